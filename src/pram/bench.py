@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""Contains the standard benchmark suite.
+
+The suite synthesizes populations of configurable size (i.e., groups, attributes, and sites), runs a set of canonical
+workloads on them, and reports iterations per second, peak memory usage, and the per-phase breakdown of computation
+time (as recorded by :class:`~pram.sim.CompInstr`).  Results are stored as JSON along with the commit and the
+environment they were obtained in so that they can be compared across commits.  The suite can be run from the command
+line::
+
+    python -m pram.bench run -o base.json
+    python -m pram.bench run -o head.json -w sir-mc probes --n-group 2000
+    python -m pram.bench cmp base.json head.json
+"""
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# Probabilitistic Relational Agent-based Models (PRAMs)
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2018-2020, momacs, University of Pittsburgh
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+import argparse
+import datetime
+import json
+import numpy as np
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+from attr        import attrs, attrib, asdict, fields
+from collections import OrderedDict
+
+from .data        import GroupSizeProbe, ProbePersistenceMem
+from .entity      import Group, Site
+from .model.epi   import SIRModel
+from .model.model import MCSolver, ODESolver
+from .rule        import GoToAndBackTimeAtRule, SegregationModel
+from .sim         import CompInstr, Simulation
+
+
+__all__ = ['BenchSpec', 'Bench', 'WORKLOADS']
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+@attrs(slots=True)
+class BenchSpec(object):
+    """Benchmark specification.
+
+    The population synthesized for every workload consists of ``n_group`` groups (fewer if the random draws happen to
+    coincide) defined by ``n_attr`` attributes with ``n_attr_val`` values each (in addition to the attributes and
+    relations the workload needs) and distributed over ``n_site`` sites.
+
+    Args:
+        n_group (int): Number of groups.
+        n_attr (int): Number of attributes.
+        n_attr_val (int): Number of values of every attribute.
+        n_site (int): Number of sites.
+        n_iter (int): Number of iterations to run every workload for.
+        n_rep (int): Number of repetitions of every workload (the fastest one is reported).
+        n_traj (int): Number of trajectories in ensemble workloads.
+        m_group (float): Maximum mass of a group (masses are drawn uniformly from ``[1, m_group]``).
+        seed (int): Random seed.
+        do_tracemalloc (bool): Record memory traced by ``tracemalloc``?  That slows Python down considerably and
+            therefore distorts time measurements.
+    """
+
+    n_group        : int   = attrib(default=500,    converter=int)
+    n_attr         : int   = attrib(default=3,      converter=int)
+    n_attr_val     : int   = attrib(default=4,      converter=int)
+    n_site         : int   = attrib(default=10,     converter=int)
+    n_iter         : int   = attrib(default=24,     converter=int)
+    n_rep          : int   = attrib(default=3,      converter=int)
+    n_traj         : int   = attrib(default=2,      converter=int)
+    m_group        : float = attrib(default=1000.0, converter=float)
+    seed           : int   = attrib(default=1234,   converter=int)
+    do_tracemalloc : bool  = attrib(default=False,  converter=bool)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+def gen_groups(spec, attr={}, rel={}):
+    """Synthesizes a population of groups.
+
+    Every group gets a random value of every one of the ``spec.n_attr`` generic attributes (named ``a0``, ``a1``, and
+    so on with values ``0`` through ``spec.n_attr_val - 1``), a random value of every one of the workload-specific
+    attributes, and a random site of every one of the workload-specific relations.  Unless the workload specifies it,
+    the ``Site.AT`` relation is set to a random site.
+
+    Args:
+        spec (BenchSpec): Benchmark specification.
+        attr (Mapping[str, Iterable[Any]]): Workload-specific attributes and their values.
+        rel (Mapping[str, Iterable[Site]]): Workload-specific relations and their sites.
+
+    Returns:
+        (list[Group], list[Site]): Groups and all sites they reference.
+    """
+
+    sites = [Site(f's{i}') for i in range(spec.n_site)]
+    rel = { Site.AT: sites, **rel }
+    attr = { **{ f'a{i}': list(range(spec.n_attr_val)) for i in range(spec.n_attr) }, **{ k: list(v) for (k,v) in attr.items() } }
+    rel  = { k: list(v) for (k,v) in rel.items() }
+
+    groups = [
+        Group(
+            m=random.uniform(1.0, spec.m_group),
+            attr={ k: random.choice(v) for (k,v) in attr.items() },
+            rel={ k: random.choice(v) for (k,v) in rel.items() }
+        )
+        for _ in range(spec.n_group)
+    ]
+
+    sites_all = { s.get_hash(): s for v in rel.values() for s in v }
+    return (groups, list(sites_all.values()))
+
+
+def _new_sim(rules, probes, groups, sites):
+    sim = Simulation()
+    sim.set_pragma_analyze(False)
+    sim.add_rules(rules)
+    sim.add_probes(probes)
+    sim.add_sites(sites)
+    sim.add_groups(groups)
+    return sim
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Workloads:
+#
+# Every workload is a function that accepts a benchmark specification and returns a list of simulations to instrument
+# and a function that runs them for the number of iterations specified.
+
+def wl_sir_mc(spec):
+    """Markov-chain SIR model."""
+
+    (groups, sites) = gen_groups(spec, attr={ 'flu': 'sir' })
+    sim = _new_sim([SIRModel('flu', 0.05, 0.10, solver=MCSolver())], [], groups, sites)
+    return ([sim], lambda: sim.run(spec.n_iter))
+
+
+def wl_sir_ode(spec):
+    """ODE SIR model (mass-level rule)."""
+
+    (groups, sites) = gen_groups(spec, attr={ 'flu': 'sir' })
+    sim = _new_sim([SIRModel('flu', 0.05, 0.10, solver=ODESolver())], [], groups, sites)
+    return ([sim], lambda: sim.run(spec.n_iter))
+
+
+def wl_go_to_and_back(spec):
+    """Agents shuttling between home and school sites (driven by the simulation time of day)."""
+
+    homes   = [Site(f'home-{i}')   for i in range(max(1, spec.n_site // 2))]
+    schools = [Site(f'school-{i}') for i in range(max(1, spec.n_site - len(homes)))]
+    (groups, sites) = gen_groups(spec, rel={ 'home': homes, 'school': schools })
+    for g in groups:
+        g.set_rel(Site.AT, g.get_rel('home'))
+    sim = _new_sim([GoToAndBackTimeAtRule(t=[8,16])], [], groups, sites)
+    return ([sim], lambda: sim.run(spec.n_iter))
+
+
+def wl_segregation(spec):
+    """Schelling-like segregation model (site mass queries and random migration)."""
+
+    (groups, sites) = gen_groups(spec, attr={ 'team': range(spec.n_attr_val) })
+    sim = _new_sim([SegregationModel('team', spec.n_attr_val)], [], groups, sites)
+    return ([sim], lambda: sim.run(spec.n_iter))
+
+
+def wl_probes(spec):
+    """Markov-chain SIR model observed by many group-size probes persisted in memory."""
+
+    (groups, sites) = gen_groups(spec, attr={ 'flu': 'sir' })
+    persistence = ProbePersistenceMem()
+    probes = (
+        [GroupSizeProbe.by_attr('flu', 'flu', list('sir'), persistence=persistence)] +
+        [GroupSizeProbe.by_attr(f'a{i}', f'a{i}', list(range(spec.n_attr_val)), persistence=persistence) for i in range(spec.n_attr)] +
+        [GroupSizeProbe.by_rel('site', Site.AT, sites, persistence=persistence)]
+    )
+    sim = _new_sim([SIRModel('flu', 0.05, 0.10, solver=MCSolver())], probes, groups, sites)
+    return ([sim], lambda: sim.run(spec.n_iter))
+
+
+def wl_ensemble(spec):
+    """An ensemble of Markov-chain SIR trajectories persisted into an in-memory database."""
+
+    from .traj import Trajectory, TrajectoryEnsemble  # the module pulls in heavy dependencies other workloads don't need
+
+    sims = []
+    for _ in range(spec.n_traj):
+        (groups, sites) = gen_groups(spec, attr={ 'flu': 'sir' })
+        sims.append(_new_sim([SIRModel('flu', 0.05, 0.10, solver=MCSolver())], [], groups, sites))
+    ens = TrajectoryEnsemble()
+    ens.add_trajectories([Trajectory(sim) for sim in sims])
+    return (sims, lambda: ens.run(spec.n_iter, is_quiet=True))
+
+
+WORKLOADS = OrderedDict([
+    ('sir-mc',         wl_sir_mc),
+    ('sir-ode',        wl_sir_ode),
+    ('go-to-and-back', wl_go_to_and_back),
+    ('segregation',    wl_segregation),
+    ('probes',         wl_probes),
+    ('ensemble',       wl_ensemble)
+])
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+class Bench(object):
+    """The benchmark suite.
+
+    Every workload is built anew (with the random number generators seeded identically) and run ``spec.n_rep`` times
+    with a :class:`~pram.sim.CompInstr` attached to each of its simulations and the fastest repetition is reported.
+    Workload construction and the simulation setup done on the first iteration are not timed separately but the
+    initial population is created outside of the timed region.
+
+    Args:
+        spec (BenchSpec, optional): Benchmark specification.
+        workloads (Iterable[str], optional): Names of workloads to run (see ``WORKLOADS``); all if None.
+    """
+
+    def __init__(self, spec=None, workloads=None):
+        self.spec = spec or BenchSpec()
+        self.workloads = list(workloads or WORKLOADS.keys())
+
+        for w in self.workloads:
+            if w not in WORKLOADS:
+                raise ValueError(f"Unknown workload: '{w}' (available: {', '.join(WORKLOADS.keys())})")
+
+    @staticmethod
+    def compare(res_a, res_b):
+        """Compares two sets of benchmark results.
+
+        Args:
+            res_a (Mapping): The baseline results (as returned by :meth:`~pram.bench.Bench.run`).
+            res_b (Mapping): The results to compare with the baseline.
+
+        Returns:
+            Mapping[str, Mapping]: For every workload present in both, iterations per second and peak RSS of both sets
+            along with the ratio of the second to the first.
+        """
+
+        ret = OrderedDict()
+        for (w,a) in res_a['res'].items():
+            b = res_b['res'].get(w)
+            if b is None:
+                continue
+            ret[w] = {
+                k: { 'a': a[k], 'b': b[k], 'ratio': (b[k] / a[k] if a[k] else None) }
+                for k in ('iter_per_s', 'mem_rss_max')
+            }
+        return ret
+
+    @staticmethod
+    def get_meta():
+        """Get information on the code and the environment benchmark results are obtained in.
+
+        Returns:
+            Mapping[str, Any]
+        """
+
+        try:
+            commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+
+        return {
+            'commit'   : commit,
+            'ts'       : datetime.datetime.now().isoformat(timespec='seconds'),
+            'python'   : platform.python_version(),
+            'numpy'    : np.__version__,
+            'platform' : platform.platform(),
+            'cpu'      : platform.processor() or platform.machine()
+        }
+
+    def run(self, is_quiet=False):
+        """Runs all workloads.
+
+        Args:
+            is_quiet (bool): Suppress progress messages?
+
+        Returns:
+            Mapping[str, Any]: Metadata (see :meth:`~pram.bench.Bench.get_meta`), the specification, and per-workload
+            results.
+        """
+
+        res = OrderedDict()
+        for w in self.workloads:
+            if not is_quiet:
+                print(f'{w}...', end='', flush=True)
+            res[w] = self.run_workload(w)
+            if not is_quiet:
+                print(f' {res[w]["iter_per_s"]:.2f} it/s')
+
+        return { 'meta': self.get_meta(), 'spec': asdict(self.spec), 'res': res }
+
+    def run_workload(self, name):
+        """Runs one workload.
+
+        Args:
+            name (str): Workload name (see ``WORKLOADS``).
+
+        Returns:
+            Mapping[str, Any]
+        """
+
+        best = None
+        t_all = []
+        for _ in range(self.spec.n_rep):
+            random.seed(self.spec.seed)
+            np.random.seed(self.spec.seed)
+
+            (sims, fn_run) = WORKLOADS[name](self.spec)
+            instrs = [CompInstr(do_tracemalloc=self.spec.do_tracemalloc) for _ in sims]
+            for (sim, instr) in zip(sims, instrs):
+                sim.set_instr(instr)
+
+            t0 = time.perf_counter()
+            fn_run()
+            t = time.perf_counter() - t0
+            t_all.append(t)
+
+            if best is None or t < best[0]:
+                best = (t, sims, instrs)
+
+        (t, sims, instrs) = best
+        arr = [i.get_arr() for i in instrs]
+        n_iter = sum(a.shape[0] for a in arr)
+        t_phase = {}
+        for i in instrs:
+            for (p,v) in i.get_t_tot().items():
+                t_phase[p] = t_phase.get(p, 0.0) + v
+
+        return {
+            'n_iter'      : n_iter,
+            't_run'       : t,
+            't_run_all'   : t_all,
+            'iter_per_s'  : (n_iter / t if t > 0 else None),
+            'mem_rss_max' : int(max(a['mem_rss'].max() for a in arr)) if n_iter > 0 else -1,
+            'mem_py_peak' : int(max(a['mem_py_peak'].max() for a in arr)) if n_iter > 0 else -1,
+            'n_group'     : sum(s.pop.get_group_cnt() for s in sims),
+            'n_site'      : sum(s.pop.get_site_cnt() for s in sims),
+            't_phase'     : { p: v / n_iter for (p,v) in t_phase.items() } if n_iter > 0 else t_phase  # [ms/iter]
+        }
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+def _print_cmp(cmp):
+    print(f'{"workload":<16} {"it/s a":>10} {"it/s b":>10} {"ratio":>7} {"rss a [MB]":>11} {"rss b [MB]":>11}')
+    for (w,c) in cmp.items():
+        r = c['iter_per_s']['ratio']
+        print(f'{w:<16} {c["iter_per_s"]["a"]:>10.2f} {c["iter_per_s"]["b"]:>10.2f} {(f"{r:.3f}" if r is not None else "-"):>7} {c["mem_rss_max"]["a"] / 2**20:>11.1f} {c["mem_rss_max"]["b"] / 2**20:>11.1f}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pram.bench', description='PRAM benchmark suite')
+    cmds = parser.add_subparsers(dest='cmd', required=True)
+
+    p_run = cmds.add_parser('run', help='run the benchmark')
+    p_run.add_argument('-w', '--workloads', nargs='+', choices=list(WORKLOADS.keys()), default=None, help='workloads to run (default: all)')
+    p_run.add_argument('-o', '--out', default=None, help='output JSON file (default: stdout)')
+    p_run.add_argument('-q', '--quiet', action='store_true', help='suppress progress messages')
+    for a in fields(BenchSpec):
+        p_run.add_argument(f'--{a.name.replace("_", "-")}', type=(int if a.type is bool else a.type), default=a.default)
+
+    p_cmp = cmds.add_parser('cmp', help='compare two result files')
+    p_cmp.add_argument('a', help='baseline results')
+    p_cmp.add_argument('b', help='results to compare')
+
+    args = parser.parse_args(argv)
+
+    if args.cmd == 'run':
+        spec = BenchSpec(**{ a.name: getattr(args, a.name) for a in fields(BenchSpec) })
+        res = Bench(spec, args.workloads).run(args.quiet or args.out is None)
+        if args.out is None:
+            json.dump(res, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.out, 'w') as f:
+                json.dump(res, f, indent=2)
+    elif args.cmd == 'cmp':
+        with open(args.a) as fa, open(args.b) as fb:
+            _print_cmp(Bench.compare(json.load(fa), json.load(fb)))
+
+
+if __name__ == '__main__':
+    main()
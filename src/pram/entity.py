@@ -17,7 +17,7 @@ import numpy as np
 import os
 import xxhash
 
-from abc             import ABC
+from abc             import abstractmethod, ABC
 from attr            import attrs, attrib, converters, validators
 from collections.abc import Iterable
 from enum            import auto, unique, IntEnum
@@ -29,11 +29,11 @@ from scipy.stats     import rv_continuous
 
 from .util import DB, Err, FS, Time
 
-__all__ = ['GroupFrozenError', 'Resource', 'Site', 'GroupQry', 'GroupSplitSpec', 'GroupDBRelSpec', 'Group']
+__all__ = ['GroupFrozenError', 'Resource', 'Site', 'GroupPred', 'AttrEq', 'AttrIn', 'AttrRange', 'HasAttr', 'HasRel', 'RelEq', 'AtSiteName', 'PredAnd', 'PredOr', 'PredNot', 'GroupQry', 'GroupSplitSpec', 'GroupDBRelSpec', 'Group']
 
 
 # ----------------------------------------------------------------------------------------------------------------------
-from collections import Mapping
+from collections.abc import Mapping
 try:
     from collections import OrderedDict
 except ImportError:
@@ -378,7 +378,7 @@ class Site(Resource):
 
     AT = '@'  # relation name for the group's current site
 
-    __slots__ = ('name', 'attr', 'rel_name', 'm', 'groups', 'hash')
+    __slots__ = ('name', 'attr', 'rel_name', 'm', 'groups', 'hash', 'cache_qry_to_groups', 'cache_qry_to_m')
 
     def __init__(self, name, attr=None, rel_name=AT, pop=None, capacity_max=1):
         super().__init__(name, capacity_max, pop)  # previously called as: (EntityType.SITE, '')
@@ -391,8 +391,8 @@ class Site(Resource):
 
         self.hash = None  # computed lazily
 
-        # self.cache_qry_to_groups = {}   # groups currently at this site
-        # self.cache_qry_to_m      = {}   # mass of population at this site
+        self.cache_qry_to_groups = {}   # groups currently at this site
+        self.cache_qry_to_m      = {}   # mass of population at this site
 
     def __eq__(self, other):
         return isinstance(self, type(other)) and (self.name == other.name) and (self.rel_name == other.rel_name) and (self.attr == other.attr)
@@ -425,9 +425,13 @@ class Site(Resource):
             ``self``
         """
 
+        if group in self.groups:
+            return self
+
         self.groups.add(group)
         # self.groups.add(group.get_hash())
         self.m += group.m
+        self.reset_cache()
         return self
 
     def ga(self, name):
@@ -479,7 +483,6 @@ class Site(Resource):
 
         return self.attr.get(name) if name is not None else self.attr
 
-    @lru_cache(maxsize=None)
     def get_groups(self, qry=None, non_empty_only=False):
         """Returns groups which currently are at this site.
 
@@ -493,37 +496,45 @@ class Site(Resource):
                 specific school (which is a restriction on the group's relation).
             non_empty_only (bool): Return only groups with non-zero agent population mass?
 
+        If the site belongs to a population, groups matching the query are looked up in the population's group
+        index (with the current-site relation added to the query).
+
         Returns:
             list[Group]: List of groups currently at this site.
 
-        Todo:
-            Implement memoization (probably of only all the groups, i.e., without accounting for the ``qry``).
+        The result is memoized until the groups at the site or their masses change.  Sites that belong to a population
+        use the population's query cache (see :class:`~pram.pop.GroupQryCache`); other sites keep their own (see
+        :meth:`~pram.entity.Site.reset_cache`).
         """
 
-        # if not qry:
-        #     groups = self.groups
-        # else:
-        #     groups = self.cache_qry_to_groups.get(qry.__hash__())
-        #     if groups is None:
-        #         groups = [g for g in self.groups if (qry.attr.items() <= g.attr.items()) and (qry.rel.items() <= g.rel.items()) and all([fn(g) for fn in qry.cond])]
-        #         # groups = []
-        #         # for gh in self.groups:
-        #         #     g = self.pop.groups[gh]
-        #         #     if (qry.attr.items() <= g.attr.items()) and (qry.rel.items() <= g.rel.items()) and all([fn(g) for fn in qry.cond]):
-        #         #         groups.append(g)
-        #         self.cache_qry_to_groups[qry.__hash__()] = groups
+        key = ('site-groups', self.get_hash(), qry, non_empty_only)
+        if self.pop is not None:
+            groups = self.pop.qry_cache.get(key)
+        else:
+            groups = self.cache_qry_to_groups.get((qry, non_empty_only))
+        if groups is not None:
+            return groups
 
         if not qry:
             groups = self.groups
+        elif self.pop is not None:
+            hashes = self.pop.group_idx.get_hashes(qry.attr, { **qry.rel, Site.AT: self.get_hash() }, qry.cond)
+            groups = [self.pop.groups[h] for h in hashes]
+            groups = [g for g in groups if (qry.attr.items() <= g.attr.items()) and (qry.rel.items() <= g.rel.items()) and all([fn(g) for fn in qry.cond])]
         else:
             groups = [g for g in self.groups if (qry.attr.items() <= g.attr.items()) and (qry.rel.items() <= g.rel.items()) and all([fn(g) for fn in qry.cond])]
 
         if non_empty_only:
-            return [g for g in groups if g.m > 0]
+            groups_all = groups
+            groups = [g for g in groups if g.m > 0]
         else:
-            return groups
+            groups_all = groups
+
+        if self.pop is not None:
+            return self.pop.qry_cache.put(key, groups, qry, groups_all, self.get_hash())
+        self.cache_qry_to_groups[(qry, non_empty_only)] = groups
+        return groups
 
-    @lru_cache(maxsize=None)
     def get_mass(self, qry=None):
         """Get the mass of groups that match the query specified.  Only groups currently residing at the site are
         searched.
@@ -535,16 +546,19 @@ class Site(Resource):
             float: Mass
         """
 
-        # if not qry:
-        #     return self.m
-        # else:
-        #     m = self.cache_qry_to_m.get(qry)
-        #     if m is None:
-        #         m = math.fsum(g.m for g in self.get_groups(qry))
-        #         self.cache_qry_to_m[qry] = m
-        #     return m
+        if self.pop is not None:
+            key = ('site-mass', self.get_hash(), qry)
+            m = self.pop.qry_cache.get(key)
+            if m is None:
+                groups = self.get_groups(qry)
+                m = self.pop.qry_cache.put(key, math.fsum(g.m for g in groups), qry, groups, self.get_hash())
+            return m
 
-        return math.fsum(g.m for g in self.get_groups(qry))
+        m = self.cache_qry_to_m.get(qry)
+        if m is None:
+            m = math.fsum(g.m for g in self.get_groups(qry))
+            self.cache_qry_to_m[qry] = m
+        return m
 
     def get_mass_prop(self, qry=None):
         """Get the proportion of the total mass accounted for the groups that match the query specified.  Only groups
@@ -573,6 +587,35 @@ class Site(Resource):
         m = self.get_mass(qry)
         return (m, m / self.m if self.m > 0 else 0)
 
+    def rem_group_link(self, group):
+        """Removes a link to a group.  Symmetrical to :meth:`~pram.entity.Site.add_group_link`.
+
+        Args:
+            group (Group): The group.
+
+        Returns:
+            ``self``
+        """
+
+        if group not in self.groups:
+            return self
+
+        self.groups.discard(group)
+        self.m -= group.m
+        self.reset_cache()
+        return self
+
+    def reset_cache(self):
+        """Resets the memoized results of group and mass queries.
+
+        Returns:
+            ``self``
+        """
+
+        self.cache_qry_to_groups = {}
+        self.cache_qry_to_m = {}
+        return self
+
     def reset_group_links(self):
         """Resets the groups located at the site and other cache and memoization data structures.
 
@@ -582,8 +625,18 @@ class Site(Resource):
 
         self.groups = set()
         self.m = 0.0
-        self.get_mass.cache_clear()
-        self.get_groups.cache_clear()
+        self.reset_cache()
+        return self
+
+    def upd_mass(self):
+        """Recomputes the mass of the site after masses of groups located at it have changed.
+
+        Returns:
+            ``self``
+        """
+
+        self.m = math.fsum(g.m for g in self.groups)
+        self.reset_cache()
         return self
 
 
@@ -709,6 +762,346 @@ class Agent(Entity):
 #     full : bool = attrib(default=False)
 
 
+# ----------------------------------------------------------------------------------------------------------------------
+class GroupPred(ABC):
+    """A declarative predicate on a group's attributes and relations.
+
+    Predicates can be used in place of callables in the ``cond`` list of a :class:`~pram.entity.GroupQry` (they are
+    callables themselves).  Unlike lambdas, predicates are compared and hashed by content, so queries that use them are
+    equal whenever they ask for the same thing and can be cached across calls and iterations.  Moreover, because a
+    predicate depends only on a group's attributes and relations (which never change once the group is part of a
+    population), it can be answered by the population's group index and needs to be tested only once per group.
+
+    Predicates are combined with the ``&``, ``|``, and ``~`` operators.  Typical usage example::
+
+        GroupQry(cond=[AttrIn('flu', ['IA', 'IS'])])                      # asymptomatic or symptomatic
+        GroupQry(cond=[AttrRange('age', 18, 65) & ~AtSiteName('home')])  # of working age and away from home
+        GroupQry(cond=[AttrEq({ 'flu': 's' }) | RelEq({ 'school': school })])
+
+    Lambdas remain allowed in ``cond`` lists alongside predicates; they are evaluated for every group every time.
+
+    Args:
+        key (tuple): The predicate's content; used for equality and hashing.  Must be hashable.
+    """
+
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = (self.__class__.__name__,) + key
+
+    def __and__(self, other):
+        return PredAnd(self, other)
+
+    @abstractmethod
+    def __call__(self, group):
+        """Checks if the group satisfies the predicate.
+
+        Args:
+            group (Group): The group.
+
+        Returns:
+            bool
+        """
+
+        pass
+
+    def __eq__(self, other):
+        return isinstance(other, GroupPred) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __invert__(self):
+        return PredNot(self)
+
+    def __or__(self, other):
+        return PredOr(self, other)
+
+    def __repr__(self):
+        return f'{self.key[0]}{self.key[1:]}'
+
+    @staticmethod
+    def _get_names_union(preds):
+        attr = set()
+        rel  = set()
+        for p in preds:
+            (a,r) = p.get_names()
+            attr.update(a)
+            rel.update(r)
+        return (attr, rel)
+
+    def get_hashes(self, idx):
+        """Get hashes of groups that may satisfy the predicate.
+
+        The set returned is a superset of groups satisfying the predicate; groups in it still need to be tested.
+
+        Args:
+            idx (GroupIndex): The population's group index.
+
+        Returns:
+            set[int]: Group hashes or None if the index can't narrow the search down.
+        """
+
+        return None
+
+    def get_names(self):
+        """Get names of attributes and relations the predicate depends on.
+
+        Returns:
+            (set[str], set[str]): Attribute names and relation names.
+        """
+
+        return (set(), set())
+
+
+class AttrEq(GroupPred):
+    """Group has all the attributes specified (see :meth:`~pram.entity.Group.has_attr`).
+
+    Args:
+        attr (Mapping[str, Any]): Attributes (i.e., name-value pairs).
+    """
+
+    __slots__ = ('attr',)
+
+    def __init__(self, attr):
+        self.attr = attr
+        super().__init__((tuple(sorted(attr.items())),))
+
+    def __call__(self, group):
+        return group.has_attr(self.attr)
+
+    def get_hashes(self, idx):
+        return idx.get_hashes(self.attr)
+
+    def get_names(self):
+        return (set(self.attr.keys()), set())
+
+
+class AttrIn(GroupPred):
+    """Group's attribute has one of the values specified.
+
+    Args:
+        name (str): Attribute's name.
+        values (Iterable[Any]): Attribute's values.
+    """
+
+    __slots__ = ('name', 'values')
+
+    def __init__(self, name, values):
+        self.name = name
+        self.values = frozenset(values)
+        super().__init__((name, self.values))
+
+    def __call__(self, group):
+        return group.get_attr(self.name) in self.values
+
+    def get_hashes(self, idx):
+        return set().union(*[idx.attr.get((self.name, v), ()) for v in self.values])
+
+    def get_names(self):
+        return ({ self.name }, set())
+
+
+class AttrRange(GroupPred):
+    """Group's numeric attribute falls into a half-open interval ``[lo, hi)``.
+
+    Args:
+        name (str): Attribute's name.
+        lo (float, optional): The lower bound (inclusive); None for no lower bound.
+        hi (float, optional): The upper bound (exclusive); None for no upper bound.
+    """
+
+    __slots__ = ('name', 'lo', 'hi')
+
+    def __init__(self, name, lo=None, hi=None):
+        self.name = name
+        self.lo = lo
+        self.hi = hi
+        super().__init__((name, lo, hi))
+
+    def __call__(self, group):
+        return self._is_in(group.get_attr(self.name))
+
+    def _is_in(self, v):
+        if isinstance(v, bool) or not isinstance(v, (int, float)):
+            return False
+        return (self.lo is None or v >= self.lo) and (self.hi is None or v < self.hi)
+
+    def get_hashes(self, idx):
+        return set().union(*[h for ((k,v),h) in idx.attr.items() if k == self.name and self._is_in(v)])
+
+    def get_names(self):
+        return ({ self.name }, set())
+
+
+class HasAttr(GroupPred):
+    """Group has the attributes specified irrespective of their values (see :meth:`~pram.entity.Group.has_attr`).
+
+    Args:
+        names (Iterable[str]): Attributes' names.
+    """
+
+    __slots__ = ('names',)
+
+    def __init__(self, names):
+        self.names = tuple(sorted(set(names)))
+        super().__init__(self.names)
+
+    def __call__(self, group):
+        return group.has_attr(list(self.names))
+
+    def get_hashes(self, idx):
+        names = set(self.names)
+        return set().union(*[h for ((k,v),h) in idx.attr.items() if k in names])
+
+    def get_names(self):
+        return (set(self.names), set())
+
+
+class HasRel(GroupPred):
+    """Group has the relations specified irrespective of the sites they point to (see
+    :meth:`~pram.entity.Group.has_rel`).
+
+    Args:
+        names (Iterable[str]): Relations' names.
+    """
+
+    __slots__ = ('names',)
+
+    def __init__(self, names):
+        self.names = tuple(sorted(set(names)))
+        super().__init__(self.names)
+
+    def __call__(self, group):
+        return group.has_rel(list(self.names))
+
+    def get_hashes(self, idx):
+        names = set(self.names)
+        return set().union(*[h for ((k,v),h) in idx.rel.items() if k in names])
+
+    def get_names(self):
+        return (set(), set(self.names))
+
+
+class RelEq(GroupPred):
+    """Group has all the relations specified (see :meth:`~pram.entity.Group.has_rel`).
+
+    Args:
+        rel (Mapping[str, Site]): Relations (i.e., name-site pairs).
+    """
+
+    __slots__ = ('rel',)
+
+    def __init__(self, rel):
+        self.rel = { k: v.get_hash() if isinstance(v, Site) else v for (k,v) in rel.items() }
+        super().__init__((tuple(sorted(self.rel.items())),))
+
+    def __call__(self, group):
+        return group.has_rel(self.rel)
+
+    def get_hashes(self, idx):
+        return idx.get_hashes(rel=self.rel)
+
+    def get_names(self):
+        return (set(), set(self.rel.keys()))
+
+
+class AtSiteName(GroupPred):
+    """Group is currently at the site it has as the relation specified (see :meth:`~pram.entity.Group.is_at_site_name`).
+
+    Args:
+        name (str): Relation's name (e.g., ``home``).
+    """
+
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+        super().__init__((name,))
+
+    def __call__(self, group):
+        return group.is_at_site_name(self.name)
+
+    def get_hashes(self, idx):
+        return set().union(*[h & idx.rel.get((Site.AT, v), set()) for ((k,v),h) in idx.rel.items() if k == self.name])
+
+    def get_names(self):
+        return (set(), { self.name, Site.AT })
+
+
+class PredAnd(GroupPred):
+    """All of the predicates specified hold.
+
+    Args:
+        *preds (GroupPred): The predicates.
+    """
+
+    __slots__ = ('preds',)
+
+    def __init__(self, *preds):
+        self.preds = preds
+        super().__init__(preds)
+
+    def __call__(self, group):
+        return all(p(group) for p in self.preds)
+
+    def get_hashes(self, idx):
+        sets = [s for s in (p.get_hashes(idx) for p in self.preds) if s is not None]
+        if len(sets) == 0:
+            return None
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+
+    def get_names(self):
+        return GroupPred._get_names_union(self.preds)
+
+
+class PredOr(GroupPred):
+    """Any of the predicates specified holds.
+
+    Args:
+        *preds (GroupPred): The predicates.
+    """
+
+    __slots__ = ('preds',)
+
+    def __init__(self, *preds):
+        self.preds = preds
+        super().__init__(preds)
+
+    def __call__(self, group):
+        return any(p(group) for p in self.preds)
+
+    def get_hashes(self, idx):
+        sets = [p.get_hashes(idx) for p in self.preds]
+        if any(s is None for s in sets):
+            return None
+        return set().union(*sets)
+
+    def get_names(self):
+        return GroupPred._get_names_union(self.preds)
+
+
+class PredNot(GroupPred):
+    """The predicate specified does not hold.
+
+    Args:
+        pred (GroupPred): The predicate.
+    """
+
+    __slots__ = ('pred',)
+
+    def __init__(self, pred):
+        self.pred = pred
+        super().__init__((pred,))
+
+    def __call__(self, group):
+        return not self.pred(group)
+
+    def get_names(self):
+        return self.pred.get_names()
+
+
 # ----------------------------------------------------------------------------------------------------------------------
 class GroupQry(object):
     """A group query.
@@ -726,6 +1119,13 @@ class GroupQry(object):
         GroupQry(cond=[lambda g: g.get_attr('x') > 100 and g.get_attr('y') ==  200]))       # explicit AND condition between attributes
         GroupQry(cond=[lambda g: g.get_attr('x') > 100 or  g.get_attr('y') == -200]))       # explicit OR  condition between attributes
 
+    The same conditions are better expressed with predicates (see :class:`~pram.entity.GroupPred`) which can be answered
+    by the population's group index and keep the query hashable by content::
+
+        GroupQry(cond=[AttrRange('x', 100)])                             # with attribute 'x' >= 100
+        GroupQry(cond=[AttrRange('x', 100) & AttrEq({ 'y': 200 })])     # with attribute 'x' >= 100 and 'y' == 200
+        GroupQry(cond=[AttrRange('x', 100) | AttrEq({ 'y': -200 })])    # with attribute 'x' >= 100 or  'y' == -200
+
     Group query objects do not have any utility outside of a simulation context (which implies population bound groups)
     and consequently won't play well with standalong groups because all Site references are turned into their hashes
     (which is what a GroupPopulation object operates on internally).
@@ -736,7 +1136,8 @@ class GroupQry(object):
         cond (Iterable(Callable)): Conditions on group's attributes and relations.  These conditions are given as
             callables which take one argument, the group.  Assuming the group argument is ``g``, the callables can then
             access the group's attributes and relations respectively as ``g.attr`` and ``g.rel``.  See the typical
-            usage examples above.
+            usage examples above.  :class:`~pram.entity.GroupPred` predicates are callables too and should be
+            preferred.
         full (bool): Does the match need to be full?  To satisfy a full match, a group's attributes and relations need
             to fully match the query.  Because PRAM cannot have two groups with the same attributes and relations, it
             follows that a full match can either return one group on no groups (if no match exists).  A partial match
@@ -780,9 +1181,37 @@ class GroupQry(object):
 
         # return xxhash.xxh64(json.dumps((attr, rel, str([inspect.getsource(i) for i in cond]), full), sort_keys=True)).intdigest()  # when using non-encoded attr and rel
 
-        return xxhash.xxh64(pickle.dumps((attr, rel, str([inspect.getsource(i) for i in cond]), full))).intdigest()  # when using encoded attr and rel
+        return xxhash.xxh64(pickle.dumps((attr, rel, str([repr(i) if isinstance(i, GroupPred) else inspect.getsource(i) for i in cond]), full))).intdigest()  # when using encoded attr and rel
         # return xxhash.xxh64(json.dumps((attr, rel, str([inspect.getsource(i) for i in cond]), full), cls=EntityJSONEncoder)).intdigest()  # when using encoded attr and rel
 
+    def get_names(self):
+        """Get names of attributes and relations the query depends on.
+
+        Names referenced inside of conditions that aren't :class:`~pram.entity.GroupPred` predicates cannot be known
+        and are not included (see :meth:`~pram.entity.GroupQry.is_transparent`).
+
+        Returns:
+            (set[str], set[str]): Attribute names and relation names.
+        """
+
+        attr = set(self.attr.keys())
+        rel  = set(self.rel.keys())
+        for c in self.cond:
+            if isinstance(c, GroupPred):
+                (a,r) = c.get_names()
+                attr.update(a)
+                rel.update(r)
+        return (attr, rel)
+
+    def is_transparent(self):
+        """Checks if all attributes and relations the query depends on are known (i.e., it has no lambda conditions).
+
+        Returns:
+            bool
+        """
+
+        return all(isinstance(c, GroupPred) for c in self.cond)
+
     # def toJson(self):
     #     # return json.dumps(self, default=lambda o: o.__dict__)
     #     return json.dumps(self.hash)
@@ -927,6 +1356,8 @@ class Group(Entity):
 
     VOID = { '__void__': True }  # all groups with this attribute are removed at the end of every iteration
 
+    ITEM_HASHES_SIZE = 2 ** 16  # maximum number of interned hashes of individual attributes and relations (see gen_item_hash())
+
     attr_used = None  # a set of attribute that has been conditioned on by at least one rule
     rel_used  = None  # ^ for relations
         # both of the above should be kept None unless a simulation is running and the dynamic rule analysis
@@ -966,10 +1397,7 @@ class Group(Entity):
 
     def __hash__(self):
         if self.hash is None:
-            if self.is_enc:
-                self.hash = Group.gen_hash(self.attr_enc, self.rel_enc)
-            else:
-                self.hash = Group.gen_hash(self.attr, self.rel)
+            self.hash = Group.gen_hash(self.attr, self.rel)  # encoded attr and rel are population-specific
         return self.hash
 
     def __repr__(self):
@@ -1134,7 +1562,7 @@ class Group(Entity):
 
         raise Err.type('qry', 'dictionary, Iterable, or string')
 
-    def apply_rules(self, pop, rules, iter, t, is_rule_setup=False, is_rule_cleanup=False, is_sim_setup=False):
+    def apply_rules(self, pop, rules, iter, t, is_rule_setup=False, is_rule_cleanup=False, is_sim_setup=False, are_applicable=False):
         """Applies all the simulation rules to the group.
 
         Applies the list of rules, each of which may split the group into (possibly already extant) subgroups.  A
@@ -1162,6 +1590,8 @@ class Group(Entity):
             is_rule_setup (bool): Is this invocation of this method during rule setup stage of the simulation?
             is_rule_cleanup (bool): Is this invocation of this method during rule cleanup stage of the simulation?
             is_sim_setup (bool): Is this invocation of this method during simulation setup stage?
+            are_applicable (bool): Have the rules been verified to be applicable to the group already?  If so, their
+                applicability isn't checked again.
 
         Todo:
             Think if the dependencies between rules could (or perhaps even should) be read from some sort of a graph.
@@ -1199,41 +1629,105 @@ class Group(Entity):
             ss_rules = [r.cleanup(pop, self) for r in rules]
         elif is_sim_setup:
             ss_rules = [rules(pop, self)]
+        elif pop.instr is not None:  # same as below, but the time spent is attributed to computational phases
+            phase = pop.instr.switch(pop.instr.RULE_APPLICABLE)
+            if not are_applicable:
+                rules = [r for r in rules if r.is_applicable(self, iter, t)]
+            pop.instr.switch(pop.instr.RULE_APPLY)
+            ss_rules = [r.apply(pop, self, iter, t) for r in rules]
+            pop.instr.switch(pop.instr.SPLIT)
+            try:
+                return self._apply_rules__split(ss_rules)
+            finally:
+                pop.instr.switch(phase)
+        elif are_applicable:
+            ss_rules = [r.apply(pop, self, iter, t) for r in rules]
         else:
             ss_rules = [r.apply(pop, self, iter, t) for r in rules if r.is_applicable(self, iter, t)]
 
+        return self._apply_rules__split(ss_rules)
+
+    def _apply_rules__split(self, ss_rules):
+        """Splits the group according to the split specs returned by rules.  Called by
+        :meth:`~pram.entity.Group.apply_rules`.
+
+        When several rules split the group, the Cartesian product of their split specs is formed (rule independence is
+        assumed).  That product can grow quickly so it is pruned and merged before any group is instantiated.  First,
+        the probability of the last split spec of every rule is complemented (as :meth:`~pram.entity.Group.split`
+        does) and zero-probability split specs are dropped; this prunes entire branches of the product.  Second, the
+        product is built on light-weight tuples instead of :class:`~pram.entity.GroupSplitSpec` objects.  Third,
+        combinations that lead to the same destination group (as established by that group's hash) are merged and
+        their probabilities summed.  Only the merged combinations are turned into split specs.
+
+        Merging is only done when the fractional mass pragma is on.  With integer mass, every combination is rounded
+        separately (see :meth:`~pram.entity.Group.split`) and merging them first would change the result of rounding
+        (and thus the simulation outcome).  In that mode, the (pruned) product is therefore split as is and the
+        probabilities the rules returned are used without being complemented.  Pruning is safe in both modes because a
+        zero-mass combination doesn't change the rounding of the others.
+
+        Args:
+            ss_rules (Iterable[Iterable[GroupSplitSpec]]): Split specs returned by every rule applied (None for rules
+                that don't split the group).
+
+        Returns:
+            list[Group]: The groups the group is split into; None if no rule split the group.
+        """
+
         ss_rules = [i for i in ss_rules if i is not None]
         if len(ss_rules) == 0:
             return None
 
-        # (2) Create a Cartesian product of the split specs (ss):
-        ss_prod = []
-        for ss_lst in itertools.product(*ss_rules):
-            ss_comb = GroupSplitSpec(p=1.0, attr_set={}, attr_del=set(), rel_set={}, rel_del=set())  # the combined split spec
-            for i in ss_lst:
-                ss_comb.p *= i.p  # this assumes rule independence
-
-                # for k,v_new in i.attr_set.items():
-                #     v_curr = ss_comb.attr_set.get(k)
-                #     if v_curr is None:
-                #         ss_comb.attr_set[k] = v_new
-                #     else:
-                #         if isinstance(v_curr, int) or isinstance(v_curr, float):
-                #             ss_comb.attr_set[k] = ss_comb.attr_set[k] + v_new
-                #         elif isinstance(v_curr, bool):
-                #             ss_comb.attr_set[k] = ss_comb.attr_set[k] and v_curr  # TODO: allow 'or'
-                #         else:
-                #             if v_new != v_curr:
-                #                 raise ValueError(f'The result of rule application results in an attribute update conflict:\n    Name: {k}\n    Type: {type(v_curr)}\n    Current value: {v_curr}\n    New value: {v_new}')
-
-                ss_comb.attr_set.update(i.attr_set)  # this update has been subsistuted by the logic above (currently commented out)
-                ss_comb.attr_del.update(i.attr_del)
-                ss_comb.rel_set.update(i.rel_set)
-                ss_comb.rel_del.update(i.rel_del)
-            ss_prod.append(ss_comb)
-
-        # (3) Split the group:
-        return self.split(ss_prod)
+        is_mass_frac = self.pop.sim.get_pragma_fractional_mass()
+
+        # (1) Complement the last probability and drop zero-probability split specs (ss) of every rule:
+        ss_rules_nz = []
+        for ss_lst in ss_rules:
+            ss_nz = []
+            p_sum = 0.0
+            for (i,s) in enumerate(ss_lst):
+                p = s.p if i < len(ss_lst) - 1 else max(1.0 - p_sum, 0.0)
+                p_sum += p
+                if p > 0:
+                    ss_nz.append((p if is_mass_frac else s.p, s))
+            ss_rules_nz.append(ss_nz)
+
+        # (2) Create a Cartesian product of the split specs:
+        ss_prod = [(1.0, {}, frozenset(), {}, frozenset())]  # (p, attr_set, attr_del, rel_set, rel_del)
+        for ss_nz in ss_rules_nz:
+            ss_prod = [
+                (
+                    p_comb * p,  # this assumes rule independence
+                    { **attr_set, **s.attr_set } if len(s.attr_set) > 0 else attr_set,
+                    attr_del | s.attr_del        if len(s.attr_del) > 0 else attr_del,
+                    { **rel_set,  **s.rel_set  } if len(s.rel_set)  > 0 else rel_set,
+                    rel_del  | s.rel_del         if len(s.rel_del)  > 0 else rel_del
+                )
+                for (p_comb, attr_set, attr_del, rel_set, rel_del) in ss_prod
+                for (p,s) in ss_nz
+            ]
+
+        # (3) Merge combinations that lead to the same group:
+        if not is_mass_frac:
+            return self.split([
+                GroupSplitSpec(p=p, attr_set=attr_set, attr_del=set(attr_del), rel_set=rel_set, rel_del=set(rel_del))
+                for (p, attr_set, attr_del, rel_set, rel_del) in ss_prod
+            ])
+
+        h_self = self.get_hash()
+        ss_dst = {}  # hash of the destination group --> combined split spec
+        for (p, attr_set, attr_del, rel_set, rel_del) in ss_prod:
+            rel_set_h = { k: (v.get_hash() if isinstance(v, Entity) else v) for (k,v) in rel_set.items() }
+            h = Group.gen_hash_upd(h_self, self.attr, attr_set,  attr_del)
+            h = Group.gen_hash_upd(h,      self.rel,  rel_set_h, rel_del, True)
+
+            ss = ss_dst.get(h)
+            if ss is None:
+                ss_dst[h] = GroupSplitSpec(p=p, attr_set=attr_set, attr_del=set(attr_del), rel_set=rel_set, rel_del=set(rel_del))
+            else:
+                ss.p = min(ss.p + p, 1.0)
+
+        # (4) Split the group:
+        return self.split(list(ss_dst.values()))
 
     def copy(self, is_deep=False):
         """Generates the group's hash.
@@ -1483,6 +1977,12 @@ class Group(Entity):
         Generates a hash for the attributes and relations dictionaries.  A hash over those two dictionaries is needed
         because groups are judged functionally equivalent based on the content of those two dictionaries alone.
 
+        The hash is the XOR of the hashes of individual attributes and relations (see
+        :meth:`~pram.entity.Group.gen_item_hash`).  Consequently, it does not depend on the order of items in the
+        dictionaries and the hash of a group that differs from another group by a few attributes or relations can be
+        derived from that other group's hash without serializing anything (see
+        :meth:`~pram.entity.Group.gen_hash_upd`).
+
         The following non-cryptographic hashing algorithms have been tested:
 
         - hash()
@@ -1511,7 +2011,76 @@ class Group(Entity):
         # return xxhash.xxh32(json.dumps((attr, rel), sort_keys=True, cls=EntityJSONEncoder)).hexdigest()
 
         # return xxhash.xxh64(json.dumps((attr, rel), sort_keys=True, cls=EntityJSONEncoder)).intdigest()  # when using non-encoded attr and rel
-        return xxhash.xxh64(pickle.dumps((attr, rel))).intdigest()  # when using encoded attr and rel
+        # return xxhash.xxh64(pickle.dumps((attr, rel))).intdigest()  # when using encoded attr and rel
+
+        h = 0
+        for (k,v) in attr.items():
+            h ^= Group.gen_item_hash(k, v)
+        for (k,v) in rel.items():
+            h ^= Group.gen_item_hash(k, v, True)
+        return h
+
+    @staticmethod
+    def gen_hash_upd(h, d_in, d_upd=None, k_del=None, is_rel=False):
+        """Updates a group's hash to reflect changes to the group's attributes or relations.
+
+        The changes are specified in the same way as for :meth:`~pram.entity.Group.gen_dict` and the result is the
+        hash of the dictionary that method would return.  The cost is proportional to the number of changes and not to
+        the size of the dictionary.
+
+        Args:
+            h (int): The group's hash.
+            d_in (Mapping[str, Any]): The group's attributes or relations.
+            d_upd (Mapping[str, Any], optional): Key-values to be set.
+            k_del (Iterable[str], optional): Keys to be removed.
+            is_rel (bool): Are these relations (as opposed to attributes)?
+
+        Returns:
+            int: The updated hash.
+        """
+
+        if d_upd is not None:
+            for (k,v) in d_upd.items():
+                if k in d_in:
+                    h ^= Group.gen_item_hash(k, d_in[k], is_rel)
+                h ^= Group.gen_item_hash(k, v, is_rel)
+
+        if k_del is not None:
+            for k in k_del:
+                if d_upd is not None and k in d_upd:
+                    h ^= Group.gen_item_hash(k, d_upd[k], is_rel)
+                elif k in d_in:
+                    h ^= Group.gen_item_hash(k, d_in[k], is_rel)
+
+        return h
+
+    @staticmethod
+    @lru_cache(maxsize=ITEM_HASHES_SIZE, typed=True)  # typed keeps e.g. 1, 1.0, and True apart
+    def _gen_item_hash(k, v, is_rel):
+        return xxhash.xxh64(pickle.dumps((is_rel, k, v))).intdigest()
+
+    @staticmethod
+    def gen_item_hash(k, v, is_rel=False):
+        """Generates the hash of a single attribute or relation.
+
+        Hashes are interned so every distinct attribute or relation is serialized and hashed only once for as long as
+        it remains among the ``ITEM_HASHES_SIZE`` most recently used ones; the table is bounded so that long runs which
+        keep producing new attribute values (e.g., counters or time stamps) don't grow it indefinitely.  Unhashable
+        values (e.g., lists) are hashed every time.
+
+        Args:
+            k (str): Name.
+            v (Any): Value.
+            is_rel (bool): Is this a relation (as opposed to an attribute)?
+
+        Returns:
+            int
+        """
+
+        try:
+            return Group._gen_item_hash(k, v, is_rel)
+        except TypeError:
+            return xxhash.xxh64(pickle.dumps((is_rel, k, v))).intdigest()
 
     def get_attr(self, name):
         """Retrieves an attribute's value.
@@ -1864,11 +2433,12 @@ class Group(Entity):
         Complementing of the last one of those probabilities is done automatically (i.e., it does not need to be
         provided and is in fact outright ignored).
 
-        A note on performance.  The biggest performance hit is likley going to be generating a hash which happens as
-        part of instantiating a new Group object.  While this may seem like a good reason to avoid crearing new groups,
-        that line of reasoning is deceptive in that a group's hash is needed regardless.  Other than that, a group
-        object is light so its impact on performance should be negligible.  Furthermore, this also grants access to
-        full functionality of the Group class to any function that uses the result of the present method.
+        A note on performance.  The hash of every new group is derived from the current group's hash and the split
+        spec alone (see :meth:`~pram.entity.Group.gen_hash_upd`).  New groups that already exist in the population share
+        that existing group's attributes and relations dictionaries so that only the groups that are truly new have
+        their dictionaries built.  Other than that, a group object is light so its impact on performance should be
+        negligible.  Furthermore, this also grants access to full functionality of the Group class to any function that
+        uses the result of the present method.
 
         Args:
             specs (Iterable[GroupSplitSpec]): Group split specs.
@@ -1917,8 +2487,16 @@ class Group(Entity):
                     rel_set[k] = v
 
             # Instantiate the new group:
-            attr = Group.gen_dict(self.attr, s.attr_set, s.attr_del)
-            rel  = Group.gen_dict(self.rel,  rel_set,    s.rel_del)  # add is_rel=False
+            h = Group.gen_hash_upd(self.get_hash(), self.attr, s.attr_set, s.attr_del)
+            h = Group.gen_hash_upd(h,               self.rel,  rel_set,    s.rel_del, True)
+
+            g = self.pop.groups.get(h)
+            if g is not None:  # reuse the existing group's definition
+                attr = g.attr
+                rel  = g.rel
+            else:
+                attr = Group.gen_dict(self.attr, s.attr_set, s.attr_del)
+                rel  = Group.gen_dict(self.rel,  rel_set,    s.rel_del)  # add is_rel=False
 
             # g = Group('{}.{}'.format(self.name, i), m, attr, rel)
             # if g == self:
@@ -1926,7 +2504,9 @@ class Group(Entity):
             # groups.append(g)
 
             # groups.append(Group(None, m, attr, rel))  # None means we do not use group names any more
-            groups.append(Group(self.name, m, attr, rel))  # use the same group name
+            g = Group(self.name, m, attr, rel)  # use the same group name
+            g.hash = h
+            groups.append(g)
 
         return groups
 
@@ -1,20 +1,25 @@
 # -*- coding: utf-8 -*-
 """Contains PRAM group and agent populations code."""
 
+import copy
 import json
 import math
+import multiprocessing
+import numpy as np
+import pickle
+import random
 import xxhash
 
 from attr            import attrs, attrib
-from collections     import deque
+from collections     import deque, OrderedDict
 from collections.abc import Iterable
 from dotmap          import DotMap
-from functools       import lru_cache
+from scipy.sparse    import csr_matrix
 
 from .data   import GroupProbe
-from .entity import Entity, Group, GroupQry, Resource, Site, EntityJSONEncoder
+from .entity import Entity, Group, GroupPred, GroupQry, Resource, Site, EntityJSONEncoder
 
-__all__ = ['MassFlowSpec', 'GroupPopulation', 'GroupPopulationHistory']
+__all__ = ['MassFlowSpec', 'GroupMassVector', 'GroupQryPlan', 'GroupQryCache', 'RuleCompatTable', 'GroupPopulation', 'GroupPopulationHistory']
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -35,6 +40,31 @@ class MassFlowSpec(object):
     src   : Group = attrib()
     dst   : list  = attrib(factory=list)
 
+    @staticmethod
+    def to_sparse(mass_flow_specs):
+        """Converts mass flow specs into a compact numeric representation.
+
+        Every destination group of every mass flow spec becomes one (source group hash, destination group hash, mass)
+        triplet.  Unlike the specs themselves, the triplets do not reference any group objects and are therefore cheap
+        to pickle and ship between processes.
+
+        Args:
+            mass_flow_specs (Iterable[MassFlowSpec]): Mass flow specs.
+
+        Returns:
+            (numpy.ndarray, numpy.ndarray, numpy.ndarray): Source group hashes, destination group hashes (both of the
+            ``uint64`` type), and masses.
+        """
+
+        src, dst, m = [], [], []
+        for mfs in mass_flow_specs:
+            h = mfs.src.get_hash()
+            for g in mfs.dst:
+                src.append(h)
+                dst.append(g.get_hash())
+                m.append(g.m)
+        return (np.array(src, dtype=np.uint64), np.array(dst, dtype=np.uint64), np.array(m, dtype=float))
+
 
 # ----------------------------------------------------------------------------------------------------------------------
 class Population(object):
@@ -239,6 +269,623 @@ class AttrRelEncoder(object):
         return self.encode_dict(rel, self.rel_k2i, self.rel_v2i, self.rel_i2k, self.rel_i2v)
 
 
+# ----------------------------------------------------------------------------------------------------------------------
+class GroupIndex(object):
+    """Inverted index of groups by their attributes and relations.
+
+    Every attribute (i.e., a name-value pair) and every relation (i.e., a name-site hash pair) is mapped to the set of
+    hashes of groups that have it.  Groups that match a conjunctive group query are then found by intersecting those
+    sets instead of testing every group in the population.  Attributes with unhashable values (e.g., lists) are not
+    indexed; queries that refer to such values cannot be answered by the index.
+    """
+
+    def __init__(self):
+        self.attr = {}  # (name, value) to hashes of groups
+        self.rel  = {}  # (name, site hash) to hashes of groups
+
+    def __len__(self):
+        return len(self.attr) + len(self.rel)
+
+    @staticmethod
+    def _add(idx, d, h):
+        for item in d.items():
+            try:
+                s = idx.get(item)
+            except TypeError:  # unhashable value
+                continue
+            if s is None:
+                idx[item] = { h }
+            else:
+                s.add(h)
+
+    @staticmethod
+    def _rem(idx, d, h):
+        for item in d.items():
+            try:
+                s = idx.get(item)
+            except TypeError:  # unhashable value
+                continue
+            if s is not None:
+                s.discard(h)
+                if len(s) == 0:
+                    del idx[item]
+
+    def add_group(self, group):
+        """Adds a group to the index.
+
+        Args:
+            group (Group): The group.
+
+        Returns:
+            ``self``
+        """
+
+        h = group.get_hash()
+        self.__class__._add(self.attr, group.attr, h)
+        self.__class__._add(self.rel,  group.rel,  h)
+        return self
+
+    def get_hashes(self, attr={}, rel={}, cond=[]):
+        """Get hashes of groups that have all the attributes and relations specified.
+
+        Conditions that are :class:`~pram.entity.GroupPred` predicates narrow the result down further; other
+        conditions (e.g., lambdas) are ignored and need to be tested by the caller.
+
+        Args:
+            attr (Mapping[str, Any]): Attributes.
+            rel (Mapping[str, int]): Relations (with site hashes as values).
+            cond (Iterable[Callable]): Query conditions.
+
+        Returns:
+            set[int]: Group hashes or None if the index can't answer (i.e., nothing has been specified or an
+                unhashable value has been specified).
+        """
+
+        sets = []
+        for (idx, d) in ((self.attr, attr), (self.rel, rel)):
+            for item in d.items():
+                try:
+                    s = idx.get(item)
+                except TypeError:
+                    return None
+                if s is None:
+                    return set()
+                sets.append(s)
+
+        for c in cond:
+            if isinstance(c, GroupPred):
+                s = c.get_hashes(self)
+                if s is not None:
+                    sets.append(s)
+
+        if len(sets) == 0:
+            return None
+
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+
+    def rem_group(self, group):
+        """Removes a group from the index.
+
+        Args:
+            group (Group): The group.
+
+        Returns:
+            ``self``
+        """
+
+        h = group.get_hash()
+        self.__class__._rem(self.attr, group.attr, h)
+        self.__class__._rem(self.rel,  group.rel,  h)
+        return self
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+class GroupMassVector(object):
+    """Group masses stored in a contiguous array indexed by stable group IDs.
+
+    Every group gets an integer ID when it is first added and keeps it for as long as it remains in the population (IDs
+    of removed groups are not reused).  The mass of the group with ID ``i`` is stored in ``self.m[i]``.  This enables
+    the mass transfer of an entire iteration to be computed as one sparse matrix-vector product instead of per-group
+    updates.  The ``m`` instance variable of every Group object is kept in sync with the array so that rules and probes
+    can continue to use it.
+
+    Args:
+        size (int): Initial capacity of the mass array.  The array is grown geometrically as groups are added.
+    """
+
+    def __init__(self, size=1024):
+        self.ids = {}     # group hash to group ID
+        self.groups = []  # group ID to Group (None for groups that have been removed)
+        self.m = np.zeros(max(size, 1), dtype=np.float64)  # group masses
+
+    def __len__(self):
+        return len(self.groups)
+
+    def add_group(self, group):
+        """Adds a group unless it already has an ID.
+
+        Args:
+            group (Group): The group.
+
+        Returns:
+            int: The group's ID.
+        """
+
+        h = group.get_hash()
+        i = self.ids.get(h)
+        if i is not None:
+            return i
+
+        i = len(self.groups)
+        if i >= self.m.shape[0]:
+            self.m = np.concatenate((self.m, np.zeros(self.m.shape[0], dtype=np.float64)))
+
+        self.ids[h] = i
+        self.groups.append(group)
+        self.m[i] = group.m
+        return i
+
+    def get_id(self, group_hash):
+        """Get the ID of the group with the hash specified.
+
+        Args:
+            group_hash (int): The group's hash.
+
+        Returns:
+            int: The group's ID or None if the group is not in the array.
+        """
+
+        return self.ids.get(group_hash)
+
+    def get_mass(self):
+        """Get the masses of all groups.
+
+        Returns:
+            numpy.ndarray: A view of the mass array (removed groups have zero mass).
+        """
+
+        return self.m[:len(self.groups)]
+
+    def inc_mass(self, group_hash, m):
+        """Increments the mass of the designated group.
+
+        Args:
+            group_hash (int): The group's hash.
+            m (float): The mass to add.
+
+        Returns:
+            ``self``
+        """
+
+        i = self.ids[group_hash]
+        self.m[i] += m
+        self.groups[i].m = float(self.m[i])
+        return self
+
+    def rem_group(self, group_hash):
+        """Removes the designated group.
+
+        The group's ID is retired and its mass is set to zero.
+
+        Args:
+            group_hash (int): The group's hash.
+
+        Returns:
+            ``self``
+        """
+
+        i = self.ids.pop(group_hash, None)
+        if i is not None:
+            self.groups[i] = None
+            self.m[i] = 0.0
+        return self
+
+    def transfer(self, src, dst, p, do_round=False):
+        """Transfers mass as a sparse matrix-vector product.
+
+        The three arguments are parallel sequences of triplets.  Every triplet moves the proportion ``p`` of the mass
+        of the ``src`` group to the ``dst`` group.  The mass of all source groups is reset before the transfer.  All
+        other groups keep their mass.
+
+        Args:
+            src (Iterable[int]): IDs of source groups.
+            dst (Iterable[int]): IDs of destination groups.
+            p (Iterable[float]): Proportions of source groups' mass to move.
+            do_round (bool): Round the resulting masses of destination groups to integers?
+
+        Returns:
+            float: The total mass transferred.
+        """
+
+        n = len(self.groups)
+        src = np.asarray(src, dtype=np.int64)
+        dst = np.asarray(dst, dtype=np.int64)
+        p   = np.asarray(p,   dtype=np.float64)
+
+        m0 = self.m[:n]
+        t = csr_matrix((p, (dst, src)), shape=(n,n))  # duplicate entries are summed
+        m_flow = t.dot(m0)
+
+        m1 = m0.copy()
+        m1[src] = 0.0
+        m1 += m_flow
+        if do_round:
+            m1[dst] = np.rint(m1[dst])  # undo floating-point error of the proportions derived from rounded masses
+        self.m[:n] = m1
+
+        for i in np.union1d(src, dst):
+            g = self.groups[i]
+            if g is not None:
+                g.m = float(m1[i])
+
+        return float(m_flow.sum())
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+class GroupQryPlan(object):
+    """A set of group queries evaluated jointly in a single pass over a group population.
+
+    Answering group queries one by one (e.g., with :meth:`~pram.pop.GroupPopulation.get_groups_mass`) costs one scan of
+    the population per query.  A plan visits every group once and adds its mass to the bucket of every query the group
+    matches.  Because attributes and relations of a group never change once it is part of a population, the attribute
+    and relation part of every query (along with its :class:`~pram.entity.GroupPred` conditions) is tested only once per
+    group and the outcome is remembered; only the remaining query conditions (e.g., lambdas) are evaluated anew every
+    time.  If the population keeps group masses in a :class:`~pram.pop.GroupMassVector`, the
+    masses of all groups matching a query are gathered from the mass array in one go.
+
+    Masses are summed with ``math.fsum()``, which is exact and independent of the order of summation, so the results are
+    identical to those of evaluating every query separately.
+
+    Args:
+        queries (Iterable[GroupQry]): The queries.  Duplicates are evaluated once and None stands for the entire
+            population.
+    """
+
+    def __init__(self, queries):
+        self.qrys = list(dict.fromkeys(queries))
+        self.qrys_static = [GroupQry(q.attr, dict(q.rel), [c for c in q.cond if isinstance(c, GroupPred)], q.full) if q is not None else None for q in self.qrys]  # only predicate conditions kept
+        self.qrys_cond   = [[c for c in q.cond if not isinstance(c, GroupPred)] if q is not None else [] for q in self.qrys]  # the remaining conditions
+
+        self.grp_qrys = {}  # group hash to indices of queries the group statically matches
+
+        self.vec = None  # the GroupMassVector the group IDs below refer to
+        self.vec_n = 0   # number of group IDs in that vector that have been classified already
+        self.vec_ids = [np.empty(0, dtype=np.int64) for _ in self.qrys]  # query index to IDs of groups statically matching it
+
+    def __len__(self):
+        return len(self.qrys)
+
+    def _get_qry_idx(self, group):
+        """Get indices of queries the group matches statically (i.e., irrespective of query conditions)."""
+
+        return [i for (i,q) in enumerate(self.qrys_static) if group.matches_qry(q)]
+
+    def _upd_vec_ids(self, vec):
+        """Classifies groups added to the mass vector since the last call."""
+
+        if vec is not self.vec:
+            self.vec = vec
+            self.vec_n = 0
+            self.vec_ids = [np.empty(0, dtype=np.int64) for _ in self.qrys]
+
+        n = len(vec)
+        if self.vec_n == n:
+            return
+
+        ids = [[] for _ in self.qrys]
+        for j in range(self.vec_n, n):
+            g = vec.groups[j]
+            if g is None:
+                continue
+            for i in self._get_qry_idx(g):
+                ids[i].append(j)
+
+        self.vec_ids = [np.concatenate((a, np.asarray(b, dtype=np.int64))) if len(b) > 0 else a for (a,b) in zip(self.vec_ids, ids)]
+        self.vec_n = n
+
+    def eval(self, pop):
+        """Evaluates all queries against the population.
+
+        Args:
+            pop (GroupPopulation): The population.
+
+        Returns:
+            Mapping[GroupQry, float]: Mass of groups matching every query.
+        """
+
+        if pop.mass_vec is not None:
+            return self._eval__vec(pop.mass_vec)
+        return self._eval__obj(pop)
+
+    def _eval__obj(self, pop):
+        """Evaluates all queries by visiting every Group object once.
+
+        Called by :meth:`~pram.pop.GroupQryPlan.eval`.
+        """
+
+        m_qry = [[] for _ in self.qrys]
+        for (h,g) in pop.groups.items():
+            qry_idx = self.grp_qrys.get(h)
+            if qry_idx is None:
+                qry_idx = self.grp_qrys[h] = self._get_qry_idx(g)
+            for i in qry_idx:
+                if all([fn(g) for fn in self.qrys_cond[i]]):
+                    m_qry[i].append(g.m)
+
+        return { q: math.fsum(m) for (q,m) in zip(self.qrys, m_qry) }
+
+    def _eval__vec(self, vec):
+        """Evaluates all queries by gathering group masses from the mass vector.
+
+        Called by :meth:`~pram.pop.GroupQryPlan.eval`.
+        """
+
+        self._upd_vec_ids(vec)
+
+        m = vec.get_mass()
+        res = {}
+        for (q,cond,ids) in zip(self.qrys, self.qrys_cond, self.vec_ids):
+            if len(cond) > 0:
+                ids = [j for j in ids if vec.groups[j] is not None and all([fn(vec.groups[j]) for fn in cond])]
+            res[q] = math.fsum(m[ids].tolist())
+        return res
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+class GroupQryCache(object):
+    """A bounded cache of group query results with dependency-tracked invalidation.
+
+    Every entry remembers the query it answers and the hashes of groups its result has been computed from.  An entry is
+    invalidated only when one of those groups changes mass or is removed, or when a group matching the query is added
+    to the population.  Entries of queries with conditions other than :class:`~pram.entity.GroupPred` predicates (e.g.,
+    lambdas) can't be tracked that way and are invalidated by any change.  Once the cache is full, the least recently
+    used entry is evicted.
+
+    To avoid matching every new group against every cached query, entries are indexed by one of the attribute or
+    relation values their queries condition on (the site for queries restricted to one).  A group can only match a
+    query if it has that value so a new group is only matched against entries indexed under one of its own attribute
+    or relation values and against the (typically few) entries that could not be indexed (e.g., queries with
+    conditions only).
+
+    Changes are recorded as they happen and applied lazily on the next cache access, so a burst of changes (e.g., a
+    mass transfer) costs one pass over the entries.
+
+    Args:
+        size (int): Maximum number of entries.  Zero disables the cache.
+    """
+
+    def __init__(self, size=4096):
+        self.size = size
+        self.entries = OrderedDict()  # key to (result, query, site hash, dependencies, index key)
+        self.idx = {}                 # index key to keys of entries; None for entries that aren't indexed
+
+        self.hashes_upd = set()  # hashes of groups which have changed since the last access
+        self.groups_add = []     # groups which have been added since the last access
+
+        self.n_hit  = 0
+        self.n_miss = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def _get_idx_key(qry, site):
+        """Returns the key an entry is indexed under (None if it can't be indexed)."""
+
+        if site is not None:
+            return ('r', Site.AT, site)
+        if qry is None:
+            return None
+        for (t,d) in (('a', qry.attr), ('r', qry.rel)):
+            for (k,v) in d.items():
+                try:
+                    hash(v)
+                    return (t,k,v)
+                except TypeError:
+                    pass
+        return None
+
+    def _get_idx_candidates(self, group):
+        """Returns keys of entries the new group could invalidate."""
+
+        keys = set(self.idx.get(None, ()))
+        for (t,d) in (('a', group.attr), ('r', group.rel)):
+            for (k,v) in d.items():
+                try:
+                    keys.update(self.idx.get((t,k,v), ()))
+                except TypeError:
+                    pass
+        return keys
+
+    def _rem(self, key):
+        """Removes the entry stored under the key specified."""
+
+        e = self.entries.pop(key)
+        keys = self.idx[e[4]]
+        keys.discard(key)
+        if len(keys) == 0:
+            del self.idx[e[4]]
+
+    def _upd(self):
+        """Invalidates entries affected by the changes pending."""
+
+        if len(self.hashes_upd) == 0 and len(self.groups_add) == 0:
+            return
+
+        keys = set()
+        for (k,e) in self.entries.items():
+            if e[3] is None or not e[3].isdisjoint(self.hashes_upd):
+                keys.add(k)
+        for g in self.groups_add:
+            for k in self._get_idx_candidates(g) - keys:
+                (_, qry, site, _, _) = self.entries[k]
+                if (site is None or g.rel.get(Site.AT) == site) and g.matches_qry(qry):
+                    keys.add(k)
+
+        for k in keys:
+            self._rem(k)
+        self.hashes_upd = set()
+        self.groups_add = []
+
+    def clear(self):
+        """Removes all entries.
+
+        Returns:
+            ``self``
+        """
+
+        self.entries.clear()
+        self.idx.clear()
+        self.hashes_upd = set()
+        self.groups_add = []
+        return self
+
+    def get(self, key):
+        """Get the result stored under the key specified.
+
+        Args:
+            key (Hashable): The key.
+
+        Returns:
+            Any: The result or None if it is not in the cache.
+        """
+
+        self._upd()
+        e = self.entries.get(key)
+        if e is None:
+            self.n_miss += 1
+            return None
+        self.entries.move_to_end(key)
+        self.n_hit += 1
+        return e[0]
+
+    def put(self, key, res, qry, groups, site=None):
+        """Stores a result.
+
+        Args:
+            key (Hashable): The key.
+            res (Any): The result.
+            qry (GroupQry): The query answered (None stands for the entire population).
+            groups (Iterable[Group]): Groups the result has been computed from.
+            site (int, optional): Hash of the site the query has been restricted to.
+
+        Returns:
+            Any: The result.
+        """
+
+        if self.size <= 0:
+            return res
+        self._upd()
+
+        if qry is None or all([isinstance(c, GroupPred) for c in qry.cond]):
+            deps = frozenset(g.get_hash() for g in groups)
+        else:
+            deps = None
+        if key in self.entries:
+            self._rem(key)
+        idx_key = self._get_idx_key(qry, site)
+        self.entries[key] = (res, qry, site, deps, idx_key)
+        self.idx.setdefault(idx_key, set()).add(key)
+        while len(self.entries) > self.size:
+            self._rem(next(iter(self.entries)))
+        return res
+
+    def add_group(self, group):
+        """Records addition of a new group.
+
+        Args:
+            group (Group): The group.
+
+        Returns:
+            ``self``
+        """
+
+        if len(self.entries) > 0:
+            self.groups_add.append(group)
+        return self
+
+    def upd_mass(self, group_hashes):
+        """Records mass change (or removal) of groups.
+
+        Args:
+            group_hashes (Iterable[int]): Hashes of the groups.
+
+        Returns:
+            ``self``
+        """
+
+        if len(self.entries) > 0:
+            self.hashes_upd.update(group_hashes)
+        return self
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+class RuleCompatTable(object):
+    """Rule-group compatibility table.
+
+    Holds, for every group, indices of rules the static preconditions of which (see :meth:`Rule.get_precond()
+    <pram.rule.Rule.get_precond>`) the group satisfies; only those rules can ever be applicable to the group.  A
+    group's attributes and relations (and therefore its compatibility with rules) never change once it is part of a
+    population, so every group is checked once and the entry remains valid for as long as the group is around and the
+    rules and their preconditions stay the same.  Preconditions are compared and not just rules because they depend
+    on rule attributes which may change between runs (e.g., a group selector set by :meth:`ParamSweep.set_params()
+    <pram.traj.ParamSweep.set_params>`).  Entries of groups no longer in the population are dropped only once they
+    become numerous.
+
+    In models with many rules, most rule-group pairs tend to be statically incompatible and with this table the cost
+    of those pairs is paid once and not at every iteration.
+    """
+
+    def __init__(self):
+        self.rules = []     # rules the table has been computed for
+        self.preconds = []  # their preconditions
+        self.groups = {}    # group hash to a tuple of indices of compatible rules
+
+    def __len__(self):
+        return len(self.groups)
+
+    def get(self, group):
+        """Get indices of rules compatible with the group.
+
+        Args:
+            group (Group): The group.
+
+        Returns:
+            tuple[int]
+        """
+
+        h = group.get_hash()
+        idx = self.groups.get(h)
+        if idx is None:
+            idx = tuple(i for (i,q) in enumerate(self.preconds) if group.matches_qry(q))
+            self.groups[h] = idx
+        return idx
+
+    def set_rules(self, rules, groups):
+        """Sets the rules the table is for (dropping all entries if they or their preconditions differ from the current
+        ones).
+
+        Args:
+            rules (Iterable[Rule]): The rules.
+            groups (Mapping[int, Group]): The population's groups (by hash); used to drop entries of groups no longer
+                in the population.
+
+        Returns:
+            ``self``
+        """
+
+        rules = list(rules)
+        preconds = [r.get_precond() for r in rules]
+        if len(rules) != len(self.rules) or any(a is not b for (a,b) in zip(rules, self.rules)) or preconds != self.preconds:
+            self.rules = rules
+            self.preconds = preconds
+            self.groups = {}
+        elif len(self.groups) > 2 * len(groups) + 1024:
+            self.groups = { h: idx for (h,idx) in self.groups.items() if h in groups }
+        return self
+
+
 # ----------------------------------------------------------------------------------------------------------------------
 class GroupPopulation(object):
     """Population of groups of agents.
@@ -260,9 +907,11 @@ class GroupPopulation(object):
         do_keep_mass_flow_specs (bool, optional): Store the last iteration mass flow specs?  This is False by default
             for memory usage sake.  If set to True, ``self.last_iter.mass_flow_specs`` will hold the specs until they
             are overwriten at the next iteration of the simulation.
+        qry_cache_size (int, optional): Maximum number of group query results to be cached (see
+            :class:`~pram.pop.GroupQryCache`).
     """
 
-    def __init__(self, sim, hist_len=0, do_keep_mass_flow_specs=False):
+    def __init__(self, sim, hist_len=0, do_keep_mass_flow_specs=False, qry_cache_size=4096):
         self.sim = sim
 
         self.groups = {}
@@ -288,6 +937,14 @@ class GroupPopulation(object):
 
         self.do_keep_mass_flow_specs = do_keep_mass_flow_specs
 
+        self.mass_vec = None  # GroupMassVector; only used when the 'vectorized_mass' simulation pragma is on
+        self.group_idx = GroupIndex()
+        self.qry_mass = {}  # group query to mass; populated by eval_qry_plan() and valid until the mass changes
+        self.qry_cache = GroupQryCache(qry_cache_size)  # used by get_groups(), get_groups_mass(), and Site
+        self.rule_compat = RuleCompatTable()  # used by apply_rules__seq()
+        self.instr = None  # CompInstr; set by the simulation for the duration of a run
+        self.par_pool = None  # _ParPool; only used when the 'par_apply_rules' simulation pragma is on
+
         # self.cache = DotMap(
         #     qry_to_groups = {},   # cache for get_groups(qry) calls
         #     qry_to_m      = {}    # cache for get_groups_mass(qry) calls
@@ -321,6 +978,7 @@ class GroupPopulation(object):
 
         if not self.is_frozen:
             self.m += group.m
+        self.qry_mass = {}
 
         rels = {}
         for (k,v) in group.rel.items():
@@ -331,13 +989,25 @@ class GroupPopulation(object):
 
         group_hash = group.get_hash()
         if group_hash in self.groups.keys():
-            self.groups.get(group_hash).m += group.m
+            g = self.groups.get(group_hash)
+            if self.mass_vec is not None:
+                self.mass_vec.inc_mass(group_hash, group.m)
+            else:
+                g.m += group.m
+            self.qry_cache.upd_mass((group_hash,))
+            site = g.get_site_at()
+            if site is not None:
+                site.upd_mass()
         else:
             self.ar_enc.encode(group)
             group_hash = group.get_hash()
             group.pop = self
             group.link_to_site_at()
             self.groups[group_hash] = group
+            self.group_idx.add_group(group)
+            self.qry_cache.add_group(group)
+            if self.mass_vec is not None:
+                self.mass_vec.add_group(group)
 
         return self
 
@@ -395,6 +1065,9 @@ class GroupPopulation(object):
     def add_site(self, site):
         """Adds a site to the population if it doesn't exist.
 
+        Links to groups the site may still hold from another population (e.g., when Site objects are shared by
+        multiple simulations) are reset upon addition.
+
         Args:
             site (Site): The site to be added.
 
@@ -406,6 +1079,7 @@ class GroupPopulation(object):
         if h not in self.sites.keys():
             self.sites[h] = site
             site.set_pop(self)
+            site.reset_group_links()
         return site
 
     def add_sites(self, sites):
@@ -456,6 +1130,14 @@ class GroupPopulation(object):
         group might have been split into resulting groups of which one or more already exists in the group population.
         In other words, not all resulting groups (local scope) need to be new (global scope).
 
+        Groups to which the only applicable rule is matrix-expressible (see
+        :meth:`Rule.get_transition_matrix() <pram.rule.Rule.get_transition_matrix>`) are not split one by one.
+        Instead, they are collected and the rule's transition matrix is applied to all of them at once by the
+        :meth:`~pram.pop.GroupPopulation.apply_transition_matrix` method.
+
+        If the ``par_apply_rules`` simulation pragma asks for more than one process, the groups are split in worker
+        processes instead (see :meth:`~pram.pop.GroupPopulation.apply_rules__par`).
+
         Args:
             rules (Iterable[Rule]): The rules.
             iter (int): Simulation interation.
@@ -473,16 +1155,207 @@ class GroupPopulation(object):
 
         mass_flow_specs = []
         src_group_hashes = set()  # hashes of groups to be updated (a safeguard against resetting mass of unaffected groups)
-        for g in self.groups.values():
-            dst_groups_g = g.apply_rules(self, rules, iter, t, is_rule_setup, is_rule_cleanup, is_sim_setup)
+
+        if is_rule_setup or is_rule_cleanup or is_sim_setup:
+            rules_tm = []
+        else:
+            rules_tm = [r.get_transition_matrix() for r in rules]
+
+        n_procs = self.sim.get_pragma_par_apply_rules() if self.sim is not None else 0
+        if (
+            n_procs > 1 and len(self.groups) > 1 and not (is_rule_setup or is_rule_cleanup or is_sim_setup) and
+            all(r.PAR_SAFE for r in rules) and 'fork' in multiprocessing.get_all_start_methods()
+        ):
+            split, tm_groups = self.apply_rules__par(n_procs, rules, iter, t)
+        else:
+            split, tm_groups = self.apply_rules__seq(self.groups.values(), rules, rules_tm, iter, t, is_rule_setup, is_rule_cleanup, is_sim_setup)
+
+        for (g, dst_groups_g) in split:
+            mass_flow_specs.append(MassFlowSpec(self.get_mass(), g, dst_groups_g))
+            src_group_hashes.add(g.get_hash())
+
+        if self.instr is not None:
+            phase = self.instr.switch(self.instr.SPLIT)
+        for (i, groups) in tm_groups.items():
+            mass_flow_specs.extend(self.apply_transition_matrix(rules_tm[i], groups))
+            src_group_hashes.update(g.get_hash() for g in groups)
+
+        if len(mass_flow_specs) > 0:
+            if self.instr is not None:
+                self.instr.switch(self.instr.TRANSFER_MASS)
+            self.transfer_mass(src_group_hashes, mass_flow_specs, iter, t, is_sim_setup)
+        if self.instr is not None:
+            self.instr.switch(phase)
+
+        return self
+
+    def apply_rules__par(self, n_procs, rules, iter, t):
+        """Applies rules to all groups in worker processes.
+
+        The groups are divided into ``n_procs`` contiguous shards and every shard is handled by one process of a pool.
+        The pool is started when it is first needed (i.e., during the first iteration of a simulation run) and its
+        processes are forked from the current one; they therefore inherit the population and the rules.  From then on,
+        every process keeps its copy of the population in sync with the original: Before every iteration, it receives
+        the sites and groups added since the previous one along with masses of all groups.  The rules are not sent
+        again which is why only rules that declare themselves safe to be applied that way are (see
+        :attr:`Rule.PAR_SAFE <pram.rule.Rule.PAR_SAFE>`).  The pool is stopped when the simulation run ends (see
+        :meth:`~pram.pop.GroupPopulation.stop_par_pool`).
+
+        The results are merged in the order of the shards which makes them identical to the results of
+        :meth:`~pram.pop.GroupPopulation.apply_rules__seq` as long as the rules don't use random numbers.  Every shard
+        has the ``random`` and ``numpy`` pseudo-random number generators seeded with a seed drawn from the current
+        process' generator so that shards draw different numbers and results are reproducible if the simulation is
+        seeded.  Sites added to the population and group attributes and relations used by rules in the worker processes
+        are copied to the current process.
+
+        Args:
+            n_procs (int): Number of worker processes.
+            rules (Iterable[Rule]): The rules.
+            iter (int): Simulation interation.
+            t (int): Simulation time.
+
+        Returns:
+            tuple(list[tuple(Group, list[Group])], Mapping[int, list[Group]]): See
+                :meth:`~pram.pop.GroupPopulation.apply_rules__seq`.
+        """
+
+        rules = list(rules)
+        if self.par_pool is None or not self.par_pool.is_for(n_procs, rules):
+            self.stop_par_pool()
+            self.par_pool = _ParPool(self, n_procs, rules)
+
+        hashes = list(self.groups.keys())
+        shard_len = -(-len(hashes) // n_procs)
+        shards = [hashes[i * shard_len:(i + 1) * shard_len] for i in range(n_procs)]  # every process gets one, even if empty, to stay in sync
+        seeds = np.random.randint(0, 2**32, n_procs, dtype=np.int64)
+        sync = pickle.dumps(self.par_pool.get_sync(self))  # pickled once instead of once per process
+
+        res = self.par_pool.map([(sync, shard, iter, t, int(seed)) for (shard, seed) in zip(shards, seeds)])
+
+        split = []
+        tm_groups = {}
+        for (split_s, tm_groups_s, sites, attr_used, rel_used) in res:
+            for (h, dst_groups_g) in split_s:
+                g = self.groups[h]
+                split.append((g, [self._get_split_group(g, x) for x in dst_groups_g]))
+            for (i, hashes_i) in tm_groups_s.items():
+                tm_groups.setdefault(i, []).extend(self.groups[h] for h in hashes_i)
+            for s in sites:
+                self.add_site(s)
+            if attr_used is not None and Group.attr_used is not None:
+                Group.attr_used.update(attr_used)
+            if rel_used is not None and Group.rel_used is not None:
+                Group.rel_used.update(rel_used)
+        return (split, tm_groups)
+
+    def _get_split_group(self, group, x):
+        """Decodes a group returned by a worker process (see :meth:`~pram.pop.GroupPopulation.apply_rules__par`).
+
+        Args:
+            group (Group): The group that has been split.
+            x (Union[Group, tuple(int, float)]): New group or the hash and mass of the already extant group.
+
+        Returns:
+            Group
+        """
+
+        if isinstance(x, Group):
+            return x
+
+        (h, m) = x
+        g_ex = self.groups[h]
+        g = Group(group.name, m, g_ex.attr, g_ex.rel)
+        g.hash = h
+        return g
+
+    def apply_rules__seq(self, groups, rules, rules_tm, iter, t, is_rule_setup=False, is_rule_cleanup=False, is_sim_setup=False):
+        """Applies rules to the groups specified in the current process.
+
+        Args:
+            groups (Iterable[Group]): The groups.
+            rules (Iterable[Rule]): The rules.
+            rules_tm (Iterable[TransitionMatrix]): Rules' transition matrices (see
+                :meth:`~pram.pop.GroupPopulation.apply_rules`).
+            iter (int): Simulation interation.
+            t (int): Simulation time.
+            is_rule_setup (bool): Is this invocation of this method during rule setup stage of the simulation?
+            is_rule_cleanup (bool): Is this invocation of this method during rule cleanup stage of the simulation?
+            is_sim_setup (bool): Is this invocation of this method during simulation setup stage?
+
+        Returns:
+            tuple(list[tuple(Group, list[Group])], Mapping[int, list[Group]]): Groups that have been split along with
+                the groups they have been split into and groups left for transition matrices (keyed by rule index).
+        """
+
+        split = []
+        tm_groups = {}  # transition matrix index to groups to be split by that matrix alone
+
+        # Rules compatible with the current iteration and time (in the special modes, applicability isn't checked):
+        is_special = is_rule_setup or is_rule_cleanup or is_sim_setup
+        if not is_special:
+            rules = list(rules)
+            self.rule_compat.set_rules(rules, self.groups)
+            is_active = [r.is_applicable_iter_time(iter, t) for r in rules]
+
+        for g in groups:
+            are_applicable = False  # have the rules been verified to be applicable to the group already?
+            if is_special:
+                rules_g = rules
+            elif any(rules_tm):
+                if self.instr is not None:
+                    phase = self.instr.switch(self.instr.RULE_APPLICABLE)
+                rules_idx = [i for i in self.rule_compat.get(g) if is_active[i] and rules[i].is_applicable(g, iter, t)]
+                if self.instr is not None:
+                    self.instr.switch(phase)
+                if len(rules_idx) == 1 and rules_tm[rules_idx[0]] is not None:
+                    tm_groups.setdefault(rules_idx[0], []).append(g)
+                    continue
+                rules_g = [rules[i] for i in rules_idx]
+                are_applicable = True
+            else:
+                rules_g = [rules[i] for i in self.rule_compat.get(g) if is_active[i]]
+                if len(rules_g) == 0:
+                    continue
+
+            dst_groups_g = g.apply_rules(self, rules_g, iter, t, is_rule_setup, is_rule_cleanup, is_sim_setup, are_applicable)
             if dst_groups_g is not None:
-                mass_flow_specs.append(MassFlowSpec(self.get_mass(), g, dst_groups_g))
-                src_group_hashes.add(g.get_hash())
+                split.append((g, dst_groups_g))
+
+        return (split, tm_groups)
+
+    def apply_transition_matrix(self, tm, groups):
+        """Applies a compiled transition matrix to a list of groups in one batched operation.
+
+        The result is equivalent to splitting every group with split specs generated from the matrix row
+        corresponding to the group's current state.
+
+        Args:
+            tm (TransitionMatrix): The transition matrix.
+            groups (Iterable[Group]): The groups.  All of them need to have the matrix' state attribute.
+
+        Returns:
+            list[MassFlowSpec]: Mass flow specs (one per group).
+        """
 
-        if len(mass_flow_specs) == 0:  # no mass to transfer
-            return self
+        m_pop = self.get_mass()
+        m = np.array([g.m for g in groups], dtype=np.float64)
+        s = np.array([tm.get_state_idx(g.get_attr(tm.attr)) for g in groups], dtype=np.int64)
+        m_dst = tm.split(m, s, not self.sim.get_pragma_fractional_mass())
 
-        return self.transfer_mass(src_group_hashes, mass_flow_specs, iter, t, is_sim_setup)
+        mass_flow_specs = []
+        for (g, s_g, m_g) in zip(groups, s, m_dst):
+            h = g.get_hash()
+            dst_groups_g = []
+            for j in np.flatnonzero(m_g):
+                attr_set = { tm.attr: tm.states[j] }
+                h_dst = Group.gen_hash_upd(h, g.attr, attr_set)
+                g_ex = self.groups.get(h_dst)
+                attr = g_ex.attr if g_ex is not None else Group.gen_dict(g.attr, attr_set)
+                g_dst = Group(g.name, float(m_g[j]), attr, g.rel)
+                g_dst.hash = h_dst
+                dst_groups_g.append(g_dst)
+            mass_flow_specs.append(MassFlowSpec(m_pop, g, dst_groups_g))
+        return mass_flow_specs
 
     def archive(self):
         if self.hist_len == 0:
@@ -501,6 +1374,16 @@ class GroupPopulation(object):
             ``self``
         """
 
+        for (k,v) in self.groups.items():
+            if v.m <= 0:
+                self.group_idx.rem_group(v)
+                self.qry_cache.upd_mass((k,))
+                site = v.get_site_at()
+                if site is not None:
+                    site.rem_group_link(v)
+                if self.mass_vec is not None:
+                    self.mass_vec.rem_group(k)
+
         self.groups = { k:v for k,v in self.groups.items() if v.m > 0 }
         return self
 
@@ -524,39 +1407,82 @@ class GroupPopulation(object):
                 self.m     -= v.m
                 self.m_out += v.m
                 del_keys.append(k)
+                self.group_idx.rem_group(v)
+                site = v.get_site_at()
+                if site is not None:
+                    site.rem_group_link(v)
                 # print(f'{k}: {v}')
         # for _ in del_keys:
         #     if k in self.groups.keys():
         #         del self.groups[k]
         self.groups = { k:v for k,v in self.groups.items() if not v.is_void() }
+        self.qry_cache.upd_mass(del_keys)
+        if self.mass_vec is not None:
+            for k in del_keys:
+                self.mass_vec.rem_group(k)
 
         # (2) Move mass from VITA groups to their corresponding groups:
         for (k,v) in self.vita_groups.items():
             # print(v.m)
             self.m    += v.m
             self.m_in += v.m
-            self.groups[k].m += v.m
+            if self.mass_vec is not None:
+                self.mass_vec.inc_mass(k, v.m)
+            else:
+                self.groups[k].m += v.m
+            site = self.groups[k].get_site_at()
+            if site is not None:
+                site.upd_mass()
+        self.qry_cache.upd_mass(self.vita_groups.keys())
         self.vita_groups = {}
+        self.qry_mass = {}
 
         return self
 
+    def eval_qry_plan(self, plan):
+        """Evaluates a group query plan and retains the resulting masses.
+
+        Until group masses change, :meth:`~pram.pop.GroupPopulation.get_groups_mass` answers queries of the plan without
+        scanning the population.
+
+        Args:
+            plan (GroupQryPlan): The plan.
+
+        Returns:
+            ``self``
+        """
+
+        self.qry_mass = plan.eval(self)
+        return self
+
     def freeze(self):
         """Freeze the population.
 
         The :class:`~pram.sim.Simulation` object freezes the population on first run.  Freezing a population is used
         only used to determine the total population size.
 
+        This is also where the group mass vector is created or dropped according to the ``vectorized_mass`` pragma.
+
         Returns:
             ``self``
         """
 
+        if self.sim.get_pragma_vectorized_mass():
+            if self.mass_vec is None:
+                self.mass_vec = GroupMassVector(len(self.groups) * 2)
+                for g in self.groups.values():
+                    self.mass_vec.add_group(g)
+        else:
+            self.mass_vec = None  # group objects hold their masses at all times so nothing is lost
+
         # [g.freeze() for g in self.groups.values()]
         # self.groups = { g.get_hash(): g for g in self.groups.values() }
 
         self.is_frozen = True
         # if self.sim.traj is not None and not self.sim.timer.i > 0:  # we check timer not to save initial state of a simulation that's been run before
         #     self.sim.traj.save_state(None)
-        self.sim.save_state(None)
+        if self.sim.run_cnt == 0:  # the initial state of a simulation that has been run before (or forked) is saved already
+            self.sim.save_state(None)
 
         return self
 
@@ -601,7 +1527,6 @@ class GroupPopulation(object):
         else:
             return len(self.groups)
 
-    @lru_cache(maxsize=None)
     def get_groups(self, qry=None):
         """Get groups that match the group query specified, or all groups if no query is specified.
 
@@ -609,6 +1534,11 @@ class GroupPopulation(object):
         :meth:`Site.get_groups() pram.entity.Site.get_groups` should be used instead for querying groups located at a
         :class:`~pram.entity.Site`.
 
+        The query's attributes, relations, and predicate conditions (see :class:`~pram.entity.GroupPred`) are first
+        looked up in the group index and only the groups found there are tested against the full query (i.e.,
+        including conditions).  Queries the index can't narrow down are tested against all groups.  Results are
+        cached (see :class:`~pram.pop.GroupQryCache`).
+
         Args:
             qry (GroupQry, optional): The group query.
 
@@ -625,9 +1555,17 @@ class GroupPopulation(object):
         #     self.cache.qry_to_groups[qry] = groups
         # return groups
 
-        return [g for g in self.groups.values() if g.matches_qry(qry)]
+        groups = self.qry_cache.get(('groups', qry))
+        if groups is not None:
+            return groups
+
+        hashes = self.group_idx.get_hashes(qry.attr, qry.rel, qry.cond)
+        if hashes is None:
+            groups = [g for g in self.groups.values() if g.matches_qry(qry)]
+        else:
+            groups = [g for g in (self.groups[h] for h in hashes) if g.matches_qry(qry)]
+        return self.qry_cache.put(('groups', qry), groups, qry, groups)
 
-    @lru_cache(maxsize=None)
     def get_groups_mass(self, qry=None, hist_delta=0):
         """Get the mass of groups that match the query specified.
 
@@ -649,7 +1587,14 @@ class GroupPopulation(object):
         """
 
         if hist_delta == 0:
-            return math.fsum([g.m for g in self.get_groups(qry)])
+            m = self.qry_mass.get(qry)
+            if m is not None:
+                return m
+            m = self.qry_cache.get(('mass', qry))
+            if m is not None:
+                return m
+            groups = self.get_groups(qry)
+            return self.qry_cache.put(('mass', qry), math.fsum([g.m for g in groups]), qry, groups)
         else:
             if hist_delta > self.hist_len:
                 raise ValueError('History delta provided (hist_delta) is larger than the history depth (hist_len).')
@@ -718,6 +1663,103 @@ class GroupPopulation(object):
 
         return len(self.sites)
 
+    def prune(self, attr=(), rel=()):
+        """Removes the specified attributes and relations from all groups.
+
+        In other words, the population is projected onto all the other attributes and relations.  Groups that become
+        identical as a result are merged into one with their masses summed up.  Because that changes group hashes, the
+        affected groups are removed from the population and added back in their reduced form.  A merged group retains
+        the name of the first of its constituents.
+
+        Args:
+            attr (Iterable[str]): Names of attributes to be removed.
+            rel (Iterable[str]): Names of relations to be removed.
+
+        Returns:
+            int: Number of groups removed by merging.
+        """
+
+        attr = set(attr)
+        rel  = set(rel)
+        groups = [g for g in self.groups.values() if not (attr.isdisjoint(g.attr.keys()) and rel.isdisjoint(g.rel.keys()))]
+        if len(groups) == 0:
+            return 0
+
+        n = len(self.groups)
+        for g in groups:
+            h = g.get_hash()
+            del self.groups[h]
+            self.group_idx.rem_group(g)
+            site = g.get_site_at()
+            if site is not None:
+                site.rem_group_link(g)
+            if self.mass_vec is not None:
+                self.mass_vec.rem_group(h)
+        self.qry_cache.clear()
+        self.qry_mass = {}
+
+        is_frozen = self.is_frozen
+        self.is_frozen = True  # the total mass does not change
+        for g in groups:
+            self.add_group(Group(
+                name=g.name,
+                m=g.m,
+                attr={ k:v for (k,v) in g.attr.items() if k not in attr },
+                rel={ k:v for (k,v) in g.rel.items() if k not in rel }
+            ))
+        self.is_frozen = is_frozen
+
+        return n - len(self.groups)
+
+    def reset_groups(self, groups, m=None):
+        """Replaces all groups in the population with the ones provided.
+
+        Sites are retained.  This is used to restore a population from a checkpoint (see
+        :class:`sim.Checkpoint <pram.sim.Checkpoint>`).
+
+        Args:
+            groups (Iterable[Group]): The new groups.
+            m (float, optional): The total population mass.  If None, it is the sum of masses of the new groups.
+
+        Returns:
+            ``self``
+        """
+
+        for g in self.groups.values():
+            site = g.get_site_at()
+            if site is not None:
+                site.rem_group_link(g)
+        self.groups = {}
+        self.group_idx = GroupIndex()
+        self.qry_cache.clear()
+        self.qry_mass = {}
+        self.rule_compat = RuleCompatTable()
+        self.mass_vec = None  # rebuilt when the population is frozen again
+
+        is_frozen = self.is_frozen
+        self.is_frozen = True  # the total mass is set below
+        for g in groups:
+            self.add_group(g)
+        self.is_frozen = is_frozen
+
+        self.m = m if m is not None else math.fsum(g.m for g in self.groups.values())
+        for site in self.sites.values():
+            site.upd_mass()
+
+        return self
+
+    def stop_par_pool(self):
+        """Stops the processes applying rules to groups (see :meth:`~pram.pop.GroupPopulation.apply_rules__par`).
+
+        Returns:
+            ``self``
+        """
+
+        if self.par_pool is not None:
+            self.par_pool.stop()
+            self.par_pool = None
+        return self
+
     def transfer_mass(self, src_group_hashes, mass_flow_specs, iter, t, is_sim_setup):
         """Transfers population mass.
 
@@ -727,10 +1769,63 @@ class GroupPopulation(object):
         Because this method is called only once per simulation iteration, it is a good place to put simulation-
         wide computations that should happen after the iteration-specific computations have concluded.
 
+        If the group mass vector is in use, the mass is transferred by
+        :meth:`~pram.pop.GroupPopulation.transfer_mass__vec` instead.
+
         Returns:
             ``self``
         """
 
+        if self.mass_vec is not None:
+            m_flow_tot = self.transfer_mass__vec(mass_flow_specs)
+        else:
+            m_flow_tot = self.transfer_mass__obj(src_group_hashes, mass_flow_specs)
+
+        # Save last iteration info:
+        self.last_iter.mass_flow_tot = m_flow_tot
+        if self.do_keep_mass_flow_specs:
+            self.last_iter.mass_flow_specs = mass_flow_specs
+
+        # Save the trajectory state:
+        # if self.sim.traj is not None:
+        #     self.sim.traj.save_state(mass_flow_specs)
+        if not is_sim_setup:
+            if self.instr is not None:
+                phase = self.instr.switch(self.instr.PERSISTENCE)
+            self.sim.save_state(mass_flow_specs)
+            if self.instr is not None:
+                self.instr.switch(phase)
+        # self.sim.save_state([mfs.m_pop for mfs in mass_flow_specs])
+
+        # Update the sites the groups involved in the mass transfer are at (new groups have been linked when added):
+        group_hashes = set(src_group_hashes)
+        for mfs in mass_flow_specs:
+            group_hashes.update(g.get_hash() for g in mfs.dst)
+
+        sites = set()
+        for h in group_hashes:
+            at = self.groups[h].rel.get(Site.AT)
+            if at is not None:
+                sites.add(at)
+        for at in sites:
+            self.sites[at].upd_mass()
+
+        # Finish up:
+        self.qry_cache.upd_mass(group_hashes)
+        self.qry_mass = {}
+        self.archive()
+
+        return self
+
+    def transfer_mass__obj(self, src_group_hashes, mass_flow_specs):
+        """Transfers population mass by updating masses of Group objects one by one.
+
+        Called by :meth:`~pram.pop.GroupPopulation.transfer_mass`.
+
+        Returns:
+            float: Total mass transferred.
+        """
+
         m_flow_tot = 0  # total mass transferred
 
         # Reset the mass of the groups being updated:
@@ -747,7 +1842,7 @@ class GroupPopulation(object):
 
         for mfs in mass_flow_specs:
             for g01 in mfs.dst:
-                g02 = self.groups.get(g01)
+                g02 = self.groups.get(g01.get_hash())
 
                 if g02 is not None:  # group already exists
                     g02.m       += g01.m
@@ -759,30 +1854,239 @@ class GroupPopulation(object):
 
                 m_flow_tot += g01.m
 
-        # Save last iteration info:
-        self.last_iter.m_flow_tot = m_flow_tot
-        if self.do_keep_mass_flow_specs:
-            self.last_iter.mass_flow_specs = mass_flow_specs
+        return m_flow_tot
 
-        # Save the trajectory state:
-        # if self.sim.traj is not None:
-        #     self.sim.traj.save_state(mass_flow_specs)
-        if not is_sim_setup:
-            self.sim.save_state(mass_flow_specs)
-        # self.sim.save_state([mfs.m_pop for mfs in mass_flow_specs])
+    def transfer_mass__vec(self, mass_flow_specs):
+        """Transfers population mass as one sparse matrix-vector product over the group mass vector.
 
-        # Relink groups to the sites they are currently at:
-        for s in self.sites.values():
-            s.reset_group_links()
-        for g in self.groups.values():
-            g.link_to_site_at()
+        Every destination group is translated into a (source ID, destination ID, proportion) triplet.  Destination
+        groups that do not exist yet are added to the population with zero mass first.  Called by
+        :meth:`~pram.pop.GroupPopulation.transfer_mass`.
 
-        # Finish up:
-        self.get_groups.cache_clear()
-        self.get_groups_mass.cache_clear()
-        self.archive()
+        Returns:
+            float: Total mass transferred.
+        """
 
-        return self
+        src, dst, p = [], [], []
+
+        for mfs in mass_flow_specs:
+            i = self.mass_vec.get_id(mfs.src.get_hash())
+            m = mfs.src.m
+            if m <= 0:  # nothing to move, but the source mass still needs to be reset
+                src.append(i)
+                dst.append(i)
+                p.append(0.0)
+                continue
+
+            for g in mfs.dst:
+                j = self.mass_vec.get_id(g.get_hash())
+                if j is None:
+                    g_m = g.m
+                    g.m = 0.0  # the mass arrives via the transfer below
+                    self.add_group(g)
+                    g.m = g_m
+                    j = self.mass_vec.get_id(g.get_hash())
+                src.append(i)
+                dst.append(j)
+                p.append(g.m / m)
+
+        return self.mass_vec.transfer(src, dst, p, not self.sim.get_pragma_fractional_mass())
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+class _ParPool(object):
+    """Processes applying rules to shards of groups (see :meth:`GroupPopulation.apply_rules__par()
+    <pram.pop.GroupPopulation.apply_rules__par>`).
+
+    Every process is forked with the population and the rules and is sent exactly one message per iteration over its
+    own pipe so that all processes see the same sequence of population updates.
+
+    Args:
+        pop (GroupPopulation): The population.
+        n_procs (int): Number of processes.
+        rules (Iterable[Rule]): The rules.
+    """
+
+    def __init__(self, pop, n_procs, rules):
+        ctx = multiprocessing.get_context('fork')
+
+        self.rules = list(rules)
+        self.group_hashes = set(pop.groups.keys())  # groups and sites the processes' copies of the population have
+        self.site_hashes  = set(pop.sites.keys())   # ^
+        self.conns = []
+        self.procs = []
+
+        for _ in range(n_procs):
+            (conn, conn_proc) = ctx.Pipe()
+            proc = ctx.Process(target=_par_worker, args=(conn_proc, pop, self.rules), daemon=True)
+            proc.start()
+            conn_proc.close()
+            self.conns.append(conn)
+            self.procs.append(proc)
+
+    def __len__(self):
+        return len(self.procs)
+
+    def get_sync(self, pop):
+        """Get the update that brings the processes' copies of the population in sync with the population.
+
+        Args:
+            pop (GroupPopulation): The population.
+
+        Returns:
+            tuple: Sites added, groups added (as tuples of hash, name, attributes, and relations), a flag indicating
+                that groups have been removed, masses of all groups (by hash), and the total population mass.
+        """
+
+        sites = []
+        for (h, site) in pop.sites.items():
+            if h not in self.site_hashes:
+                site = copy.copy(site)
+                site.reset_group_links()
+                site.set_pop(None)
+                sites.append(site)
+                self.site_hashes.add(h)
+
+        groups = [(h, g.name, g.attr, g.rel) for (h,g) in pop.groups.items() if h not in self.group_hashes]
+        is_rem = len(self.group_hashes) + len(groups) != len(pop.groups)
+        if is_rem:
+            self.group_hashes = set(pop.groups.keys())
+        else:
+            self.group_hashes.update(h for (h,_,_,_) in groups)
+
+        return (sites, groups, is_rem, { h: g.m for (h,g) in pop.groups.items() }, pop.m)
+
+    def is_for(self, n_procs, rules):
+        """Checks if the pool has been started for the number of processes and the rules specified.
+
+        Returns:
+            bool
+        """
+
+        rules = list(rules)
+        return len(self) == n_procs and len(rules) == len(self.rules) and all(a is b for (a,b) in zip(rules, self.rules))
+
+    def map(self, msgs):
+        """Sends one message to every process and collects the results.
+
+        Args:
+            msgs (Iterable[tuple]): Messages (one per process).
+
+        Returns:
+            list: Results (one per process).
+        """
+
+        for (conn, msg) in zip(self.conns, msgs):
+            conn.send(msg)
+
+        res = [conn.recv() for conn in self.conns]
+        for (is_ok, r) in res:
+            if not is_ok:
+                raise r
+        return [r for (_,r) in res]
+
+    def stop(self):
+        """Stops all processes."""
+
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except OSError:  # the process is gone already
+                pass
+            conn.close()
+        for proc in self.procs:
+            proc.join()
+        self.conns = []
+        self.procs = []
+
+
+def _par_worker(conn, pop, rules):
+    """Main loop of a process of the :class:`~pram.pop._ParPool` pool.
+
+    Args:
+        conn (multiprocessing.connection.Connection): Pipe to the simulation's process.
+        pop (GroupPopulation): The population (i.e., the process' copy of it).
+        rules (Iterable[Rule]): The rules.
+    """
+
+    pop.mass_vec = None  # masses are set on Group objects by _apply_rules__shard() and no mass is transferred here
+    pop.instr = None
+
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg is None:
+            break
+
+        try:
+            res = (True, _apply_rules__shard(pop, rules, *msg))
+        except Exception as e:
+            res = (False, e)
+        conn.send(res)
+    conn.close()
+
+
+def _apply_rules__shard(pop, rules, sync, hashes, iter, t, rand_seed):
+    """Brings a worker process' copy of the population up to date and applies rules to one shard of groups.
+
+    See :meth:`~pram.pop.GroupPopulation.apply_rules__par`.
+
+    Args:
+        pop (GroupPopulation): The process' copy of the population.
+        rules (Iterable[Rule]): The rules.
+        sync (bytes): Pickled population update (see :meth:`_ParPool.get_sync() <pram.pop._ParPool.get_sync>`).
+        hashes (Iterable[int]): Hashes of groups in the shard.
+        iter (int): Simulation interation.
+        t (int): Simulation time.
+        rand_seed (int): Pseudo-random number generator seed.
+
+    Returns:
+        tuple: Split groups and groups left for transition matrices (both as hashes), sites added, and group attributes
+            and relations used.  Groups the split groups are split into are returned as (hash, mass) tuples if they
+            exist in the population already (to save on pickling).
+    """
+
+    # Sync the population:
+    (sites, groups, is_rem, groups_m, m) = pickle.loads(sync)
+    for site in sites:
+        pop.add_site(site)
+    groups = [Group(name, 0.0, attr, rel) for (_, name, attr, rel) in groups]
+    if is_rem:
+        pop.reset_groups([g for (h,g) in pop.groups.items() if h in groups_m] + groups, m)
+    else:
+        for g in groups:
+            pop.add_group(g)
+    for (h,g) in pop.groups.items():
+        g.m = groups_m[h]
+    pop.m = m
+    for site in pop.sites.values():
+        site.upd_mass()
+    pop.qry_cache.clear()
+    pop.qry_mass = {}
+
+    # Apply rules:
+    random.seed(rand_seed)
+    np.random.seed(rand_seed)
+
+    sites0 = set(pop.sites.keys())
+    split, tm_groups = pop.apply_rules__seq([pop.groups[h] for h in hashes], rules, [r.get_transition_matrix() for r in rules], iter, t)
+
+    sites = []
+    for h in pop.sites.keys() - sites0:  # sent to the simulation's process which sends them back with the next sync
+        site = pop.sites.pop(h)
+        site.reset_group_links()
+        site.set_pop(None)
+        sites.append(site)
+
+    return (
+        [(g.get_hash(), [(x.get_hash(), x.m) if x.get_hash() in pop.groups else x for x in dst_groups_g]) for (g, dst_groups_g) in split],
+        { j: [g.get_hash() for g in groups] for (j, groups) in tm_groups.items() },
+        sites,
+        Group.attr_used,
+        Group.rel_used
+    )
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -9,13 +9,13 @@ import string
 
 from abc             import abstractmethod, ABC
 from attr            import attrs, attrib, converters
-from collections     import Iterable
+from collections.abc import Iterable
 from dotmap          import DotMap
 from enum            import IntEnum
 from scipy.stats     import gamma, lognorm, norm, poisson, rv_discrete
 from scipy.integrate import ode, solve_ivp
 
-from .entity import Group, GroupQry, GroupSplitSpec, Site
+from .entity import AttrEq, Group, GroupPred, GroupQry, GroupSplitSpec, HasAttr, HasRel, PredOr, Site
 from .util   import Err, Time as TimeU
 
 
@@ -156,12 +156,41 @@ class TimeSet(Time):
 
 # ----------------------------------------------------------------------------------------------------------------------
 class Directive(ABC):
+    """Simulation directive base class.
+
+    A directive is an instruction to the simulation engine issued by a simulation rule (by returning it from
+    :meth:`SimRule.apply() <pram.rule.SimRule.apply>`).  The engine acts upon directives at the end of the iteration
+    they have been issued in.
+    """
+
     pass
 
 
 # ----------------------------------------------------------------------------------------------------------------------
+@attrs(slots=True)
 class ForkDirective(Directive):
-    pass
+    """Directive to fork the running simulation into branches.
+
+    Every branch starts as a copy of the simulation as of the end of the iteration in which the directive has been
+    issued and runs for as many iterations as the simulation has left.  Before it is run, a branch is set up by a
+    function that receives the branch's simulation (e.g., to add or remove rules or to change simulation variables).
+    The simulation that has issued the directive continues unaffected, i.e., it becomes the baseline the branches can
+    be compared against.
+
+    How branches are run is up to the handler of the directive (see :meth:`Simulation.set_cb_fork()
+    <pram.sim.Simulation.set_cb_fork>`).  When the simulation is run as a part of a trajectory ensemble, every branch
+    becomes a child trajectory that shares the history of its parent up to the fork point instead of recomputing it.
+
+    Args:
+        branches (Mapping[str, Callable[[Simulation], Any]]): Branch names mapped onto branch setup functions (None
+            for a branch that needs no setup).
+    """
+
+    branches: dict = attrib(factory=dict, converter=dict)
+
+    def __attrs_post_init__(self):
+        if len(self.branches) == 0:
+            raise ValueError('At least one branch needs to be specified.')
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -176,6 +205,12 @@ class Rule(ABC):
     group of humans currently infected with some infectious disease.  The same rule, however, would not be applied to
     a group of city buses.  Each rule knows how to recognize a compatible group.
 
+    A rule can be applied in worker processes (see the ``par_apply_rules`` simulation pragma) only if its class sets
+    ``PAR_SAFE`` to ``True``.  That declares that the rule's ``is_applicable()`` and ``apply()`` depend on nothing but
+    their arguments (i.e., the group, the population's groups, sites, and masses, the iteration, and time) and the
+    rule's own state, that they don't change that state or the population (e.g., by adding VITA groups), and that
+    nothing else changes the rule's state during a simulation run.
+
     Args:
         name (str): Name.
         t (:class:`~pram.rule.Time`, int, tuple[int,int], set[int]): Compatible time selector.
@@ -187,9 +222,11 @@ class Rule(ABC):
     T_UNIT_MS = TimeU.MS.h
     NAME = 'Rule'
     ATTRS = {}  # a dict of attribute names as keys and the list of their values as values
+    PAR_SAFE = False  # can the rule be applied in worker processes (see GroupPopulation.apply_rules__par())?
 
     pop = None
     compile_spec = None
+    sel_memo = None  # (iter, t, result) of the most recent iteration and time selectors evaluation
 
     def __init__(self, name='rule', t=TimeAlways(), i=IterAlways(), group_qry=None, memo=None):
         # Err.type(t, 't', Time, True)
@@ -248,6 +285,7 @@ class Rule(ABC):
             self.i = IterSet(i)
         else:
             raise ValueError("Wrong type of the argument 'i' specified.")
+        self.sel_memo = None
 
     def _set_t(self, t=None):
         """Decode and set time selector.
@@ -269,6 +307,7 @@ class Rule(ABC):
             self.t = TimeSet(t)
         else:
             raise ValueError("Wrong type of the argument 't' specified.")
+        self.sel_memo = None
 
     @abstractmethod
     def apply(self, pop, group, iter, t):
@@ -319,6 +358,30 @@ class Rule(ABC):
 
         return f'{prefix}{name}_' + ''.join(random.sample(string.ascii_letters + string.digits, rand_len))
 
+    @staticmethod
+    def gen_precond(group_qry=None, attr=(), rel=()):
+        """Generates a static group precondition (see :meth:`~pram.rule.Rule.get_precond`).
+
+        Args:
+            group_qry (GroupQry, optional): The rule's group selector.  Conditions that aren't
+                :class:`~pram.entity.GroupPred` predicates are dropped because they need not be static.
+            attr (Iterable[str]): Names of attributes a compatible group needs to have.
+            rel (Iterable[str]): Names of relations a compatible group needs to have.
+
+        Returns:
+            GroupQry or None
+        """
+
+        cond = []
+        if len(attr) > 0:
+            cond.append(HasAttr(attr))
+        if len(rel) > 0:
+            cond.append(HasRel(rel))
+
+        if group_qry is None or not isinstance(group_qry, GroupQry):
+            return GroupQry(cond=cond) if len(cond) > 0 else None
+        return GroupQry(dict(group_qry.attr), dict(group_qry.rel), [c for c in group_qry.cond if isinstance(c, GroupPred)] + cond, group_qry.full)
+
     def get_inner_rules(self):
         """Get a rule's inner rules.
 
@@ -330,6 +393,40 @@ class Rule(ABC):
 
         return self.rules
 
+    def get_precond(self):
+        """Get the rule's static group precondition.
+
+        The precondition is a group query that every group the rule is applicable to satisfies irrespective of the
+        iteration and time; it thus expresses the part of :meth:`~pram.rule.Rule.is_applicable` that depends on the
+        group's attributes and relations alone.  Because those never change once the group is part of a population,
+        the population checks preconditions of all rules once per group (see :class:`~pram.pop.RuleCompatTable`) and
+        only calls :meth:`~pram.rule.Rule.is_applicable` for rules the group is compatible with.  The precondition
+        need not be sufficient (:meth:`~pram.rule.Rule.is_applicable` is still called) but it must be necessary.
+
+        The default precondition is the static part of the rule's group selector.  Subclasses that require attributes or
+        relations should override this method (see :meth:`~pram.rule.Rule.gen_precond`).
+
+        Returns:
+            GroupQry or None: The precondition; None if there is none.
+        """
+
+        return Rule.gen_precond(self.group_qry)
+
+    def get_transition_matrix(self):
+        """Get the rule's compiled transition matrix.
+
+        A rule is matrix-expressible if its effect on every compatible group is to redistribute that group's mass
+        among the values of a single attribute according to a constant right stochastic matrix.  Such a rule can
+        return that matrix here which lets the group population apply it to all compatible groups in one batched
+        operation instead of calling :meth:`~pram.rule.Rule.apply` group by group.  Rules that are not
+        matrix-expressible (which is the default) return None and are applied via group split specs.
+
+        Returns:
+            TransitionMatrix or None
+        """
+
+        return None
+
     def is_applicable(self, group, iter, t):
         """Verifies if the rule is applicable to the specified group at the specified iteration and time.
 
@@ -344,7 +441,7 @@ class Rule(ABC):
             bool: True if applicable, False otherwise.
         """
 
-        return self.is_applicable_iter(iter) and self.is_applicable_time(t) and self.is_applicable_group(group)
+        return self.is_applicable_iter_time(iter, t) and self.is_applicable_group(group)
 
     def is_applicable_iter(self, iter):
         """Verifies if the rule is applicable at the specified iteration.
@@ -370,6 +467,27 @@ class Rule(ABC):
         else:
             raise TypeError("Type '{}' used for specifying rule iteration not yet implemented (Rule.is_applicable).".format(type(self.i).__name__))
 
+    def is_applicable_iter_time(self, iter, t):
+        """Verifies if the rule is applicable at the specified iteration and time.
+
+        The result is memoized for the most recent iteration and time so that the selectors are evaluated once per
+        iteration and not once per group.
+
+        Args:
+            iter (int): Iteration.
+            t (float): Time.
+
+        Returns:
+            bool: True if applicable, False otherwise.
+        """
+
+        memo = self.sel_memo
+        if memo is not None and memo[0] == iter and memo[1] == t:
+            return memo[2]
+        res = self.is_applicable_iter(iter) and self.is_applicable_time(t)
+        self.sel_memo = (iter, t, res)
+        return res
+
     def is_applicable_time(self, t):
         """Verifies if the rule is applicable at the specified time.
 
@@ -387,7 +505,7 @@ class Rule(ABC):
         elif isinstance(self.t, TimeInt):
             return self.t.t0 <= t <= self.t.t1
         elif isinstance(self.t, TimeSet):
-            return t in self.i.t
+            return t in self.t.t
         else:
             raise TypeError("Type '{}' used for specifying rule timing not yet implemented (Rule.is_applicable).".format(type(self.t).__name__))
 
@@ -511,7 +629,8 @@ class SimRule(Rule, ABC):
             time (float): Time.
 
         Returns:
-            Iterable[GroupSplitSpect] or None: Specs groups the current group should be split into.
+            Directive, Iterable[Directive], or None: Directives for the simulation engine (see
+            :class:`~pram.rule.Directive`).
         """
 
         pass
@@ -522,6 +641,27 @@ class SimRule(Rule, ABC):
         return super().is_applicable_iter(iter) and super().is_applicable_time(t)
 
 
+# ----------------------------------------------------------------------------------------------------------------------
+class ForkRule(SimRule):
+    """Forks the simulation into branches at the designated iteration.
+
+    See :class:`~pram.rule.ForkDirective` for details.
+
+    Args:
+        i (int): Iteration to fork the simulation at.
+        branches (Mapping[str, Callable[[Simulation], Any]]): Branch names mapped onto branch setup functions.
+        name (str): Name.
+        memo (str): Description.
+    """
+
+    def __init__(self, i, branches, name='fork', memo=None):
+        super().__init__(name, i=i, memo=memo)
+        self.branches = branches
+
+    def apply(self, sim, iter, t):
+        return ForkDirective(self.branches)
+
+
 # ----------------------------------------------------------------------------------------------------------------------
 class Noop(Rule):
     """NO-OP, i.e., a rule that does not do anything.
@@ -533,6 +673,8 @@ class Noop(Rule):
         name (str): Name.
     """
 
+    PAR_SAFE = True
+
     def __init__(self, name='noop'):
         super().__init__(name)
 
@@ -615,6 +757,8 @@ class GroupMassDecByNumRule(Rule):
         memo (str, optional): Description.
     """
 
+    PAR_SAFE = True
+
     def __init__(self, m, name='grp-mass-dec-by-num', t=TimeAlways(), i=IterAlways(), group_qry=None, memo=None):
         super().__init__(name, t, i, group_qry, memo)
         self.m = m
@@ -642,6 +786,8 @@ class GroupMassDecByPropRule(Rule):
         memo (str, optional): Description.
     """
 
+    PAR_SAFE = True
+
     def __init__(self, p, name='grp-mass-dec-by-prop', t=TimeAlways(), i=IterAlways(), group_qry=None, memo=None):
         super().__init__(name, t, i, group_qry, memo)
         self.p = p
@@ -932,6 +1078,11 @@ class FibonacciSeq(Sequence, DifferenceEquation):
 
         return [GroupSplitSpec(p=1.00, attr_set={ self.attr: n_, self.attr_1: n1, self.attr_2: n2 })]
 
+    def get_precond(self):
+        """See :meth:`pram.rule.Rule.get_precond <Rule.get_precond()>`."""
+
+        return Rule.gen_precond(self.group_qry, attr=[self.attr])
+
     def is_applicable(self, group, iter, t):
         return super().is_applicable(group, iter, t) and group.ha(self.attr)
 
@@ -1033,6 +1184,8 @@ class ODESystem(Rule):
         memo (str, optional): Description.
     """
 
+    PAR_SAFE = False  # integration state and history are kept by the rule
+
     def __init__(self, fn_deriv, y0, name='ode-system', t=TimeAlways(), i=IterAlways(), dt=1.0, ni_name='zvode', group_qry=None, memo=None):
         super().__init__(name, t, i, group_qry, memo)
 
@@ -1092,6 +1245,8 @@ class ODESystemAttr(Rule):
         memo (str, optional): Description.
     """
 
+    PAR_SAFE = False  # integration state and history are kept by the rule
+
     def __init__(self, fn_deriv, y0, name='ode-system', t=TimeAlways(), i=IterAlways(), dt=1.0, ni_name='zvode', memo=None):
         super().__init__(name, t, i, memo)
 
@@ -1169,6 +1324,8 @@ class ODESystemMass(Rule):
         memo (str, optional): Description.
     """
 
+    PAR_SAFE = False  # integration state and history are kept by the rule
+
     def __init__(self, derivatives, group_queries, name='ode-system-mass', t=TimeAlways(), i=IterAlways(), dt=1.0, ni_name='zvode', memo=None):
         super().__init__(name, t, i, memo)
 
@@ -1234,10 +1391,15 @@ class ODESystemMass(Rule):
 
         return [t,y]
 
+    def get_precond(self):
+        """See :meth:`pram.rule.Rule.get_precond <Rule.get_precond()>`."""
+
+        return GroupQry(cond=[PredOr(*[AttrEq(dict(q.attr)) for q in self.group_queries])])
+
     def is_applicable(self, group, iter, t):
         """See :meth:`pram.rule.Rule.is_applicable <Rule.is_applicable()>`."""
 
-        return super().is_applicable(group, iter, t) and group.ha(self.y0)
+        return super().is_applicable(group, iter, t) and any(group.ha(q.attr) for q in self.group_queries)
 
     def set_params(self, **kwargs):
         self.derivatives.set_params(**kwargs)
@@ -1314,6 +1476,83 @@ class ProbabilisticAutomaton(Rule, ABC):
     pass
 
 
+# ----------------------------------------------------------------------------------------------------------------------
+class TransitionMatrix(object):
+    """A compiled state-transition matrix of a matrix-expressible rule.
+
+    The matrix is built once from the ``{ state: stochastic vector }`` mapping used by Markov chain rules.  Rows
+    correspond to current states and columns to next states (i.e., it is a right stochastic matrix).
+
+    Args:
+        attr (str): Name of state attribute.
+        tm (Mapping[str,Iterable[float]]): Transition matrix.  Keys correspond to state names and values to lists of
+            transition probabilities.
+    """
+
+    def __init__(self, attr, tm):
+        self.attr = attr
+        self.states = list(tm.keys())
+        self.state_idx = { s:i for (i,s) in enumerate(self.states) }
+        self.p = np.array([tm[s] for s in self.states], dtype=np.float64)
+
+        # The last non-zero probability in a row gets the complement of the mass (as in Group.split()):
+        self.last = np.array([np.flatnonzero(p)[-1] for p in self.p], dtype=np.int64)
+
+    def get_state_idx(self, state):
+        """Get the row index of the state specified.
+
+        Args:
+            state (Any): The state.
+
+        Returns:
+            int
+
+        Raises:
+            ValueError: If the state is unknown.
+        """
+
+        i = self.state_idx.get(state)
+        if i is None:
+            raise ValueError(f"'{self.__class__.__name__}' class: Unknown state '{state}' for attribute '{self.attr}'")
+        return i
+
+    def split(self, m, s, do_round=False):
+        """Splits the masses of multiple groups at once.
+
+        Mass that would otherwise be lost due to floating-point arithmetic is assigned to the last state with a
+        non-zero transition probability.  Rounding preserves the total mass of every group in the same way
+        ``iteround.saferound()`` does (i.e., by adjusting the masses that changed the most due to rounding).
+
+        Args:
+            m (numpy.ndarray): Masses of groups.
+            s (numpy.ndarray): Row indices of groups' current states.
+            do_round (bool): Round the resulting masses to integers?
+
+        Returns:
+            numpy.ndarray: Masses of the groups (rows) moving to each of the states (columns).
+        """
+
+        rows = np.arange(len(s))
+        last = self.last[s]
+
+        m_dst = m[:,None] * self.p[s]
+        m_dst[rows, last] = 0.0
+        m_dst[rows, last] = m - m_dst.sum(axis=1)
+
+        if do_round:
+            m_int = np.rint(m_dst)
+            n_adj = np.rint(m_dst.sum(axis=1)) - m_int.sum(axis=1)  # units to add (or remove if negative)
+            diff = m_dst - m_int
+            key = np.where((n_adj >= 0)[:,None], -diff, diff)
+            key[self.p[s] == 0] = np.inf  # never move mass to states the rule doesn't move it to
+            order = np.argsort(key, axis=1, kind='stable')
+            rank = np.empty_like(order)
+            rank[rows[:,None], order] = np.arange(m_dst.shape[1])
+            m_dst = m_int + np.sign(n_adj)[:,None] * (rank < np.abs(n_adj)[:,None])
+
+        return m_dst
+
+
 # ----------------------------------------------------------------------------------------------------------------------
 class MarkovChain(MarkovProcess, ProbabilisticAutomaton, ABC):
     """Markov process with a discrete state space."""
@@ -1390,6 +1629,8 @@ class DiscreteInvMarkovChain(MarkovChain, DiscreteSpacetimeStochasticProcess, St
             ``fn(group, attr_val, tm)``.
     """
 
+    PAR_SAFE = True
+
     def __init__(self, attr, tm, name='markov-chain', t=TimeAlways(), i=IterAlways(), memo=None, cb_before_apply=None):
         super().__init__(name, t, i, memo)
 
@@ -1400,6 +1641,7 @@ class DiscreteInvMarkovChain(MarkovChain, DiscreteSpacetimeStochasticProcess, St
         self.tm = tm
         self.states = list(self.tm.keys())  # simplify and speed-up lookup in apply()
         self.cb_before_apply = cb_before_apply
+        self.tm_mat = TransitionMatrix(attr, tm)
 
     def apply(self, pop, group, iter, t):
         """See :meth:`pram.rule.Rule.apply <Rule.apply()>`."""
@@ -1417,6 +1659,23 @@ class DiscreteInvMarkovChain(MarkovChain, DiscreteSpacetimeStochasticProcess, St
 
         return self.states
 
+    def get_transition_matrix(self):
+        """See :meth:`pram.rule.Rule.get_transition_matrix <Rule.get_transition_matrix()>`.
+
+        The rule is not matrix-expressible if the ``cb_before_apply`` callback is set (because the callback can alter
+        the transition probabilities on a per-group basis) or if the :meth:`~pram.rule.DiscreteInvMarkovChain.apply`
+        method is overridden by a subclass or replaced on the instance (e.g., by :class:`~pram.sim.CompProf`).
+        """
+
+        if self.cb_before_apply or type(self).apply is not DiscreteInvMarkovChain.apply or 'apply' in vars(self):
+            return None
+        return self.tm_mat
+
+    def get_precond(self):
+        """See :meth:`pram.rule.Rule.get_precond <Rule.get_precond()>`."""
+
+        return Rule.gen_precond(self.group_qry, attr=[self.attr])
+
     def is_applicable(self, group, iter, t):
         """See :meth:`pram.rule.Rule.is_applicable <Rule.is_applicable()>`."""
 
@@ -1473,6 +1732,8 @@ class DiscreteVarMarkovChain(MarkovChain, DiscreteSpacetimeStochasticProcess):
         memo (str, optional): Description.
     """
 
+    PAR_SAFE = True
+
     def __init__(self, attr, tm, name='markov-chain', t=TimeAlways(), i=IterAlways(), memo=None):
         super().__init__(name, t, memo)
 
@@ -1500,6 +1761,11 @@ class DiscreteVarMarkovChain(MarkovChain, DiscreteSpacetimeStochasticProcess):
 
         return self.states
 
+    def get_precond(self):
+        """See :meth:`pram.rule.Rule.get_precond <Rule.get_precond()>`."""
+
+        return Rule.gen_precond(self.group_qry, attr=[self.attr])
+
     def is_applicable(self, group, iter, t):
         """See :meth:`pram.rule.Rule.is_applicable <Rule.is_applicable()>`."""
 
@@ -1886,6 +2152,11 @@ class PoissonIncidenceProcess(PoissonProcess):
             GroupSplitSpec(p=1 - p0, attr_set={ 'age': age + age_inc, self.attr: True  })
         ]
 
+    def get_precond(self):
+        """See :meth:`pram.rule.Rule.get_precond <Rule.get_precond()>`."""
+
+        return Rule.gen_precond(self.group_qry, attr=['age', self.attr])
+
     def is_applicable(self, group, iter, t):
         """See :meth:`pram.rule.Rule.is_applicable <Rule.is_applicable()>`."""
 
@@ -1948,6 +2219,8 @@ class SegregationModel(Rule):
         memo (str, optional): Description.
     """
 
+    PAR_SAFE = True
+
     def __init__(self, attr, attr_dom_card, p_migrate=0.05, name='segregation-model', t=TimeAlways(), i=IterAlways(), group_qry=None, memo=None):
         super().__init__(name, t, i, group_qry, memo)
 
@@ -1985,6 +2258,11 @@ class SegregationModel(Rule):
             s = random.choice(list(pop.sites.values()))
         return s
 
+    def get_precond(self):
+        """See :meth:`pram.rule.Rule.get_precond <Rule.get_precond()>`."""
+
+        return Rule.gen_precond(self.group_qry, attr=[self.attr], rel=[Site.AT])
+
     def is_applicable(self, group, iter, t):
         """See :meth:`pram.rule.Rule.is_applicable <Rule.is_applicable()>`."""
 
@@ -2262,6 +2540,7 @@ class GoToRule(Rule):
     """
 
     NAME = 'Goto'
+    PAR_SAFE = True
 
     def __init__(self, p, rel_from, rel_to, name='goto', t=TimeAlways(), i=IterAlways(), group_qry=None, memo=None):
         super().__init__(name, t, i, group_qry, memo)
@@ -2331,6 +2610,7 @@ class GoToAndBackTimeAtRule(Rule):
     # TODO: Switch from PDF to CDF because it's more natural.
 
     NAME = 'Goto and back'
+    PAR_SAFE = True
 
     TIME_PDF_TO_DEF   = { 8: 0.5, 12:0.5 }
     TIME_PDF_BACK_DEF = { 1: 0.05, 3: 0.2, 4: 0.25, 5: 0.2, 6: 0.1, 7: 0.1, 8: 0.1 }
@@ -2381,6 +2661,11 @@ class GoToAndBackTimeAtRule(Rule):
             GroupSplitSpec(p=1 - p, attr_set={ self.t_at_attr: (t_at + 1) })
         ]
 
+    def get_precond(self):
+        """See :meth:`pram.rule.Rule.get_precond <Rule.get_precond()>`."""
+
+        return Rule.gen_precond(self.group_qry, rel=[self.to, self.back])
+
     def is_applicable(self, group, iter, t):
         """See :meth:`pram.rule.Rule.is_applicable <Rule.is_applicable()>`."""
 
@@ -2390,6 +2675,7 @@ class GoToAndBackTimeAtRule(Rule):
 # ----------------------------------------------------------------------------------------------------------------------
 class ResetRule(Rule):
     NAME = 'Reset'
+    PAR_SAFE = True
 
     def __init__(self, t=5, i=None, attr_del=None, attr_set=None, rel_del=None, rel_set=None, memo=None):
         super().__init__('reset', t, i, memo)
@@ -2413,6 +2699,11 @@ class ResetSchoolDayRule(ResetRule):
         super().__init__(t, i, attr_del, attr_set, rel_del, rel_set, memo)
         self.name = 'reset-school-day'
 
+    def get_precond(self):
+        """See :meth:`pram.rule.Rule.get_precond <Rule.get_precond()>`."""
+
+        return Rule.gen_precond(self.group_qry, rel=['home', 'school'])
+
     def is_applicable(self, group, iter, t):
         """See :meth:`pram.rule.Rule.is_applicable <Rule.is_applicable()>`."""
 
@@ -2427,6 +2718,11 @@ class ResetWorkDayRule(ResetRule):
         super().__init__(t, i, attr_del, attr_set, rel_del, rel_set, memo)
         self.name = 'reset-work-day'
 
+    def get_precond(self):
+        """See :meth:`pram.rule.Rule.get_precond <Rule.get_precond()>`."""
+
+        return Rule.gen_precond(self.group_qry, rel=['home', 'work'])
+
     def is_applicable(self, group, iter, t):
         """See :meth:`pram.rule.Rule.is_applicable <Rule.is_applicable()>`."""
 
@@ -48,7 +48,7 @@ class Signal(object):
     """
 
     def __init__(self, series=None, names=None):
-        if series is not None and not isinstance(Signal, np.ndarray):
+        if series is not None and not isinstance(series, np.ndarray):
             raise ValueError('S needs to be an instance of ndarray.')
 
         self.series = series
@@ -21,10 +21,12 @@
 
 import ast
 import bz2
+import copy
 import datetime
 import gc
 import gzip
 import inspect
+import json
 import math
 import matplotlib.pyplot as plt
 import numpy as np
@@ -34,25 +36,28 @@ import psutil
 import random
 import sqlite3
 import statistics
+import textwrap
 import time
+import tracemalloc
 
 from collections import namedtuple, Counter
 from dotmap      import DotMap
 from scipy.stats import gaussian_kde
 
-from .data        import GroupSizeProbe, Probe
+from .data        import GroupProbe, GroupSizeProbe, Probe
 from .entity      import Agent, Group, GroupQry, Site
 from .model.model import Model
-from .pop         import GroupPopulation, GroupPopulationHistory
-from .rule        import Rule, SimRule, IterAlways, IterPoint, IterInt
+from .pop         import GroupPopulation, GroupPopulationHistory, GroupQryPlan, MassFlowSpec
+from .rule        import Directive, ForkDirective, Rule, SimRule, IterAlways, IterPoint, IterInt
 from .util        import Err, FS, Size, Time
 
-__all__ = ['SimulationConstructionError', 'SimulationConstructionWarning', 'Simulation']
+__all__ = ['SimulationConstructionError', 'SimulationConstructionWarning', 'SimulationError', 'CompInstr', 'CompProf', 'Checkpoint', 'Simulation']
 
 
 # ----------------------------------------------------------------------------------------------------------------------
 class SimulationConstructionError(Exception): pass
 class SimulationConstructionWarning(Warning): pass
+class SimulationError(Exception): pass
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -243,6 +248,654 @@ class YearTimer(Timer):
 # class CalDayTimer(Timer):
 
 
+# ----------------------------------------------------------------------------------------------------------------------
+class CompInstr(object):
+    """Per-iteration computational instrumentation of a simulation.
+
+    For every iteration, the wall time is recorded along with its breakdown into the phases listed in ``PHASES``,
+    memory usage, and the numbers of groups and sites.  The simulation and the population tell the instrument which
+    phase they enter (see :meth:`~pram.sim.CompInstr.switch`) and the time elapsed between two switches is attributed
+    to the phase being left.  That costs one clock read per switch and only happens while an instrument is attached
+    (see :meth:`Simulation.set_instr() <pram.sim.Simulation.set_instr>`).  When rules are applied in worker processes
+    (see the ``par_apply_rules`` pragma), the time spent in workers is attributed to the ``rule_apply`` phase as a
+    whole.
+
+    Memory usage is recorded as resident set size (RSS) always, as unique set size (USS) if requested and permitted by
+    the operating system, and as the current and peak size of memory blocks traced by the ``tracemalloc`` module if
+    requested (tracing is started if needed; note that it slows Python down considerably).  Unavailable measurements
+    are recorded as -1.
+
+    The recorded history is available as a NumPy structured array (see :meth:`~pram.sim.CompInstr.get_arr`) and can
+    be persisted into the probe database (see :meth:`~pram.sim.CompInstr.save_db`).  Subclasses can record additional
+    quantities by overriding :meth:`~pram.sim.CompInstr.get_mem` or :meth:`~pram.sim.CompInstr.iter_end`.
+
+    Args:
+        do_uss (bool): Record USS?  That requires reading the process' full memory map which is slower.
+        do_tracemalloc (bool): Record memory traced by ``tracemalloc``?
+        persistence (ProbePersistenceDB, optional): Probe persistence the history should be saved into at the end of
+            every simulation run.
+    """
+
+    PHASES = ('rule_applicable', 'rule_apply', 'split', 'transfer_mass', 'persistence', 'sim_rules', 'probes', 'post_iter', 'other')
+
+    RULE_APPLICABLE = 0
+    RULE_APPLY      = 1
+    SPLIT           = 2
+    TRANSFER_MASS   = 3
+    PERSISTENCE     = 4
+    SIM_RULES       = 5
+    PROBES          = 6
+    POST_ITER       = 7
+    OTHER           = 8
+
+    def __init__(self, do_uss=False, do_tracemalloc=False, persistence=None):
+        self.do_uss = do_uss
+        self.do_tracemalloc = do_tracemalloc
+        self.persistence = persistence
+
+        self.phase = self.__class__.OTHER
+        self.t_phase = [0.0] * len(self.__class__.PHASES)  # time per phase in the current iteration [s]
+        self.t_last = time.perf_counter()  # time of the most recent phase switch
+        self.t_iter_0 = None  # time the current iteration started (None outside of an iteration)
+
+        self.iter = None   # the current iteration
+        self.rows = []     # one tuple per iteration (see get_dtype())
+        self.n_saved = 0   # number of rows saved to the database already
+
+        if self.do_tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def __getstate__(self):
+        return { **self.__dict__, 'persistence': None }  # database connections can't be pickled
+
+    def get_arr(self):
+        """Get the recorded history.
+
+        Returns:
+            numpy.ndarray: Structured array with one element per iteration (see
+                :meth:`~pram.sim.CompInstr.get_dtype`).
+        """
+
+        return np.array(self.rows, dtype=self.get_dtype())
+
+    def get_dtype(self):
+        """Get the data type of the recorded history.
+
+        Fields are: ``iter``, ``t_iter`` (time per iteration [ms]), ``t_<phase>`` (time per phase [ms]; one field per
+        phase), ``mem_rss``, ``mem_uss``, ``mem_py``, ``mem_py_peak`` (memory [B]), ``n_group``, and ``n_site``.
+
+        Returns:
+            numpy.dtype
+        """
+
+        return np.dtype(
+            [('iter', np.int64), ('t_iter', np.float64)] +
+            [(f't_{p}', np.float64) for p in self.__class__.PHASES] +
+            [('mem_rss', np.int64), ('mem_uss', np.int64), ('mem_py', np.int64), ('mem_py_peak', np.int64), ('n_group', np.int64), ('n_site', np.int64)]
+        )
+
+    def get_mem(self):
+        """Get current memory usage.
+
+        Returns:
+            tuple(int, int, int, int): RSS, USS, traced current, and traced peak memory [B]; -1 if unavailable.
+        """
+
+        proc = psutil.Process()
+        rss = proc.memory_info().rss
+        uss = -1
+        if self.do_uss:
+            try:
+                uss = proc.memory_full_info().uss
+            except (psutil.AccessDenied, AttributeError):
+                self.do_uss = False
+        (py, py_peak) = tracemalloc.get_traced_memory() if self.do_tracemalloc and tracemalloc.is_tracing() else (-1, -1)
+        return (rss, uss, py, py_peak)
+
+    def get_t_tot(self):
+        """Get total time spent in every phase across all iterations recorded.
+
+        Returns:
+            Mapping[str, float]: Phase name to time [ms].
+        """
+
+        i0 = 2
+        return { p: math.fsum(r[i0 + i] for r in self.rows) for (i,p) in enumerate(self.__class__.PHASES) }
+
+    def iter_end(self, pop):
+        """Ends the current iteration and records it.  Does nothing outside of an iteration.
+
+        Args:
+            pop (GroupPopulation): The population.
+
+        Returns:
+            ``self``
+        """
+
+        if self.t_iter_0 is None:
+            return self
+
+        self.switch(self.__class__.OTHER)
+        t_iter = (self.t_last - self.t_iter_0) * 1000
+        self.rows.append((self.iter, t_iter, *[t * 1000 for t in self.t_phase], *self.get_mem(), pop.get_group_cnt(), pop.get_site_cnt()))
+        self.t_iter_0 = None
+        return self
+
+    def iter_start(self, iter, pop):
+        """Starts a new iteration (ending the current one if necessary).
+
+        Args:
+            iter (int): The iteration.
+            pop (GroupPopulation): The population.
+
+        Returns:
+            ``self``
+        """
+
+        self.iter_end(pop)
+        self.iter = iter
+        self.phase = self.__class__.OTHER
+        self.t_phase = [0.0] * len(self.__class__.PHASES)
+        self.t_last = self.t_iter_0 = time.perf_counter()
+        return self
+
+    def reset(self):
+        """Forgets the recorded history.
+
+        Returns:
+            ``self``
+        """
+
+        self.rows = []
+        self.n_saved = 0
+        self.t_iter_0 = None
+        return self
+
+    def save_db(self, conn, traj_id=None, tbl='comp_hist'):
+        """Saves iterations recorded since the last call into a database table (created if it doesn't exist).
+
+        Args:
+            conn (sqlite3.Connection): Database connection.
+            traj_id (int, optional): ID of the trajectory the simulation belongs to.
+            tbl (str): Table name.
+
+        Returns:
+            ``self``
+        """
+
+        dtype = self.get_dtype()
+        cols = ['traj_id'] + list(dtype.names)
+        with conn as c:
+            c.execute(f'CREATE TABLE IF NOT EXISTS {tbl} (' + ', '.join(f'{n} {"REAL" if n.startswith("t_") else "INTEGER"}' for n in cols) + ')')
+            c.executemany(
+                f'INSERT INTO {tbl} ({", ".join(cols)}) VALUES ({", ".join(["?"] * len(cols))})',
+                [(traj_id, *r) for r in self.rows[self.n_saved:]]
+            )
+        self.n_saved = len(self.rows)
+        return self
+
+    def switch(self, phase):
+        """Attributes time elapsed since the last switch to the current phase and enters the phase specified.
+
+        Args:
+            phase (int): The phase (e.g., ``CompInstr.SPLIT``).
+
+        Returns:
+            int: The phase left (so that the caller can switch back to it).
+        """
+
+        t = time.perf_counter()
+        self.t_phase[self.phase] += t - self.t_last
+        self.t_last = t
+        (phase, self.phase) = (self.phase, phase)
+        return phase
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+class CompProf(object):
+    """Profiler attributing computation time to individual rules, simulation rules, and probes.
+
+    While attached to a running simulation (see :meth:`Simulation.set_prof() <pram.sim.Simulation.set_prof>`), the
+    ``is_applicable()`` and ``apply()`` methods of every rule and simulation rule and the ``run()`` method of every probe
+    are wrapped so that the number of calls and the time spent in them (cumulative and exclusive of the other wrapped
+    calls they make) is recorded per call stack.  Every instance is profiled separately, even if several instances of
+    the same class are used.  The wrappers are set on the instances (not their classes) and are removed when the
+    simulation run ends (even if it ends with an exception).
+
+    A wrapped rule is never applied in the batched, transition-matrix form (see :meth:`Rule.get_transition_matrix()
+    <pram.rule.Rule.get_transition_matrix>`); its ``apply()`` is called for every group instead so that the profile
+    accounts for all of them.  Profiled runs of models with matrix-expressible rules are therefore slower than
+    unprofiled ones and the rules' share of the total time is higher.
+
+    The results can be displayed as a report sorted by cost (see :meth:`~pram.sim.CompProf.print_report`) or saved as a
+    file of folded stacks (see :meth:`~pram.sim.CompProf.save_folded`) which can be rendered by flame graph tools (e.g.,
+    ``flamegraph.pl`` or speedscope).
+
+    Calls made in worker processes (see the ``par_apply_rules`` pragma) are not recorded.
+    """
+
+    ROOT = 'run'  # the frame all stacks start at
+
+    def __init__(self):
+        self.stats = {}    # stack (tuple of frames) to [call count, cumulative time [s], exclusive time [s]]
+        self.stack = [self.__class__.ROOT]  # frames currently executing
+        self.t_child = []  # time spent in wrapped calls made by frames currently executing [s]
+        self.t_run = 0.0   # total time the profiler has been attached for [s]
+        self.t_run_0 = None
+        self.wrapped = []  # (object, method name, method found in the object's __dict__ or None)
+
+    def _wrap(self, obj, name, label):
+        """Replaces an object's method with a wrapper which records calls to it."""
+
+        fn = getattr(obj, name)
+        frame = f'{label}.{name}'
+        prof = self
+
+        def wrapper(*args, **kwargs):
+            prof.stack.append(frame)
+            prof.t_child.append(0.0)
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                t = time.perf_counter() - t0
+                t_child = prof.t_child.pop()
+                if len(prof.t_child) > 0:
+                    prof.t_child[-1] += t
+                s = prof.stats.get(tuple(prof.stack))
+                if s is None:
+                    s = prof.stats[tuple(prof.stack)] = [0, 0.0, 0.0]
+                s[0] += 1
+                s[1] += t
+                s[2] += t - t_child
+                prof.stack.pop()
+
+        self.wrapped.append((obj, name, obj.__dict__.get(name)))
+        setattr(obj, name, wrapper)
+
+    def attach(self, sim):
+        """Wraps methods of the simulation's rules, simulation rules, and probes.
+
+        Args:
+            sim (Simulation): The simulation.
+
+        Returns:
+            ``self``
+        """
+
+        labels = Counter()
+
+        def get_label(kind, obj):
+            label = f'{kind} {obj.__class__.__name__}({getattr(obj, "name", "")})'.replace(';', ',')
+            labels[label] += 1
+            return label if labels[label] == 1 else f'{label}#{labels[label]}'
+
+        for r in sim.rules:
+            label = get_label('rule', r)
+            self._wrap(r, 'is_applicable', label)
+            self._wrap(r, 'apply', label)
+        for r in sim.sim_rules:
+            label = get_label('sim-rule', r)
+            self._wrap(r, 'is_applicable', label)
+            self._wrap(r, 'apply', label)
+        for p in sim.probes:
+            self._wrap(p, 'run', get_label('probe', p))
+
+        self.t_run_0 = time.perf_counter()
+        return self
+
+    def detach(self):
+        """Restores all wrapped methods.
+
+        Returns:
+            ``self``
+        """
+
+        for (obj, name, fn) in reversed(self.wrapped):
+            if fn is None:
+                delattr(obj, name)
+            else:
+                setattr(obj, name, fn)
+        self.wrapped = []
+
+        if self.t_run_0 is not None:
+            self.t_run += time.perf_counter() - self.t_run_0
+            self.t_run_0 = None
+        return self
+
+    def get_report(self):
+        """Get the per-frame summary of the profile, sorted by cumulative time (descending).
+
+        Returns:
+            list[Mapping[str, Any]]: One dict per frame (i.e., rule or probe method) with the following items: ``frame``,
+                ``n`` (call count), ``t_cum`` (cumulative time [s]), ``t_self`` (exclusive time [s]), and ``t_call``
+                (mean cumulative time per call [s]).
+        """
+
+        frames = {}
+        for (stack, (n, t_cum, t_self)) in self.stats.items():
+            f = frames.setdefault(stack[-1], [0, 0.0, 0.0])
+            f[0] += n
+            f[2] += t_self
+            if stack[-1] not in stack[:-1]:  # recursive calls are already included in the outermost call's time
+                f[1] += t_cum
+
+        return sorted(
+            [{ 'frame': k, 'n': n, 't_cum': t_cum, 't_self': t_self, 't_call': t_cum / n } for (k, (n, t_cum, t_self)) in frames.items()],
+            key=lambda x: x['t_cum'], reverse=True
+        )
+
+    def print_report(self, n=None):
+        """Prints the per-frame summary of the profile (see :meth:`~pram.sim.CompProf.get_report`).
+
+        Args:
+            n (int, optional): Maximum number of frames to print (all by default).
+        """
+
+        report = self.get_report()[:n]
+        w = max([len(r['frame']) for r in report] + [5])
+        print(f'Profile (total time: {self.t_run:.3f} s)')
+        print(f'    {"Frame":{w}}  {"Calls":>10}  {"Cum [s]":>10}  {"Self [s]":>10}  {"Per call [us]":>14}  {"Cum [%]":>8}')
+        for r in report:
+            p = r['t_cum'] / self.t_run * 100 if self.t_run > 0 else 0
+            print(f'    {r["frame"]:{w}}  {r["n"]:>10}  {r["t_cum"]:>10.3f}  {r["t_self"]:>10.3f}  {r["t_call"] * 1e6:>14.1f}  {p:>8.1f}')
+
+    def reset(self):
+        """Forgets the recorded profile.
+
+        Returns:
+            ``self``
+        """
+
+        self.stats = {}
+        self.t_run = 0.0
+        return self
+
+    def save_folded(self, fpath):
+        """Saves the profile as folded stacks (one ``frame;frame;...;frame <microseconds>`` line per stack).
+
+        Time not spent in any of the profiled methods is attributed to the root frame.
+
+        Args:
+            fpath (str): Destination file path.
+
+        Returns:
+            ``self``
+        """
+
+        t_top = math.fsum(t_cum for (stack, (_, t_cum, _)) in self.stats.items() if len(stack) == 2)
+        with open(fpath, 'w') as f:
+            f.write(f'{self.__class__.ROOT} {max(int(round((self.t_run - t_top) * 1e6)), 0)}\n')
+            for (stack, (_, _, t_self)) in sorted(self.stats.items()):
+                f.write(f'{";".join(stack)} {int(round(t_self * 1e6))}\n')
+        return self
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+class Checkpoint(object):
+    """Incremental binary checkpoints of a running simulation.
+
+    While attached to a simulation (see :meth:`Simulation.set_checkpoint() <pram.sim.Simulation.set_checkpoint>`), the
+    simulation state is written to a directory when the run starts and then every ``every`` iterations.  Only the state
+    that evolves as the simulation runs is written: group masses, group definitions, sites, the timer, and the states
+    of the ``random`` and ``numpy`` pseudo-random number generators.  Rules, probes, and everything else are expected to
+    be recreated by the code that set the simulation up in the first place.  That is what makes a checkpoint much
+    cheaper than pickling the entire simulation (see :meth:`Simulation.save() <pram.sim.Simulation.save>`).
+
+    Every checkpoint is a NumPy ``.npz`` file.  Groups are identified by integer IDs assigned in the order in which
+    they are first encountered and their definitions are written only once (in the checkpoint in which a group first
+    appears).  Attributes and relations are interned so that every distinct attributes or relations dictionary is
+    pickled only once as well.  The first checkpoint holds masses of all groups; subsequent ones hold only masses that
+    have changed and IDs of groups that have been removed (unless a full snapshot is requested via ``full_every``).
+    Checkpoint files are written under temporary names and renamed; the manifest ('ckpt.json') is updated last so a
+    run killed while writing a checkpoint leaves the previous checkpoint intact.
+
+    A killed run is resumed with :meth:`Simulation.resume() <pram.sim.Simulation.resume>`.  Because the order of
+    groups is restored as well, a resumed run is identical to an uninterrupted one as long as rules keep no state of
+    their own (e.g., counters), which is not part of a checkpoint.
+
+    Args:
+        dpath (str): Directory to store the checkpoints in (created if necessary).
+        every (int): Checkpointing frequency in iterations.
+        full_every (int): Write a full snapshot instead of a delta every that many checkpoints (0 means only the first
+            checkpoint is full).  Full snapshots bound the number of deltas that need to be read on resume.
+    """
+
+    FNAME_MANIFEST = 'ckpt.json'
+
+    def __init__(self, dpath, every=100, full_every=0):
+        if every < 1:
+            raise ValueError('Checkpointing frequency must be a positive integer.')
+
+        self.dpath = dpath
+        self.every = every
+        self.full_every = full_every
+
+        self.manifest = { 'ckpts': [] }  # one entry per checkpoint file
+        self.is_restored = False  # flag: has the state below been restored from the existing checkpoints?
+
+        self.grp_ids  = {}     # group hash -> ID
+        self.attr_ids = {}     # interned attributes -> ID
+        self.rel_ids  = {}     # interned relations -> ID
+        self.site_hashes = set()
+        self.m = {}            # group ID -> mass as of the last checkpoint
+
+        os.makedirs(self.dpath, exist_ok=True)
+        fpath = os.path.join(self.dpath, self.FNAME_MANIFEST)
+        if os.path.isfile(fpath):
+            with open(fpath, 'r') as f:
+                self.manifest = json.load(f)
+
+    @staticmethod
+    def _intern(d, ids, new):
+        """Returns the ID of an attributes or relations dictionary adding it to the new ones if it hasn't been seen."""
+
+        k = pickle.dumps(sorted(d.items()))
+        i = ids.get(k)
+        if i is None:
+            i = ids[k] = len(ids)
+            new.append(d)
+        return i
+
+    @staticmethod
+    def _arr2obj(a):
+        return pickle.loads(a.tobytes())
+
+    @staticmethod
+    def _obj2arr(o):
+        return np.frombuffer(pickle.dumps(o), dtype=np.uint8)
+
+    def _save_manifest(self):
+        fpath = os.path.join(self.dpath, self.FNAME_MANIFEST)
+        with open(fpath + '.tmp', 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(fpath + '.tmp', fpath)
+
+    def get_fpath(self, i):
+        """Get the filepath of the checkpoint written at the designated iteration.
+
+        Args:
+            i (int): Iteration.
+
+        Returns:
+            str
+        """
+
+        return os.path.join(self.dpath, f'ckpt-{i:09d}.npz')
+
+    def has_series(self):
+        """Has a series of checkpoints been started (or restored) by this object?
+
+        Checkpoints found in the directory that have not been restored do not count.
+
+        Returns:
+            bool
+        """
+
+        return self.is_restored and len(self.manifest['ckpts']) > 0
+
+    def restore(self, sim):
+        """Restores the simulation to the state of the latest checkpoint.
+
+        The simulation needs to have been set up the same way as the one checkpointed (i.e., with the same rules,
+        probes, and so on).  Its groups are replaced with the checkpointed ones, sites missing from it are added, and the
+        timer, pseudo-random number generators, and the run count are restored.  The simulation timer is left at the
+        checkpointed iteration; the number of iterations the checkpointed run had left is returned instead.
+
+        Args:
+            sim (Simulation): The simulation.
+
+        Returns:
+            int: Number of iterations left in the checkpointed run or None if there are no checkpoints to restore.
+        """
+
+        ckpts = self.manifest['ckpts']
+        if len(ckpts) == 0:
+            return None
+
+        # (1) Read group definitions from all checkpoints and masses from the latest full one onward:
+        k_full = max(k for (k,c) in enumerate(ckpts) if c['is_full'])
+        attr_tbl, rel_tbl, grps, sites = [], [], {}, []
+        m = {}
+        for (k,c) in enumerate(ckpts):
+            with np.load(os.path.join(self.dpath, c['fname'])) as f:
+                tbl = self._arr2obj(f['tbl'])
+                attr_tbl.extend(tbl['attr'])
+                rel_tbl.extend(tbl['rel'])
+                sites.extend(tbl['sites'])
+                for (gid, h, a, r, name) in zip(f['grp_id'].tolist(), f['grp_hash'].tolist(), f['grp_attr'].tolist(), f['grp_rel'].tolist(), tbl['grp_name']):
+                    grps[gid] = (h, a, r, name)
+
+                if k == k_full:
+                    m = dict(zip(f['m_id'].tolist(), f['m'].tolist()))
+                elif k > k_full:
+                    for gid in f['del_id'].tolist():
+                        del m[gid]
+                    m.update(zip(f['m_id'].tolist(), f['m'].tolist()))
+
+                if k == len(ckpts) - 1:
+                    state = self._arr2obj(f['state'])
+
+        # (2) Restore the checkpointing state so that subsequent checkpoints continue the series:
+        self.grp_ids  = { h: gid for (gid, (h,_,_,_)) in grps.items() }
+        self.attr_ids = { pickle.dumps(sorted(d.items())): i for (i,d) in enumerate(attr_tbl) }
+        self.rel_ids  = { pickle.dumps(sorted(d.items())): i for (i,d) in enumerate(rel_tbl) }
+        self.site_hashes = set(h for (h,_,_,_) in sites)
+        self.m = m
+        self.is_restored = True
+
+        # (3) Restore the simulation:
+        for (h, name, attr, rel_name) in sites:
+            if h not in sim.pop.sites:
+                sim.pop.add_site(Site(name, attr, rel_name))
+
+        sim.pop.reset_groups([Group(grps[gid][3], m_g, attr_tbl[grps[gid][1]], rel_tbl[grps[gid][2]]) for (gid, m_g) in m.items()], state['pop_m'])
+        sim.pop.m_in  = state['pop_m_in']
+        sim.pop.m_out = state['pop_m_out']
+
+        sim.timer.i = state['i']
+        sim.timer.t = state['t']
+        sim.timer.t_loop_cnt = state['t_loop_cnt']
+        sim.timer.i_max = state['i']  # the next run adds to that
+        sim.run_cnt = state['run_cnt']
+        sim.is_setup_done = state['is_setup_done']
+
+        random.setstate(state['rand_state'])
+        np.random.set_state(state['np_rand_state'])
+
+        return state['i_max'] - state['i']
+
+    def write(self, sim):
+        """Writes a checkpoint of the simulation's current state.
+
+        If the directory holds checkpoints that have not been restored (i.e., they belong to a different run), they are
+        removed and a new series is started.
+
+        Args:
+            sim (Simulation): The simulation.
+
+        Returns:
+            ``self``
+        """
+
+        if not self.is_restored:
+            for c in self.manifest['ckpts']:
+                fpath = os.path.join(self.dpath, c['fname'])
+                if os.path.isfile(fpath):
+                    os.remove(fpath)
+            self.manifest = { 'ckpts': [] }
+            self.is_restored = True
+
+        pop = sim.pop
+        n_ckpt = len(self.manifest['ckpts'])
+        is_full = n_ckpt == 0 or (self.full_every > 0 and n_ckpt % self.full_every == 0)
+
+        # (1) Group masses and new definitions:
+        new_grp, new_attr, new_rel = [], [], []
+        ids = np.empty(len(pop.groups), dtype=np.int64)
+        m   = np.empty(len(pop.groups), dtype=np.float64)
+        for (k,g) in enumerate(pop.groups.values()):
+            h = g.get_hash()
+            gid = self.grp_ids.get(h)
+            if gid is None:
+                gid = self.grp_ids[h] = len(self.grp_ids)
+                new_grp.append((gid, h, self._intern(g.attr, self.attr_ids, new_attr), self._intern(g.rel, self.rel_ids, new_rel), g.name))
+            ids[k] = gid
+            m[k] = g.m
+
+        new_sites = []
+        for (h,s) in pop.sites.items():
+            if h not in self.site_hashes:
+                self.site_hashes.add(h)
+                new_sites.append((h, s.name, s.attr, s.rel_name))
+
+        # (2) Masses to write:
+        if is_full:
+            (m_id, m_val, del_id) = (ids, m, np.empty(0, dtype=np.int64))
+        else:
+            m_prev = np.array([self.m.get(gid, np.nan) for gid in ids.tolist()], dtype=np.float64)
+            sel = ~(m_prev == m)
+            (m_id, m_val) = (ids[sel], m[sel])
+            del_id = np.array(sorted(set(self.m.keys()).difference(ids.tolist())), dtype=np.int64)
+        self.m = dict(zip(ids.tolist(), m.tolist()))
+
+        # (3) Write:
+        state = {
+            'i'             : sim.timer.i,
+            't'             : sim.timer.t,
+            't_loop_cnt'    : sim.timer.t_loop_cnt,
+            'i_max'         : sim.timer.i_max,
+            'run_cnt'       : sim.run_cnt,
+            'is_setup_done' : sim.is_setup_done,
+            'pop_m'         : pop.m,
+            'pop_m_in'      : pop.m_in,
+            'pop_m_out'     : pop.m_out,
+            'rand_state'    : random.getstate(),
+            'np_rand_state' : np.random.get_state()
+        }
+        tbl = { 'attr': new_attr, 'rel': new_rel, 'sites': new_sites, 'grp_name': [g[4] for g in new_grp] }
+
+        fpath = self.get_fpath(sim.timer.i)
+        with open(fpath + '.tmp', 'wb') as f:
+            np.savez(f,
+                grp_id   = np.array([g[0] for g in new_grp], dtype=np.int64),
+                grp_hash = np.array([g[1] for g in new_grp], dtype=np.uint64),
+                grp_attr = np.array([g[2] for g in new_grp], dtype=np.int64),
+                grp_rel  = np.array([g[3] for g in new_grp], dtype=np.int64),
+                m_id     = m_id,
+                m        = m_val,
+                del_id   = del_id,
+                tbl      = self._obj2arr(tbl),
+                state    = self._obj2arr(state)
+            )
+        os.replace(fpath + '.tmp', fpath)
+
+        self.manifest['ckpts'].append({ 'i': sim.timer.i, 'fname': os.path.basename(fpath), 'is_full': is_full })
+        self._save_manifest()
+
+        return self
+
+
 # ----------------------------------------------------------------------------------------------------------------------
 class DynamicRuleAnalyzer(object):
     """Infers group attributes and relations conditioned upon based on running a simulation.
@@ -379,29 +1032,51 @@ class StaticRuleAnalyzer(object):
                     attr = list(ast.iter_fields(node))[0][1]
                     attr_name = list(ast.iter_fields(attr))[1][1]
 
-                    if attr_name in ('get_attr', 'get_rel', 'has_attr', 'has_rel', 'ga', 'gr', 'ha', 'hr'):
+                    if attr_name in ('get_attr', 'get_rel', 'has_attr', 'has_rel', 'ga', 'gr', 'ha', 'hr') and len(call_args) > 0:
                         call_args = call_args[0]
-                        if call_args.__class__.__name__ == 'Str':
-                            if attr_name in ('get_attr', 'has_attr', 'ga', 'ha'):
-                                self.attr_used.add(StaticRuleAnalyzer.get_str(call_args))
+                        used = self.attr_used if attr_name in ('get_attr', 'has_attr', 'ga', 'ha') else self.rel_used
+                        if call_args.__class__.__name__ in ('List', 'Tuple', 'Set', 'Dict'):
+                            items = list(ast.iter_fields(call_args))[0][1]
+                        else:
+                            items = [call_args]
+                        for i in items:
+                            names = self._resolve(i)
+                            if names is not None:
+                                used.update(names)
+                                self.cnt_rec[attr_name] += 1
                             else:
-                                self.rel_used.add(StaticRuleAnalyzer.get_str(call_args))
-                            self.cnt_rec[attr_name] += 1
-                        elif call_args.__class__.__name__ in ('List', 'Dict'):
-                            for i in list(ast.iter_fields(call_args))[0][1]:
-                                if i.__class__.__name__ == 'Str':
-                                    if attr_name in ('get_attr', 'has_attr', 'ga', 'ha'):
-                                        self.attr_used.add(StaticRuleAnalyzer.get_str(i))
-                                    else:
-                                        self.rel_used.add(StaticRuleAnalyzer.get_str(i))
-                                    self.cnt_rec[attr_name] += 1
-                                else:
-                                    self.cnt_unrec[attr_name] += 1
-                                    # print(list(ast.iter_fields(i)))
+                                self.cnt_unrec[attr_name] += 1
+                                # print(list(ast.iter_fields(i)))
         elif isinstance(node, list):
             for i in node:
                 self._analyze(i)
 
+    def _resolve(self, node):
+        """Resolves an argument of an attribute or relation accessor into names.
+
+        Besides string literals, ``Site.AT`` and instance variables of the rule being analyzed (i.e., ``self.name``)
+        holding a string, an iterable of strings, or a mapping with string keys are resolved (the latter works because
+        rule objects, not just their classes, are analyzed).
+
+        Returns:
+            list[str]: Names or None if the node cannot be resolved.
+        """
+
+        cls = node.__class__.__name__
+        if cls in ('Str', 'Constant'):
+            v = StaticRuleAnalyzer.get_str(node)
+            return [v] if isinstance(v, str) else None
+        if cls == 'Attribute' and isinstance(node.value, ast.Name):
+            if node.value.id == 'Site' and node.attr == 'AT':
+                return [Site.AT]
+            if node.value.id == 'self' and self.rule is not None:
+                v = getattr(self.rule, node.attr, None)
+                if isinstance(v, str):
+                    return [v]
+                if isinstance(v, (list, tuple, set, frozenset, dict)) and all(isinstance(i, str) for i in v):
+                    return list(v)
+        return None
+
     def analyze_rules(self, rules):
         """
         Can be (and in fact is) called before any groups have been added.
@@ -417,6 +1092,8 @@ class StaticRuleAnalyzer(object):
         self.cnt_rec   = Counter({ 'get_attr': 0, 'get_rel': 0, 'has_attr': 0, 'has_rel': 0 })  # recognized
         self.cnt_unrec = Counter({ 'get_attr': 0, 'get_rel': 0, 'has_attr': 0, 'has_rel': 0 })  # unrecognized
 
+        self.cls_unrec = set()
+
         # (2) Analyze the rules:
         for r in rules:
             self.analyze_rule(r)
@@ -440,16 +1117,30 @@ class StaticRuleAnalyzer(object):
         self.are_groups_done = True
 
     def analyze_rule(self, rule):
-        tree = ast.fix_missing_locations(ast.parse(inspect.getsource(rule.__class__)))
+        """
+        The rule's class and all its ancestors that are rules are analyzed.  Classes the source code of which is not
+        available (e.g., those defined interactively) are recorded in ``self.cls_unrec``.
+        """
 
-        for node in ast.walk(tree):
-            if not isinstance(node, ast.ClassDef): continue  # skip non-classes
+        self.rule = rule
+        for cls in type(rule).__mro__:
+            if not issubclass(cls, Rule):
+                continue
+            try:
+                tree = ast.fix_missing_locations(ast.parse(textwrap.dedent(inspect.getsource(cls))))
+            except (OSError, TypeError):
+                self.cls_unrec.add(cls.__name__)
+                continue
 
-            for node_fn in node.body:
-                if not isinstance(node_fn, ast.FunctionDef): continue  # skip non-methods
-                self._analyze(node_fn.body)
+            for node in ast.walk(tree):
+                if not isinstance(node, ast.ClassDef): continue  # skip non-classes
 
-                # if node_fn.name in ('is_applicable'): print(self._analyze_01(node_fn.body))
+                for node_fn in node.body:
+                    if not isinstance(node_fn, ast.FunctionDef): continue  # skip non-methods
+                    self._analyze(node_fn.body)
+
+                    # if node_fn.name in ('is_applicable'): print(self._analyze_01(node_fn.body))
+        self.rule = None
 
     def dump(self, rule):
         tree = ast.fix_missing_locations(ast.parse(inspect.getsource(rule.__class__)))
@@ -459,10 +1150,25 @@ class StaticRuleAnalyzer(object):
     def get_str(node):
         return list(ast.iter_fields(node))[0][1]
 
+    def is_conclusive(self):
+        """Checks if all attribute and relation references found in the rules have been resolved into names.
+
+        Even if they have, rules can still access group attributes and relations in ways the analysis doesn't
+        recognize (e.g., via the ``attr`` and ``rel`` dictionaries directly).
+
+        Returns:
+            bool
+        """
+
+        return self.are_rules_done and sum(self.cnt_unrec.values()) == 0 and len(self.cls_unrec) == 0
+
     def reset(self):
         self.are_rules_done  = False
         self.are_groups_done = False
 
+        self.rule = None  # the rule being analyzed
+        self.cls_unrec = set()  # names of classes that couldn't be analyzed
+
         self.attr_used = set()
         self.rel_used  = set()
 
@@ -765,6 +1471,12 @@ class SimulationSetter(object):
         self.sim.set_cb_check_work(fn)
         return self
 
+    def cb_fork(self, fn):
+        """Shortcut to :meth:`Simulation.set_cb_fork() <pram.sim.Simulation.set_cb_fork>`."""
+
+        self.sim.set_cb_fork(fn)
+        return self
+
     def cb_save_state(self, fn):
         """Shortcut to :meth:`Simulation.set_cb_save_state() <pram.sim.Simulation.set_cb_save_state>`."""
 
@@ -804,16 +1516,28 @@ class SimulationSetter(object):
         self.sim.set_fn_group_setup(fn)
         return self
 
+    def instr(self, instr):
+        """Shortcut to :meth:`Simulation.set_instr() <pram.sim.Simulation.set_instr>`."""
+
+        self.sim.set_instr(instr)
+        return self
+
+    def prof(self, prof):
+        """Shortcut to :meth:`Simulation.set_prof() <pram.sim.Simulation.set_prof>`."""
+
+        self.sim.set_prof(prof)
+        return self
+
     def pragma(self, name, value):
         """Shortcut to :meth:`Simulation.set_pragma() <pram.sim.Simulation.set_pragma>`."""
 
         self.sim.set_pragma(name, value)
         return self
 
-    def pragmas(self, analyze=None, autocompact=None, autoprune_groups=None, autostop=None, autostop_n=None, autostop_p=None, autostop_t=None, comp_summary=None, fractional_mass=None, live_info=None, live_info_ts=None, probe_capture_init=None, rule_analysis_for_db_gen=None):
+    def pragmas(self, analyze=None, autocompact=None, autoprune_groups=None, autostop=None, autostop_n=None, autostop_p=None, autostop_t=None, comp_summary=None, fractional_mass=None, live_info=None, live_info_ts=None, probe_capture_init=None, rule_analysis_for_db_gen=None, vectorized_mass=None, par_apply_rules=None, mass_flow_rec=None):
         """Shortcut to :meth:`Simulation.set_pragmas() <pram.sim.Simulation.set_pragmas>`."""
 
-        self.sim.set_pragmas(analyze, autocompact, autoprune_groups, autostop, autostop_n, autostop_p, autostop_t, comp_summary, fractional_mass, live_info, live_info_ts, probe_capture_init, rule_analysis_for_db_gen)
+        self.sim.set_pragmas(analyze, autocompact, autoprune_groups, autostop, autostop_n, autostop_p, autostop_t, comp_summary, fractional_mass, live_info, live_info_ts, probe_capture_init, rule_analysis_for_db_gen, vectorized_mass, par_apply_rules, mass_flow_rec)
         return self
 
     def pragma_analyze(self, value):
@@ -894,6 +1618,24 @@ class SimulationSetter(object):
         self.sim.set_pragma_rule_analysis_for_db_gen(value)
         return self
 
+    def pragma_vectorized_mass(self, value):
+        """Shortcut to :meth:`Simulation.set_pragma_vectorized_mass() <pram.sim.Simulation.set_pragma_vectorized_mass>`."""
+
+        self.sim.set_pragma_vectorized_mass(value)
+        return self
+
+    def pragma_par_apply_rules(self, value):
+        """Shortcut to :meth:`Simulation.set_pragma_par_apply_rules() <pram.sim.Simulation.set_pragma_par_apply_rules>`."""
+
+        self.sim.set_pragma_par_apply_rules(value)
+        return self
+
+    def pragma_mass_flow_rec(self, value):
+        """Shortcut to :meth:`Simulation.set_pragma_mass_flow_rec() <pram.sim.Simulation.set_pragma_mass_flow_rec>`."""
+
+        self.sim.set_pragma_mass_flow_rec(value)
+        return self
+
     def rand_seed(self, rand_seed):
         """Shortcut to :meth:`Simulation.set_rand_seed() <pram.sim.Simulation.set_rand_seed>`."""
 
@@ -951,6 +1693,8 @@ class Simulation(object):
             :class:`pop.MassFlowSpec <pram.pop.MassFlowSpec>` classes.
     """
 
+    MASS_FLOW_REC = ('none', 'aggr', 'sparse', 'full')  # mass flow recording levels (see the 'mass_flow_rec' pragma)
+
     def __init__(self, pop_hist_len=0, traj_id=None, rand_seed=None, do_keep_mass_flow_specs=False):
         self.set_rand_seed(rand_seed)
 
@@ -962,6 +1706,15 @@ class Simulation(object):
         self.rules = []
         self.sim_rules = []
         self.probes = []
+        self.probe_qry_plan = None  # GroupQryPlan with queries of all group probes; built on first use
+        self.instr = None  # CompInstr; see set_instr()
+        self.prof  = None  # CompProf; see set_prof()
+        self.ckpt  = None  # Checkpoint; see set_checkpoint()
+
+        self.state_group_hashes = set()  # groups whose definitions the save state callback has already received
+
+        self.directives = []  # directives issued by simulation rules during the current iteration
+        self.forks = []  # branches forked without a fork callback set; see run__directives()
 
         self.timer = None  # value deduced in add_group() based on rule timers
 
@@ -1002,6 +1755,26 @@ class Simulation(object):
         else:
             print(f'[info] {msg}')
 
+    def _run_probes(self, iter, t):
+        """Runs all probes.
+
+        Queries of all group probes are evaluated jointly in a single pass over the population first (see
+        :class:`~pram.pop.GroupQryPlan`) so that the probes' calls to
+        :meth:`~pram.pop.GroupPopulation.get_groups_mass` do not need to scan the population.
+
+        Args:
+            iter (int): The simulation iteration.
+            t (int): The simulation time.
+        """
+
+        if self.probe_qry_plan is None:
+            self.probe_qry_plan = GroupQryPlan(q for p in self.probes if isinstance(p, GroupProbe) for q in [p.qry_tot, *p.queries])
+        if len(self.probe_qry_plan) > 0:
+            self.pop.eval_qry_plan(self.probe_qry_plan)
+
+        for p in self.probes:
+            p.run(iter, t, self.traj_id)
+
     def add(self, lst=None):
         """Simulation element adder.
 
@@ -1091,6 +1864,7 @@ class Simulation(object):
 
         self.pop.ar_enc.encode_probe(probe)
         self.probes.append(probe)
+        self.probe_qry_plan = None
         probe.set_pop(self.pop)
         return self
 
@@ -1323,6 +2097,44 @@ class Simulation(object):
 
         return SimulationDBI(self, db)
 
+    def fork(self):
+        """Copy the simulation so that the copy can be run independently of the original.
+
+        Everything the simulation state is made of (i.e., the population, rules, probes, variables, and the timer) is
+        copied.  Callback functions and the persistence objects of probes are shared with the original instead while
+        the computational instrument, profiler, and checkpoint are not carried over.  The copy's timer is stopped at
+        the current iteration so that the copy's next run continues from where the original is.
+
+        Returns:
+            Simulation
+        """
+
+        memo = { id(fn): fn for fn in self.cb.values() if fn is not None }
+        memo.update({ id(p.persistence): p.persistence for p in self.probes if getattr(p, 'persistence', None) is not None })
+        for o in (self.instr, self.prof, self.ckpt, getattr(self, 'traj', None), self.pop.par_pool):
+            memo[id(o)] = None
+
+        directives = self.directives
+        self.directives = []
+        try:
+            sim = copy.deepcopy(self, memo)
+        finally:
+            self.directives = directives
+
+        sim.instr = None
+        sim.prof  = None
+        sim.ckpt  = None
+        sim.traj_id = None
+        sim.forks = []
+        if hasattr(sim, 'traj'):
+            sim.traj = None
+
+        sim.timer.i_max = sim.timer.i
+        sim.timer.is_running = False
+        sim.running.is_running = False
+
+        return sim
+
     def gen_diagram(self, fpath_diag, fpath_pdf):
         """Generates a simulation diagram.
 
@@ -1525,8 +2337,11 @@ class Simulation(object):
     def get_comp_hist(self):
         """Retrieves computational history.
 
+        A finer-grained history (e.g., with a breakdown of iteration time by phase) is recorded by an instrument
+        attached with :meth:`~pram.sim.Simulation.set_instr`.
+
         The computational history dict contains the following items:
-        - **mem_iter** (*Iterable[int]): Memory usage per iteration [B].
+        - **mem_iter** (*Iterable[int]): Memory usage (resident set size) per iteration [B].
         - **t_iter** (*Iterable[int]): Time per iteration [ms].
         - **t_sim** (*int*): Total simulation time [ms].
 
@@ -1543,7 +2358,9 @@ class Simulation(object):
 
         - **analyze** (*bool*): Should static and dynamic rule analyses be performed?
         - **autocompact** (*bool*): Should the simulation be autocompacted after every iteration?
-        - **autoprune_groups** (*bool*): Should empty groups be removed after every iteration?
+        - **autoprune_groups** (*bool*): Should groups be projected onto attributes and relations rules and probes
+          condition on (merging groups that become identical) before every run?  See
+          :meth:`~pram.sim.Simulation.run__autoprune_groups`.
         - **autostop** (*bool*): Should the simulation be stoped after stopping condition has been reached?
         - **autostop_n** (*bool*): Stopping condition: Mass smaller than specified has been transfered.
         - **autostop_p** (*bool*): Stopping condition: Mass proportion smaller than specified has been transfered.
@@ -1553,6 +2370,12 @@ class Simulation(object):
         - **partial_mass** (*bool*): Allow floating point group mass?  Integer is the default.
         - **probe_capture_init** (*bool*): Instruct probes to capture the initial state of the simulation?
         - **rule_analysis_for_db_gen** (*bool*):
+        - **vectorized_mass** (*bool*): Keep group masses in a contiguous NumPy array and transfer mass as one sparse matrix-vector product per iteration?
+        - **par_apply_rules** (*int*): Number of worker processes used to apply rules to groups (0 or 1 means rules are applied in the simulation's process).  Parallelism is opt-in on the part of rules as well: A single rule that has not declared itself safe to be applied in worker processes (see :attr:`Rule.PAR_SAFE <pram.rule.Rule.PAR_SAFE>`) disables it.  The worker processes are started once per run (see :meth:`GroupPopulation.apply_rules__par() <pram.pop.GroupPopulation.apply_rules__par>`).  Requires the ``fork`` start method.
+        - **mass_flow_rec** (*str*): Mass flow recording level, i.e., what the save state callback receives after every
+          iteration (see :meth:`~pram.sim.Simulation.save_state`).  One of ``none`` (nothing is recorded), ``aggr``
+          (group masses and the total mass transferred), ``sparse`` (group masses and mass flow as source hash,
+          destination hash, and mass triplets), and ``full`` (group definitions and mass flow specs; the default).
 
         Args:
             name (str): The pragma.
@@ -1574,7 +2397,10 @@ class Simulation(object):
             'live_info_ts'             : self.get_pragma_live_info_ts,
             'partial_mass'             : self.get_pragma_partial_mass,
             'probe_capture_init'       : self.get_pragma_probe_capture_init,
-            'rule_analysis_for_db_gen' : self.get_pragma_rule_analysis_for_db_gen
+            'rule_analysis_for_db_gen' : self.get_pragma_rule_analysis_for_db_gen,
+            'vectorized_mass'          : self.get_pragma_vectorized_mass,
+            'par_apply_rules'          : self.get_pragma_par_apply_rules,
+            'mass_flow_rec'            : self.get_pragma_mass_flow_rec
         }.get(name, None)
 
         if fn is None:
@@ -1647,6 +2473,21 @@ class Simulation(object):
 
         return self.pragma.rule_analysis_for_db_gen
 
+    def get_pragma_vectorized_mass(self):
+        """See :meth:`~pram.sim.Simulation.get_pragma`."""
+
+        return self.pragma.vectorized_mass
+
+    def get_pragma_par_apply_rules(self):
+        """See :meth:`~pram.sim.Simulation.get_pragma`."""
+
+        return self.pragma.par_apply_rules
+
+    def get_pragma_mass_flow_rec(self):
+        """See :meth:`~pram.sim.Simulation.get_pragma`."""
+
+        return self.pragma.mass_flow_rec
+
     def get_probe(self, name):
         for p in self.probes:
             if p.name == name:
@@ -1684,7 +2525,10 @@ class Simulation(object):
                     'live_info'                : self.get_pragma_live_info(),
                     'live_info_ts'             : self.get_pragma_live_info_ts(),
                     'probe_capture_init'       : self.get_pragma_probe_capture_init(),
-                    'rule_analysis_for_db_gen' : self.get_pragma_rule_analysis_for_db_gen()
+                    'rule_analysis_for_db_gen' : self.get_pragma_rule_analysis_for_db_gen(),
+                    'vectorized_mass'          : self.get_pragma_vectorized_mass(),
+                    'par_apply_rules'          : self.get_pragma_par_apply_rules(),
+                    'mass_flow_rec'            : self.get_pragma_mass_flow_rec()
                 }
             },
             'pop': {
@@ -1889,6 +2733,34 @@ class Simulation(object):
         else:
             return fig
 
+    def prune_groups(self, attr=(), rel=()):
+        """Removes the specified attributes and relations from all groups.
+
+        Groups that become identical as a result are merged (see :meth:`GroupPopulation.prune()
+        <pram.pop.GroupPopulation.prune>`).  Nothing checks whether rules or probes depend on the attributes and
+        relations removed; the ``autoprune_groups`` pragma does that (see :meth:`~pram.sim.Simulation.get_pragma`).
+
+        Args:
+            attr (Iterable[str]): Names of attributes to be removed.
+            rel (Iterable[str]): Names of relations to be removed.
+
+        Returns:
+            ``self``
+        """
+
+        attr = set(attr)
+        rel  = set(rel)
+        if len(attr) == 0 and len(rel) == 0:
+            return self
+
+        n = self.pop.prune(attr, rel)
+
+        self._inf(f'    Attributes removed     : {list(attr)}')
+        self._inf(f'    Relations removed      : {list(rel)}')
+        self._inf(f'    Groups merged          : {"{:,}".format(n)}')
+
+        return self
+
     def rem_probe(self, probe):
         """Removes the designated probe.
 
@@ -1900,6 +2772,7 @@ class Simulation(object):
         """
 
         self.probes.discard(probe)
+        self.probe_qry_plan = None
         return self
 
     def rem_rule(self, rule):
@@ -1923,11 +2796,17 @@ class Simulation(object):
             ``self``
         """
 
+        if self.cb.fork is _fork_remote:
+            self.cb.fork = None
         return self
 
     def remote_before(self):
         """Prepare the object for remote execution (on a cluster).
 
+        Unless a fork callback is set, one that raises :class:`~pram.sim.SimulationError` is installed; branches of a
+        :class:`~pram.rule.ForkDirective` would otherwise be silently lost (see
+        :meth:`~pram.sim.Simulation.run__directives`).
+
         Returns:
             ``self``
         """
@@ -1935,6 +2814,8 @@ class Simulation(object):
         if self.traj_id is not None:
             for p in self.probes:
                 p.set_traj_id(self.traj_id)
+        if self.cb.fork is None:
+            self.cb.fork = _fork_remote
         return self
 
     def reset_cb(self):
@@ -1944,6 +2825,7 @@ class Simulation(object):
         - **after_iter**: Call after iteration.
         - **before_iter**: Call before iteration.
         - **check_work**:
+        - **fork**: Call for every branch of a fork (see :meth:`~pram.sim.Simulation.set_cb_fork`).
         - **save_state**:
         - **upd_progress**:
 
@@ -1955,6 +2837,7 @@ class Simulation(object):
             after_iter   = None,
             before_iter  = None,
             check_work   = None,
+            fork         = None,
             save_state   = None,
             upd_progress = None
         )
@@ -1970,7 +2853,7 @@ class Simulation(object):
         """
 
         self.comp_hist = DotMap(  # computational history
-            mem_iter = [],        # memory usage per iteration [B]
+            mem_iter = [],        # memory usage (RSS) per iteration [B]
             t_iter = [],          # time per iteration [ms]
             t_sim = 0             # total simulation time [ms]
         )
@@ -2014,7 +2897,10 @@ class Simulation(object):
             live_info_ts = False,            #
             fractional_mass = False,         # flag: should fractional mass be allowed?
             probe_capture_init = True,       # flag: let probes capture the pre-run state of the simulation?
-            rule_analysis_for_db_gen = True  # flag: should static rule analysis results help form DB groups
+            rule_analysis_for_db_gen = True, # flag: should static rule analysis results help form DB groups
+            vectorized_mass = False,         # flag: keep group masses in a NumPy array and transfer them via sparse matrix-vector product?
+            par_apply_rules = 0,             # number of worker processes to apply rules to groups with (0 or 1 means no parallelism)
+            mass_flow_rec = 'full'           # mass flow recording level: none, aggr, sparse, or full
         )
         return self
 
@@ -2059,6 +2945,33 @@ class Simulation(object):
         self.vars = {}
         return self
 
+    def resume(self, ckpt, do_disp_t=False, do_disp_iter=False):
+        """Resume a run from the latest checkpoint.
+
+        The simulation needs to be set up the same way as the one that has been checkpointed (i.e., with the same
+        rules, probes, pragmas, and so on); its groups need not be.  The simulation is restored to the state of the
+        latest checkpoint and run for the number of iterations that the checkpointed run had left.  The checkpoint is
+        attached to the simulation so that the resumed run continues the series of checkpoints.  If there are no
+        checkpoints to restore, the simulation is not run.
+
+        Args:
+            ckpt (Checkpoint): The checkpoint.
+            do_disp_t (bool): Display simulation time at every iteration?  Useful for debugging.
+            do_disp_iter (bool): Display simulation iteration at every iteration?  Useful for debugging.
+
+        Returns:
+            ``self``
+        """
+
+        i_left = ckpt.restore(self)
+        if i_left is None:
+            return self
+
+        self.set_checkpoint(ckpt)
+        if i_left > 0:
+            self.run(i_left, do_disp_t, do_disp_iter)
+        return self
+
     def run(self, iter_or_dur=1, do_disp_t=False, do_disp_iter=False):
         """Run the simulation.
 
@@ -2083,6 +2996,7 @@ class Simulation(object):
             print('No groups are present\nExiting')
             return self
 
+        self.run__autoprune_groups()
         self.pop.freeze()  # masses of groups cannot be changed directly but only via the group-splitting mechanism
 
         # Decode iterations/duration:
@@ -2124,16 +3038,14 @@ class Simulation(object):
             self.compact()
 
         # Save last-iter info:
-        # self.comp_hist.mem_iter.append(psutil.Process(self.pid).memory_full_info().uss)  # TODO: ray doesn't work with memory_full_info() (access denied)
-        self.comp_hist.mem_iter.append(0)
+        self.comp_hist.mem_iter.append(psutil.Process().memory_info().rss)  # USS would need memory_full_info() which ray doesn't permit (access denied)
         self.comp_hist.t_iter.append(Time.ts() - ts_sim_0)
 
         # Force probes to capture the initial state:
         if self.pragma.probe_capture_init and self.run_cnt == 0:
             self._inf('Capturing the initial state')
 
-            for p in self.probes:
-                p.run(None, None, self.traj_id)
+            self._run_probes(None, None)
 
         # Run the simulation:
         self._inf('Initial population')
@@ -2145,89 +3057,130 @@ class Simulation(object):
         self.run_cnt += 1
         self.autostop_i = 0  # number of consecutive iterations the 'autostop' condition has been met for
 
-        self.timer.start()
-        for i in range(self.timer.get_i_left()):
-            if do_disp_iter:
-                print(i)
-
-            ts_iter_0 = Time.ts()
-
-            if self.cb.before_iter is not None:
-                self.cb.before_iter(self)
-
-            if self.pragma.live_info:
-                self._inf(f'Iteration {self.timer.i + 1} of {self.timer.i_max}')
-                self._inf(f'    Group count: {self.pop.get_group_cnt()}')
-            elif do_disp_t:
-                print(f't:{self.timer.get_t()}')
-
-            # Apply group rules:
-            self.pop.apply_rules(self.rules, self.timer.get_i(), self.timer.get_t())
-            m_flow = self.pop.last_iter.mass_flow_tot
-            m_pop = float(self.pop.get_mass())
-            if m_pop > 0:
-                p_flow = float(m_flow) / m_pop
-            else:
-                p_flow = None
-
-            # Apply simulation rules:
-            for r in self.sim_rules:
-                if r.is_applicable(self.timer.get_i(), self.timer.get_t()):
-                    r.apply(self, self.timer.get_i(), self.timer.get_t())
-
-            # Save last-iter info:
-            # self.comp_hist.mem_iter.append(psutil.Process(self.pid).memory_full_info().uss)  # TODO: ray doesn't work with memory_full_info() (access denied)
-            self.comp_hist.mem_iter.append(0)
-            self.comp_hist.t_iter.append(Time.ts() - ts_iter_0)
-
-            # Run probes:
-            for p in self.probes:
-                p.run(self.timer.get_i(), self.timer.get_t(), self.traj_id)
-
-            # Cleanup the population:
-            self.pop.do_post_iter()
-
-            # Advance timer:
-            self.timer.step()
-            self.running.progress += self.running.step
-
-            # Autostop:
-            if self.pragma.autostop and p_flow is not None:
-                if m_flow < self.pragma.autostop_n or p_flow < self.pragma.autostop_p:
-                    self.autostop_i += 1
+        instr = self.instr
+        self.pop.instr = instr
+
+        if self.prof is not None:
+            self.prof.attach(self)
+
+        try:
+            self.timer.start()
+            if self.ckpt is not None and not self.ckpt.has_series():
+                self.ckpt.write(self)
+
+            for i in range(self.timer.get_i_left()):
+                if do_disp_iter:
+                    print(i)
+
+                ts_iter_0 = Time.ts()
+                if instr is not None:
+                    instr.iter_start(self.timer.get_i(), self.pop)
+
+                if self.cb.before_iter is not None:
+                    self.cb.before_iter(self)
+
+                if self.pragma.live_info:
+                    self._inf(f'Iteration {self.timer.i + 1} of {self.timer.i_max}')
+                    self._inf(f'    Group count: {self.pop.get_group_cnt()}')
+                elif do_disp_t:
+                    print(f't:{self.timer.get_t()}')
+
+                # Apply group rules:
+                if instr is not None:
+                    instr.switch(CompInstr.RULE_APPLY)
+                self.pop.apply_rules(self.rules, self.timer.get_i(), self.timer.get_t())
+                if instr is not None:
+                    instr.switch(CompInstr.SIM_RULES)
+                m_flow = self.pop.last_iter.mass_flow_tot
+                m_pop = float(self.pop.get_mass())
+                if m_pop > 0:
+                    p_flow = float(m_flow) / m_pop
                 else:
-                    self.autostop_i = 0
-
-                if self.autostop_i >= self.pragma.autostop_t:
-                    if self.pragma.live_info:
-                        self._inf('Autostop condition has been met; population mass transfered during the most recent iteration')
-                        self._inf(f'    {m_flow} of {self.pop.get_mass()} = {p_flow * 100}%')
-                        self.timer.stop()
-                        break
+                    p_flow = None
+
+                # Apply simulation rules:
+                for r in self.sim_rules:
+                    if r.is_applicable(self.timer.get_i(), self.timer.get_t()):
+                        d = r.apply(self, self.timer.get_i(), self.timer.get_t())
+                        if isinstance(d, Directive):
+                            self.directives.append(d)
+                        elif isinstance(d, (list, tuple)):
+                            self.directives.extend(d_ for d_ in d if isinstance(d_, Directive))
+
+                # Save last-iter info:
+                self.comp_hist.mem_iter.append(psutil.Process().memory_info().rss)
+                self.comp_hist.t_iter.append(Time.ts() - ts_iter_0)
+
+                # Run probes:
+                if instr is not None:
+                    instr.switch(CompInstr.PROBES)
+                self._run_probes(self.timer.get_i(), self.timer.get_t())
+
+                # Cleanup the population:
+                if instr is not None:
+                    instr.switch(CompInstr.POST_ITER)
+                self.pop.do_post_iter()
+
+                # Advance timer:
+                self.timer.step()
+                self.running.progress += self.running.step
+
+                # Autostop:
+                if self.pragma.autostop and p_flow is not None:
+                    if m_flow < self.pragma.autostop_n or p_flow < self.pragma.autostop_p:
+                        self.autostop_i += 1
                     else:
-                        print('')
-                        print('Autostop condition has been met; population mass transfered during the most recent iteration:')
-                        print(f'    {m_flow} of {self.pop.get_mass()} = {p_flow * 100}%')
-                        self.timer.stop()
-                        break
-
-            # Autocompact:
-            if self.pragma.autocompact:
-                self._inf(f'    Compacting the model')
-                self.compact()
-
-            # Callbacks:
-            if self.cb.after_iter:
-                self.cb.after_iter(self)
-
-            if self.cb.upd_progress:
-                self.cb.upd_progress(i, iter_or_dur)
-
-            if self.cb.check_work:
-                while not self.cb.check_work():
-                    time.sleep(0.1)
-
-        self.timer.stop()
+                        self.autostop_i = 0
+
+                    if self.autostop_i >= self.pragma.autostop_t:
+                        if self.pragma.live_info:
+                            self._inf('Autostop condition has been met; population mass transfered during the most recent iteration')
+                            self._inf(f'    {m_flow} of {self.pop.get_mass()} = {p_flow * 100}%')
+                            self.timer.stop()
+                            break
+                        else:
+                            print('')
+                            print('Autostop condition has been met; population mass transfered during the most recent iteration:')
+                            print(f'    {m_flow} of {self.pop.get_mass()} = {p_flow * 100}%')
+                            self.timer.stop()
+                            break
+
+                # Autocompact:
+                if self.pragma.autocompact:
+                    self._inf(f'    Compacting the model')
+                    self.compact()
+
+                # Directives:
+                if len(self.directives) > 0:
+                    self.run__directives()
+
+                # Checkpoint:
+                if self.ckpt is not None and self.timer.i % self.ckpt.every == 0:
+                    if instr is not None:
+                        instr.switch(CompInstr.PERSISTENCE)
+                    self.ckpt.write(self)
+
+                # Callbacks:
+                if instr is not None:
+                    instr.switch(CompInstr.OTHER)
+                if self.cb.after_iter:
+                    self.cb.after_iter(self)
+
+                if self.cb.upd_progress:
+                    self.cb.upd_progress(i, iter_or_dur)
+
+                if self.cb.check_work:
+                    while not self.cb.check_work():
+                        time.sleep(0.1)
+
+            self.timer.stop()
+            if instr is not None:
+                instr.iter_end(self.pop)
+        finally:
+            self.pop.instr = None
+            self.pop.stop_par_pool()
+            if self.prof is not None:
+                self.prof.detach()
 
         self._inf(f'Final population info')
         self._inf(f'    Groups: {"{:,}".format(self.pop.get_group_cnt())}')
@@ -2261,12 +3214,62 @@ class Simulation(object):
             if p.persistence is not None:
                 p.persistence.flush()
 
+        if instr is not None and instr.persistence is not None:
+            instr.save_db(instr.persistence.conn, self.traj_id)
+
         self.comp_hist.t_sim = Time.ts() - ts_sim_0
 
         self.run__comp_summary()
 
         return self
 
+    def run__autoprune_groups(self):
+        """Called by :meth:`~pram.sim.Simulation.run` to prune groups if the ``autoprune_groups`` pragma is on.
+
+        Before a run, attributes and relations that according to the static rule analysis no rule conditions on are
+        removed.  That is only done if the analysis is conclusive (see :meth:`StaticRuleAnalyzer.is_conclusive()
+        <pram.sim.StaticRuleAnalyzer.is_conclusive>`) and no group query of a probe or a rule has lambda conditions.
+        Attributes and relations found by any of the two rule analyses or referenced by group queries of probes and
+        rules are kept as is the ``Site.AT`` relation.
+
+        Groups are never pruned automatically after a run.  The dynamic rule analysis only knows which attributes and
+        relations went unused so far and they may be needed later on (e.g., in a subsequent run) while removing them
+        is irreversible.  To prune based on it, call :meth:`~pram.sim.Simulation.prune_groups` explicitly, e.g.,
+        ``sim.prune_groups(sim.analysis.rule_dynamic.attr_unused, sim.analysis.rule_dynamic.rel_unused)``.
+        """
+
+        if not self.pragma.autoprune_groups:
+            return
+
+        ra = self.analysis.rule_static
+        rd = self.analysis.rule_dynamic
+
+        # Attributes and relations referenced by group queries:
+        qrys = [q for p in self.probes if isinstance(p, GroupProbe) for q in [p.qry_tot, *p.queries] if q is not None]
+        for r in self.rules:
+            for v in vars(r).values():
+                if isinstance(v, GroupQry):
+                    qrys.append(v)
+                elif isinstance(v, (list, tuple)):
+                    qrys.extend([q for q in v if isinstance(q, GroupQry)])
+
+        attr_qry = set()
+        rel_qry  = set()
+        for q in qrys:
+            (a,r) = q.get_names()
+            attr_qry.update(a)
+            rel_qry.update(r)
+
+        # Attributes and relations to remove:
+        if not ra.is_conclusive() or not all(q.is_transparent() for q in qrys):
+            self._inf('Static rule analysis is inconclusive; groups will not be pruned')
+            return
+        attr = set(k for g in self.pop.groups.values() for k in g.attr.keys())
+        rel  = set(k for g in self.pop.groups.values() for k in g.rel.keys())
+
+        self._inf('Pruning groups')
+        self.prune_groups(attr - ra.attr_used - rd.attr_used - attr_qry, rel - ra.rel_used - rd.rel_used - rel_qry - { Site.AT })
+
     def run__comp_summary(self):
         """Called by :meth:`~pram.sim.Simulation.run` to display computational summary."""
 
@@ -2298,6 +3301,45 @@ class Simulation(object):
         print(f'    Iteration time   : Range: [{t  ["min"]}, {t  ["max"]}]    Mean (SD): {t  ["mean"]} ({t  ["stdev"]})    Median: {t  ["median"]}')
         print(f'    Simulation time  : {Time.tsdiff2human(self.comp_hist.t_sim)}')
 
+        if self.instr is not None and len(self.instr.rows) > 0:
+            t_phase = self.instr.get_t_tot()
+            t_tot = math.fsum(t_phase.values())
+            print(f'    Time per phase   : ' + '    '.join(f'{p}: {Time.tsdiff2human(t)} ({t / t_tot * 100 if t_tot > 0 else 0:.1f}%)' for (p,t) in t_phase.items()))
+
+    def run__directives(self):
+        """Act upon directives issued by simulation rules during the current iteration.
+
+        This method is called at the end of an iteration (i.e., after the timer has been advanced).  For every branch of
+        a :class:`~pram.rule.ForkDirective`, the simulation is forked (see :meth:`~pram.sim.Simulation.fork`), the
+        branch's setup function is applied to the copy, and the copy is handed over to the fork callback function
+        together with the branch name and the number of iterations left in the current run.  If that callback is not
+        set, branches are appended to ``self.forks`` as dicts with keys ``name``, ``sim``, and ``i_left`` so that the
+        caller can run them once this run has finished (simulations cannot be run while another one is running).
+
+        A simulation run by a trajectory executor has no caller to pick up its branches (the executor discards the
+        simulation object once the run is over) so forking is an error there (see
+        :meth:`~pram.sim.Simulation.remote_before`); forking trajectories are only supported by sequential ensemble
+        runs.
+        """
+
+        directives = self.directives
+        self.directives = []
+
+        i_left = self.timer.get_i_left()
+        for d in directives:
+            if not isinstance(d, ForkDirective):
+                continue
+
+            for (name, fn) in d.branches.items():
+                sim = self.fork()
+                if fn is not None:
+                    fn(sim)
+
+                if self.cb.fork:
+                    self.cb.fork(self, name, sim, i_left)
+                else:
+                    self.forks.append({ 'name': name, 'sim': sim, 'i_left': i_left })
+
     def _save(self, fpath, fn):
         with fn(fpath, 'wb') as f:
             pickle.dump(self, f)
@@ -2344,6 +3386,17 @@ class Simulation(object):
     def save_state(self, mass_flow_specs=None):
         """Call the save simulation state callback function.
 
+        What the callback receives depends on the ``mass_flow_rec`` pragma (see
+        :meth:`~pram.sim.Simulation.get_pragma`):
+
+        - **none**: The callback is not called at all.  This suits runs that only need probe output.
+        - **aggr**: Masses of all groups and the total mass transferred (``mass_flow_tot``).  Group attributes and
+          relations are sent only the first time a group is encountered.
+        - **sparse**: As ``aggr`` plus the mass flow as (source group hash, destination group hash, mass) triplets of
+          NumPy arrays (``mass_flow``; see :meth:`MassFlowSpec.to_sparse() <pram.pop.MassFlowSpec.to_sparse>`).
+        - **full**: Definitions and masses of all groups, the total mass transferred, and the mass flow specs themselves
+          (``mass_flow_specs``).
+
         Args:
             mass_flow_specs(MassFlowSpecs, optional): Mass flow specs.
 
@@ -2365,18 +3418,36 @@ class Simulation(object):
         # else:
         #     self.traj.save_state(mass_flow_specs)
 
-        if self.cb.save_state:
-            self.cb.save_state([{
-                'type'            : 'state',
-                'host_name'       : None,
-                'host_ip'         : None,
-                'traj_id'         : self.traj_id,  # self.traj.id if self.traj else None,
-                'iter'            : self.timer.i if self.timer.is_running else -1,
-                'pop_m'           : self.pop.get_mass(),
-                'groups'          : [{ 'hash': g.get_hash(), 'm': g.m, 'attr': g.attr, 'rel': g.rel } for g in self.pop.groups.values()],  # self.pop.get_groups()
-                # 'mass_flow_specs' : mass_flow_specs if self.timer.i > 0 else None
-                'mass_flow_specs' : mass_flow_specs
-            }])
+        rec = self.pragma.mass_flow_rec
+        if not self.cb.save_state or rec == 'none':
+            return self
+
+        if rec == 'full':
+            groups = [{ 'hash': g.get_hash(), 'm': g.m, 'attr': g.attr, 'rel': g.rel } for g in self.pop.groups.values()]  # self.pop.get_groups()
+        else:
+            groups = []
+            for g in self.pop.groups.values():
+                h = g.get_hash()
+                if h in self.state_group_hashes:
+                    groups.append({ 'hash': h, 'm': g.m })
+                else:
+                    groups.append({ 'hash': h, 'm': g.m, 'attr': g.attr, 'rel': g.rel })
+                    self.state_group_hashes.add(h)
+
+        self.cb.save_state([{
+            'type'            : 'state',
+            'host_name'       : None,
+            'host_ip'         : None,
+            'traj_id'         : self.traj_id,  # self.traj.id if self.traj else None,
+            'iter'            : self.timer.i if self.timer.is_running else -1,
+            'pop_m'           : self.pop.get_mass(),
+            'groups'          : groups,
+            'mass_flow_rec'   : rec,
+            'mass_flow_tot'   : self.pop.last_iter.mass_flow_tot if mass_flow_specs is not None else None,
+            'mass_flow'       : MassFlowSpec.to_sparse(mass_flow_specs) if rec == 'sparse' and mass_flow_specs is not None else None,
+            # 'mass_flow_specs' : mass_flow_specs if self.timer.i > 0 else None
+            'mass_flow_specs' : mass_flow_specs if rec == 'full' else None
+        }])
 
         return self
 
@@ -2434,6 +3505,22 @@ class Simulation(object):
         self.cb.check_work = fn
         return self
 
+    def set_cb_fork(self, fn):
+        """Set the fork callback function.
+
+        The function is called for every branch of a :class:`~pram.rule.ForkDirective` with the forking simulation,
+        the branch name, the branch simulation, and the number of iterations left in the current run as arguments.
+
+        Args:
+            fn (Callable[[Simulation, str, Simulation, int], None], optional): The function.
+
+        Returns:
+            ``self``
+        """
+
+        self.cb.fork = fn
+        return self
+
     def set_cb_save_state(self, fn):
         """Set the callback function.
 
@@ -2446,6 +3533,8 @@ class Simulation(object):
             ``self``
         """
 
+        if fn is not None:
+            self.state_group_hashes = set()  # the new recipient needs all group definitions
         self.cb.save_state = fn
         return self
 
@@ -2464,6 +3553,22 @@ class Simulation(object):
         self.cb.upd_progress = fn
         return self
 
+    def set_checkpoint(self, ckpt):
+        """Attaches a checkpoint (or detaches it if None is passed).
+
+        The simulation state is checkpointed when a run starts (unless the checkpoint is already part of a series) and
+        then every so many iterations; see :class:`~pram.sim.Checkpoint`.
+
+        Args:
+            ckpt (Checkpoint, optional): The checkpoint.
+
+        Returns:
+            ``self``
+        """
+
+        self.ckpt = ckpt
+        return self
+
     def set_fn_group_setup(self, fn):
         """Set the group setup function.
 
@@ -2481,7 +3586,35 @@ class Simulation(object):
         self.fn.group_setup = fn
         return self
 
-    def set_pragmas(self, analyze=None, autocompact=None, autoprune_groups=None, autostop=None, autostop_n=None, autostop_p=None, autostop_t=None, comp_summary=None, fractional_mass=None, live_info=None, live_info_ts=None, probe_capture_init=None, rule_analysis_for_db_gen=None):
+    def set_instr(self, instr):
+        """Attaches a computational instrument (or detaches it if None is passed).
+
+        Args:
+            instr (CompInstr, optional): The instrument.
+
+        Returns:
+            ``self``
+        """
+
+        self.instr = instr
+        return self
+
+    def set_prof(self, prof):
+        """Attaches a profiler (or detaches it if None is passed).
+
+        The profiler records time spent in every rule, simulation rule, and probe during subsequent simulation runs.
+
+        Args:
+            prof (CompProf, optional): The profiler.
+
+        Returns:
+            ``self``
+        """
+
+        self.prof = prof
+        return self
+
+    def set_pragmas(self, analyze=None, autocompact=None, autoprune_groups=None, autostop=None, autostop_n=None, autostop_p=None, autostop_t=None, comp_summary=None, fractional_mass=None, live_info=None, live_info_ts=None, probe_capture_init=None, rule_analysis_for_db_gen=None, vectorized_mass=None, par_apply_rules=None, mass_flow_rec=None):
         """Sets values of multiple pragmas.
 
         See :meth:`~pram.sim.Simulation.get_pragma`.
@@ -2505,7 +3638,10 @@ class Simulation(object):
         if live_info                is not None: self.set_pragma_live_info(live_info),
         if live_info_ts             is not None: self.set_pragma_live_info_ts(live_info_ts),
         if probe_capture_init       is not None: self.set_pragma_probe_capture_init(probe_capture_init),
-        if rule_analysis_for_db_gen is not None: self.set_pragma_rule_analysis_for_db_gen(rule_analysis_for_db_gen)
+        if rule_analysis_for_db_gen is not None: self.set_pragma_rule_analysis_for_db_gen(rule_analysis_for_db_gen),
+        if vectorized_mass          is not None: self.set_pragma_vectorized_mass(vectorized_mass),
+        if par_apply_rules          is not None: self.set_pragma_par_apply_rules(par_apply_rules),
+        if mass_flow_rec            is not None: self.set_pragma_mass_flow_rec(mass_flow_rec)
 
         return self
 
@@ -2530,10 +3666,14 @@ class Simulation(object):
             'autostop_n'               : self.set_pragma_autostop_n,
             'autostop_p'               : self.set_pragma_autostop_p,
             'autostop_t'               : self.set_pragma_autostop_t,
+            'comp_summary'             : self.set_pragma_comp_summary,
             'live_info'                : self.set_pragma_live_info,
             'live_info_ts'             : self.set_pragma_live_info_ts,
             'probe_capture_init'       : self.set_pragma_probe_capture_init,
-            'rule_analysis_for_db_gen' : self.set_pragma_rule_analysis_for_db_gen
+            'rule_analysis_for_db_gen' : self.set_pragma_rule_analysis_for_db_gen,
+            'vectorized_mass'          : self.set_pragma_vectorized_mass,
+            'par_apply_rules'          : self.set_pragma_par_apply_rules,
+            'mass_flow_rec'            : self.set_pragma_mass_flow_rec
         }.get(name, None)
 
         if fn is None:
@@ -2672,6 +3812,39 @@ class Simulation(object):
         self.pragma.rule_analysis_for_db_gen = value
         return self
 
+    def set_pragma_vectorized_mass(self, value):
+        """See :meth:`~pram.sim.Simulation.get_pragma`.
+
+        Returns:
+            ``self``
+        """
+
+        self.pragma.vectorized_mass = value
+        return self
+
+    def set_pragma_par_apply_rules(self, value):
+        """See :meth:`~pram.sim.Simulation.get_pragma`.
+
+        Returns:
+            ``self``
+        """
+
+        self.pragma.par_apply_rules = value
+        return self
+
+    def set_pragma_mass_flow_rec(self, value):
+        """See :meth:`~pram.sim.Simulation.get_pragma`.
+
+        Returns:
+            ``self``
+        """
+
+        if value not in self.MASS_FLOW_REC:
+            raise ValueError(f"Mass flow recording level must be one of: {', '.join(self.MASS_FLOW_REC)}.")
+
+        self.pragma.mass_flow_rec = value
+        return self
+
     def set_rand_seed(self, rand_seed=None):
         """Set pseudo-random generator seed.
 
@@ -2850,6 +4023,18 @@ class Simulation(object):
         return self
 
 
+# ----------------------------------------------------------------------------------------------------------------------
+def _fork_remote(sim, name, sim_branch, i_left):
+    """Fork callback of simulations run by a trajectory executor (see :meth:`Simulation.remote_before()
+    <pram.sim.Simulation.remote_before>`).
+
+    Raises:
+        SimulationError: Always; the branch would otherwise be lost.
+    """
+
+    raise SimulationError(f"Branch '{name}' has been forked off of a simulation run by a trajectory executor; forking trajectories are only supported by sequential ensemble runs.")
+
+
 # ----------------------------------------------------------------------------------------------------------------------
 # @ray.remote
 # class SimulationRemote(Simulation):
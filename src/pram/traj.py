@@ -13,8 +13,10 @@
 import altair as alt
 import altair_saver as alt_save
 import gc
+import itertools
 import json
 import matplotlib.pyplot as plt
+import multiprocessing
 import numpy as np
 import os
 # import pickle
@@ -27,19 +29,25 @@ import sqlite3
 import time
 import tqdm
 
+from abc                 import abstractmethod, ABC
+from collections         import deque
+from concurrent.futures  import ProcessPoolExecutor
 from dotmap              import DotMap
 from pyrqa.neighbourhood import FixedRadius
+from queue               import Empty
 from scipy.fftpack       import fft
 from scipy               import signal
+from scipy.sparse        import csr_matrix
 from sortedcontainers    import SortedDict
 
 from .data   import ProbePersistenceDB
 from .graph  import MassGraph
+from .pop    import MassFlowSpec
 from .signal import Signal
 from .sim    import Simulation
 from .util   import DB, Size, Time
 
-__all__ = ['ClusterInf', 'TrajectoryError', 'Trajectory', 'TrajectoryEnsemble']
+__all__ = ['ClusterInf', 'TrajectoryExecutor', 'RayExecutor', 'LocalExecutor', 'ColumnarMassStore', 'TrajectoryError', 'Trajectory', 'TrajectoryEnsemble', 'ParamSweep']
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -56,6 +64,187 @@ class ClusterInf(object):
         return self.kwargs
 
 
+# ----------------------------------------------------------------------------------------------------------------------
+class ColumnarMassStore(object):
+    """Columnar binary store of trajectory mass locus.
+
+    An alternative to the 'mass_locus' table of the trajectory ensemble database which holds one row per group per
+    iteration.  Here, every trajectory is stored as an append-only file of dense per-iteration mass vectors (float64,
+    native byte order) in which the group with database ID ``k`` occupies column ``k-1`` and groups absent in an
+    iteration are NaN.  Because new groups can appear as a simulation runs, the vectors can widen over time; a
+    contiguous run of vectors of the same width is a segment and segments are cataloged in the 'mass_locus_seg' table
+    of the ensemble database (which also remains the catalog of group definitions).  Reading a trajectory therefore
+    amounts to memory-mapping a handful of contiguous blocks.
+
+    Args:
+        dpath (str): Directory to store the trajectory files in (created if necessary).
+    """
+
+    SQL_CREATE_SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS mass_locus_seg (
+        id      INTEGER PRIMARY KEY AUTOINCREMENT,
+        traj_id INTEGER NOT NULL,
+        i0      INTEGER NOT NULL,
+        n_iter  INTEGER NOT NULL,
+        n_grp   INTEGER NOT NULL,
+        offset  INTEGER NOT NULL,
+        CONSTRAINT fk__mass_locus_seg__traj FOREIGN KEY (traj_id) REFERENCES traj (id) ON UPDATE CASCADE ON DELETE CASCADE
+        );
+        '''
+
+    DTYPE = np.float64
+
+    def __init__(self, dpath):
+        self.dpath = dpath
+        self.conn = None
+
+        self.ins_val = {}  # traj ID -> list of (iter, mass vector) buffered until the next flush
+        self.n_grp = {}    # traj ID -> current width of mass vectors
+
+        os.makedirs(self.dpath, exist_ok=True)
+
+    def append(self, traj_id, iter, grp_ids, m):
+        """Buffer the mass locus of one iteration.
+
+        Args:
+            traj_id (int): Trajectory database ID.
+            iter (int): Iteration.
+            grp_ids (Iterable[int]): Database IDs of groups.
+            m (Iterable[float]): Masses of those groups.
+
+        Returns:
+            ``self``
+        """
+
+        grp_ids = np.asarray(grp_ids, dtype=np.int64)
+        n_grp = max(self.n_grp.get(traj_id, 0), int(grp_ids.max()) if grp_ids.size > 0 else 0)
+        self.n_grp[traj_id] = n_grp
+
+        row = np.full(n_grp, np.nan, dtype=self.DTYPE)
+        row[grp_ids - 1] = m
+        self.ins_val.setdefault(traj_id, []).append((iter, row))
+
+        return self
+
+    def attach(self, conn):
+        """Associate the store with the trajectory ensemble database.
+
+        Args:
+            conn (sqlite3.Connection): The SQLite3 connection object.
+
+        Returns:
+            ``self``
+        """
+
+        self.conn = conn
+        with self.conn as c:
+            c.executescript(self.SQL_CREATE_SCHEMA)
+        return self
+
+    def flush(self):
+        """Write all buffered mass vectors to their trajectory files and catalog the segments.
+
+        The transaction is not committed; that is left to the ensemble which commits its own rows at the same time.
+
+        Returns:
+            ``self``
+        """
+
+        for (traj_id, rows) in self.ins_val.items():
+            with open(self.get_fpath(traj_id), 'ab') as f:
+                j = 0
+                while j < len(rows):  # split into runs of rows of the same width
+                    k = j + 1
+                    while k < len(rows) and rows[k][1].size == rows[j][1].size and rows[k][0] == rows[k-1][0] + 1:
+                        k += 1
+
+                    offset = f.tell()
+                    f.write(np.vstack([r for (_,r) in rows[j:k]]).tobytes())
+                    self._add_seg(traj_id, rows[j][0], k - j, rows[j][1].size, offset)
+                    j = k
+        self.ins_val = {}
+
+        return self
+
+    def _add_seg(self, traj_id, i0, n_iter, n_grp, offset):
+        """Catalog a segment extending the previous one if they are contiguous."""
+
+        seg = self.conn.execute('SELECT id, i0, n_iter, n_grp, offset FROM mass_locus_seg WHERE traj_id = ? ORDER BY i0 DESC LIMIT 1', [traj_id]).fetchone()
+        if seg is not None and seg[3] == n_grp and seg[1] + seg[2] == i0 and seg[4] + seg[2] * n_grp * self.DTYPE().itemsize == offset:
+            self.conn.execute('UPDATE mass_locus_seg SET n_iter = n_iter + ? WHERE id = ?', [n_iter, seg[0]])
+        else:
+            self.conn.execute('INSERT INTO mass_locus_seg (traj_id, i0, n_iter, n_grp, offset) VALUES (?,?,?,?,?)', [traj_id, i0, n_iter, n_grp, offset])
+
+    def get_fpath(self, traj_id):
+        """Get the filepath of the designated trajectory's file.
+
+        Args:
+            traj_id (int): Trajectory database ID.
+
+        Returns:
+            str
+        """
+
+        return os.path.join(self.dpath, f'traj-{traj_id}.bin')
+
+    def get_lineage(self, traj_id):
+        """Get the lineage of the designated trajectory.
+
+        A forked trajectory's file holds only the iterations that follow the fork; the earlier ones are held by the
+        files of its ancestors (see the 'traj_fork' table of the ensemble database).
+
+        Args:
+            traj_id (int): Trajectory database ID.
+
+        Returns:
+            list[tuple[int,int]]: (Trajectory database ID, last iteration shared) pairs ordered from the trajectory
+                itself (for which the last iteration is None) to its root ancestor.
+        """
+
+        lin = [(traj_id, None)]
+        while True:
+            r = self.conn.execute('SELECT parent_id, i FROM traj_fork WHERE traj_id = ?', [lin[-1][0]]).fetchone()
+            if r is None:
+                return lin
+            lin.append((r[0], r[1] if lin[-1][1] is None else min(r[1], lin[-1][1])))
+
+    def get_mass(self, traj_id):
+        """Get the mass locus of the designated trajectory.
+
+        The history a forked trajectory shares with its ancestors is read from their files.  If the trajectory is
+        stored in a single segment, the returned array is a read-only memory map of its file.
+
+        Args:
+            traj_id (int): Trajectory database ID.
+
+        Returns:
+            (numpy.ndarray, numpy.ndarray): Iterations (shape ``(n_iter,)``) and masses (shape ``(n_iter, n_grp)``; the
+                group with database ID ``k`` is in column ``k-1``).
+        """
+
+        segs = []  # (traj ID, i0, n_iter, n_grp, offset)
+        for (tid, i_max) in reversed(self.get_lineage(traj_id)):
+            for (i0, n_iter, n_grp, offset) in self.conn.execute('SELECT i0, n_iter, n_grp, offset FROM mass_locus_seg WHERE traj_id = ? ORDER BY i0', [tid]).fetchall():
+                if i_max is not None:
+                    n_iter = min(n_iter, i_max - i0 + 1)
+                if n_iter > 0:
+                    segs.append((tid, i0, n_iter, n_grp, offset))
+        if len(segs) == 0:
+            return (np.empty(0, dtype=np.int64), np.empty((0,0), dtype=self.DTYPE))
+
+        blocks = [np.memmap(self.get_fpath(s[0]), dtype=self.DTYPE, mode='r', offset=s[4], shape=(s[2], s[3])) for s in segs]
+        iters = np.concatenate([np.arange(s[1], s[1] + s[2]) for s in segs])
+        if len(blocks) == 1:
+            return (iters, blocks[0])
+
+        m = np.full((iters.size, max([s[3] for s in segs])), np.nan, dtype=self.DTYPE)
+        j = 0
+        for b in blocks:
+            m[j:j + b.shape[0], :b.shape[1]] = b
+            j += b.shape[0]
+        return (iters, m)
+
+
 # ----------------------------------------------------------------------------------------------------------------------
 class TrajectoryError(Exception): pass
 
@@ -77,6 +266,237 @@ class TqdmUpdTo(tqdm.tqdm):
         self.update(to - self.n)  # will also set self.n = blocks_so_far * block_size
 
 
+# ----------------------------------------------------------------------------------------------------------------------
+class TrajectoryExecutor(ABC):
+    """Trajectory ensemble executor.
+
+    An executor runs all trajectories of a :class:`~pram.traj.TrajectoryEnsemble` in parallel.  Irrespective of where
+    the simulations are run, all payloads they produce (i.e., simulation states and probe-recorded values) are
+    persisted by the ensemble in the head process via :meth:`TrajectoryEnsemble.save_work()
+    <pram.traj.TrajectoryEnsemble.save_work>` so that the ensemble database has a single writer.
+    """
+
+    @abstractmethod
+    def run(self, ens, iter_or_dur=1, is_quiet=False):
+        """Run the ensemble.
+
+        Args:
+            ens (TrajectoryEnsemble): The ensemble.
+            iter_or_dur (int or str): Number of iterations or a string representation of duration (see
+                :meth:`util.Time.dur2ms() <pram.util.Time.dur2ms>`)
+            is_quiet (bool): Suppress the progress bar?
+        """
+
+        pass
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+class RayExecutor(TrajectoryExecutor):
+    """Executor running trajectories on a ray computational cluster.
+
+    Args:
+        cluster_inf (ClusterInf): Computational cluster information (passed to ``ray.init()``).
+    """
+
+    def __init__(self, cluster_inf):
+        self.cluster_inf = cluster_inf
+
+    def run(self, ens, iter_or_dur=1, is_quiet=False):
+        """Run the ensemble on a computational cluster.
+
+        Args:
+            ens (TrajectoryEnsemble): The ensemble.
+            iter_or_dur (int or str): Number of iterations or a string representation of duration (see
+                :meth:`util.Time.dur2ms() <pram.util.Time.dur2ms>`)
+            is_quiet (bool): Suppress the progress bar?
+        """
+
+        try:
+            ray.init(**self.cluster_inf.get_args())
+
+            n_nodes = len(ray.nodes())
+            n_cpu   = int(ray.cluster_resources()['CPU'])
+            n_traj  = len(ens.traj)
+            n_iter  = n_traj * iter_or_dur
+
+            work_collector = WorkCollector.remote(10)
+            progress_mon = ProgressMonitor.remote()
+
+            for t in ens.traj.values():
+                t.sim.remote_before()
+            ens.probe_persistence.remote_before(work_collector)
+
+            ens.unpersisted_probes = []  # probes which have not yet been persisted via ens.save_work()
+
+            workers = [Worker(i, t.id, t.sim, iter_or_dur, work_collector, progress_mon) for (i,t) in enumerate(ens.traj.values())]
+
+            wait_ids = [start_worker.remote(w) for w in workers]
+            time.sleep(1)  # give workers time to start
+            with TqdmUpdTo(total=n_iter, miniters=1, desc=f'nodes:{n_nodes}  cpus:{n_cpu}  trajs:{n_traj}  iters:{n_traj}×{iter_or_dur}={Size.b2h(n_iter, False)}', bar_format='{desc}  |{bar}| {percentage:3.0f}% [{elapsed}<{remaining}, {rate_fmt}{postfix}]', dynamic_ncols=True, ascii=' 123456789.', disable=is_quiet) as pbar:
+                while len(wait_ids) > 0:
+                    done_id, wait_ids = ray.wait(wait_ids, timeout=0.1)
+
+                    work = ray.get(work_collector.get.remote())
+                    ens.save_work(work)
+                    del work
+
+                    pbar.update_to(ray.get(progress_mon.get_i.remote()))
+
+            # Code used previously instead of the progress bar:
+            #     sys.stdout.write('\r')
+            #     sys.stdout.write(ray.get(progress_mon.get_rep.remote()))
+            #     sys.stdout.flush()
+            # sys.stdout.write('\n')
+
+            ens.save_work(ens.unpersisted_probes)  # save any remaining to-be-persisted probes
+
+            progress_mon.rem_all_workers.remote()
+
+            for t in ens.traj.values():
+                t.sim.remote_after()
+            ens.probe_persistence.remote_after(ens, ens.conn)
+        finally:
+            if self.cluster_inf.get_args().get('address') is None:
+                ray.shutdown()
+            if hasattr(ens, 'unpersisted_probes'):
+                del ens.unpersisted_probes
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+class LocalExecutor(TrajectoryExecutor):
+    """Executor running trajectories in a pool of processes on the local machine.
+
+    This executor does not depend on ray.  Each trajectory is run by a :class:`~pram.traj.LocalWorker` in a
+    :class:`concurrent.futures.ProcessPoolExecutor` process.  Workers stream their payloads (simulation states, probe
+    values, and progress updates) back to the head process over a bounded queue; the head process drains that queue
+    into the ensemble database and the progress bar.  Because the queue is bounded, workers block (instead of piling
+    up payloads in memory) whenever the head process falls behind.
+
+    Args:
+        n_procs (int, optional): Number of worker processes.  If None, the number of CPUs is used.
+        max_capacity (int): Maximum number of payloads in flight between the workers and the head process.
+    """
+
+    def __init__(self, n_procs=None, max_capacity=1024):
+        self.n_procs = n_procs or os.cpu_count() or 1
+        self.max_capacity = max_capacity
+
+    def run(self, ens, iter_or_dur=1, is_quiet=False):
+        """Run the ensemble in a local process pool.
+
+        Args:
+            ens (TrajectoryEnsemble): The ensemble.
+            iter_or_dur (int or str): Number of iterations or a string representation of duration (see
+                :meth:`util.Time.dur2ms() <pram.util.Time.dur2ms>`)
+            is_quiet (bool): Suppress the progress bar?
+        """
+
+        try:
+            for t in ens.traj.values():
+                t.sim.remote_before()
+            ens.probe_persistence.remote_before(LocalWorkCollector())
+
+            ens.unpersisted_probes = []  # probes which have not yet been persisted via ens.save_work()
+
+            workers = [pickle.dumps(LocalWorker(i, t.id, t.sim, iter_or_dur)) for (i,t) in enumerate(ens.traj.values())]  # cloudpickle handles closures in rules
+            self.run_workers(ens, _start_local_worker, [(w,) for w in workers], iter_or_dur, is_quiet)
+            del workers
+
+            ens.save_work(ens.unpersisted_probes)  # save any remaining to-be-persisted probes
+
+            for t in ens.traj.values():
+                t.sim.remote_after()
+            ens.probe_persistence.remote_after(ens, ens.conn)
+        finally:
+            if hasattr(ens, 'unpersisted_probes'):
+                del ens.unpersisted_probes
+
+    def _drain(self, queue, progress, timeout=0.1):
+        """Retrieve all messages currently in the queue.
+
+        Args:
+            queue (multiprocessing.Queue): The queue.
+            progress (Mapping[Any,int]): Worker progress; updated in place.
+            timeout (float): Time to wait for the first message [s].
+
+        Returns:
+            (Iterable[Mapping[str,Any]], int): The work to be persisted and the number of workers that have finished.
+        """
+
+        work = []
+        n_done = 0
+        try:
+            msg = queue.get(timeout=timeout)
+            while True:
+                (type, args) = msg
+                if type == 'state':
+                    work.append(args[0])
+                elif type == 'probe':
+                    work.append({ 'type': 'probe', 'qry': args[0], 'vals': args[1] })
+                elif type == 'upd_worker':
+                    progress[args[0]] = args[1]
+                elif type == 'done':
+                    n_done += 1
+                msg = queue.get_nowait()
+        except Empty:
+            pass
+        return (work, n_done)
+
+    def run_workers(self, ens, fn, args, iter_or_dur=1, is_quiet=False, base=None):
+        """Run workers in the process pool and persist their payloads in the ensemble database as they arrive.
+
+        Every worker is started by calling ``fn`` in a pool process with one item of ``args``.  That function needs to
+        put the 'done' message on the queue to the head process once the worker has finished (see
+        :func:`~pram.traj._start_local_worker`).
+
+        Args:
+            ens (TrajectoryEnsemble): The ensemble.
+            fn (Callable): Module-level function starting a worker.
+            args (Iterable[tuple]): Arguments of ``fn``; one tuple per worker.
+            iter_or_dur (int): Number of iterations every worker runs.
+            is_quiet (bool): Suppress the progress bar?
+            base (bytes, optional): Payload every process of the pool receives only once when it starts (e.g., a
+                pickled simulation that workers clone; see :class:`~pram.traj.ParamSweep`).
+        """
+
+        n_traj  = len(args)
+        n_procs = max(1, min(self.n_procs, n_traj))
+        n_iter  = n_traj * iter_or_dur
+
+        queue = multiprocessing.Queue(self.max_capacity)
+
+        try:
+            with ProcessPoolExecutor(n_procs, initializer=_init_local_worker, initargs=(queue, base)) as ex:
+                futures = [ex.submit(fn, *a) for a in args]
+
+                progress = {}  # worker ID -> number of iterations completed
+                n_done = 0
+                try:
+                    with TqdmUpdTo(total=n_iter, miniters=1, desc=f'procs:{n_procs}  trajs:{n_traj}  iters:{n_traj}×{iter_or_dur}={Size.b2h(n_iter, False)}', bar_format='{desc}  |{bar}| {percentage:3.0f}% [{elapsed}<{remaining}, {rate_fmt}{postfix}]', dynamic_ncols=True, ascii=' 123456789.', disable=is_quiet) as pbar:
+                        while n_done < n_traj:
+                            (work, n) = self._drain(queue, progress)
+                            n_done += n
+                            ens.save_work(work)
+                            del work
+
+                            pbar.update_to(sum(progress.values()))
+
+                            for f in futures:  # a worker process that died will never send its done message
+                                if f.done() and f.exception() is not None:
+                                    raise f.exception()
+                except BaseException:
+                    for f in futures:
+                        f.cancel()
+                    while not all([f.done() for f in futures]):  # unblock workers waiting on the full queue so the pool can shut down
+                        self._drain(queue, {})
+                    raise
+
+                for f in futures:
+                    f.result()  # re-raise exceptions the simulations may have thrown
+        finally:
+            queue.close()
+
+
 # ----------------------------------------------------------------------------------------------------------------------
 class Trajectory(object):
     """A time-ordered sequence of system configurations that occur as the system state evolves.
@@ -148,6 +568,12 @@ class Trajectory(object):
         self._check_ens()
         return self.ens.gen_agent(self, n_iter)
 
+    def gen_agent_paths(self, n_agents=1, n_iter=-1):
+        """See :meth:`TrajectoryEnsemble.gen_agent_paths() <pram.traj.TrajectoryEnsemble.gen_agent_paths>`."""
+
+        self._check_ens()
+        return self.ens.gen_agent_paths(self, n_agents, n_iter)
+
     def gen_agent_pop(self, n_agents=1, n_iter=-1):
         """See :meth:`TrajectoryEnsemble.gen_agent_pop() <pram.traj.TrajectoryEnsemble.gen_agent_pop>`."""
 
@@ -356,12 +782,22 @@ class TrajectoryEnsemble(object):
         - While having a 'traj_id' field in the 'grp_name' table seems like a reasonable choice, a trajectory ensemble
           is assumed to hold only similar trajectories.  Therefore, the 'grp' and 'grp_name' tables can simply be
           joined on the 'hash' field.
+        - A trajectory forked off of another one (see :class:`~pram.rule.ForkDirective`) does not duplicate the
+          history it shares with its parent.  Instead, the 'traj_fork' table records the parent and the last shared
+          iteration and the 'traj_iter' view resolves that lineage into the rows of the 'iter' table that make up the
+          full history of every trajectory.  Queries concerning individual trajectories should use that view.
 
     Args:
         fpath_db (str, optional): Database filepath.
         do_load_sims (bool): Load simulations?
-        cluster_inf (ClusterInf, optional): Computational cluster information.
+        cluster_inf (ClusterInf, optional): Computational cluster information.  Shortcut for running the ensemble
+            with a :class:`~pram.traj.RayExecutor`.
         flush_every (int): Data flushing frequency in iterations.
+        executor (TrajectoryExecutor, optional): Executor used to run the trajectories in parallel (e.g.,
+            :class:`~pram.traj.LocalExecutor`).  If neither the executor nor the cluster info is provided, trajectories
+            are run sequentially.
+        mass_store (ColumnarMassStore, optional): Columnar store to keep mass locus in instead of the 'mass_locus'
+            table.  The same store needs to be provided when the ensemble database is reopened.
     """
 
     SQL_CREATE_SCHEMA = '''
@@ -380,6 +816,7 @@ class TrajectoryEnsemble(object):
         i         INTEGER NOT NULL,
         host_name TEXT,
         host_ip   TEXT,
+        m_flow    REAL,  -- total mass transferred in the iteration (NULL for the initial state)
         UNIQUE (traj_id, i),
         CONSTRAINT fk__iter__traj FOREIGN KEY (traj_id) REFERENCES traj (id) ON UPDATE CASCADE ON DELETE CASCADE
         );
@@ -447,24 +884,91 @@ class TrajectoryEnsemble(object):
         # CONSTRAINT fk__rule__traj FOREIGN KEY (traj_id) REFERENCES traj (id) ON UPDATE CASCADE ON DELETE CASCADE
         # );
 
+    SQL_CREATE_SCHEMA_STAT = '''
+        CREATE TABLE IF NOT EXISTS mass_locus_stat (
+        grp_id INTEGER NOT NULL,
+        i      INTEGER NOT NULL,
+        n      INTEGER NOT NULL,
+        m_mean REAL NOT NULL,
+        m_m2   REAL NOT NULL,  -- sum of squared deviations from the mean
+        m_min  REAL NOT NULL,
+        m_max  REAL NOT NULL,
+        PRIMARY KEY (grp_id, i),
+        CONSTRAINT fk__mass_locus_stat__grp FOREIGN KEY (grp_id) REFERENCES grp (id) ON UPDATE CASCADE ON DELETE CASCADE
+        );
+
+        CREATE TABLE IF NOT EXISTS mass_locus_stat_traj (
+        traj_id INTEGER PRIMARY KEY,
+        i_max   INTEGER NOT NULL,  -- the last iteration of the trajectory accounted for in 'mass_locus_stat'
+        CONSTRAINT fk__mass_locus_stat_traj__traj FOREIGN KEY (traj_id) REFERENCES traj (id) ON UPDATE CASCADE ON DELETE CASCADE
+        );
+        '''
+
+    SQL_CREATE_SCHEMA_FORK = '''
+        CREATE TABLE IF NOT EXISTS traj_fork (
+        traj_id   INTEGER PRIMARY KEY,
+        parent_id INTEGER NOT NULL,
+        i         INTEGER NOT NULL,  -- the last iteration of the parent's history shared with the trajectory
+        CONSTRAINT fk__traj_fork__traj   FOREIGN KEY (traj_id)   REFERENCES traj (id) ON UPDATE CASCADE ON DELETE CASCADE,
+        CONSTRAINT fk__traj_fork__parent FOREIGN KEY (parent_id) REFERENCES traj (id) ON UPDATE CASCADE ON DELETE CASCADE
+        );
+
+        CREATE VIEW IF NOT EXISTS traj_iter AS
+        WITH RECURSIVE lin (traj_id, anc_id, i_max) AS (
+            SELECT id, id, NULL FROM traj
+            UNION ALL
+            SELECT lin.traj_id, f.parent_id, MIN(IFNULL(lin.i_max, f.i), f.i)
+            FROM lin
+            INNER JOIN traj_fork f ON f.traj_id = lin.anc_id
+        )
+        SELECT lin.traj_id, i.id, i.ts, i.i, i.host_name, i.host_ip
+        FROM lin
+        INNER JOIN iter i ON i.traj_id = lin.anc_id
+        WHERE lin.i_max IS NULL OR i.i <= lin.i_max;
+        '''
+
+    SQL_CREATE_SCHEMA_PARAM = '''
+        CREATE TABLE IF NOT EXISTS traj_param (
+        traj_id INTEGER NOT NULL,
+        name    TEXT NOT NULL,
+        val     REAL NOT NULL,  -- non-numeric values are stored as text
+        PRIMARY KEY (traj_id, name),
+        CONSTRAINT fk__traj_param__traj FOREIGN KEY (traj_id) REFERENCES traj (id) ON UPDATE CASCADE ON DELETE CASCADE
+        );
+        '''
+
+    STAT_BAND_TYPES = ('ci', 'stderr', 'stdev', 'minmax')  # bands computable from 'mass_locus_stat'
+
     FLUSH_EVERY = 16  # frequency of flushing data to the database
     WEBDRIVER = 'chrome'  # 'firefox'
 
-    def __init__(self, fpath_db=None, do_load_sims=True, cluster_inf=None, flush_every=FLUSH_EVERY):
+    def __init__(self, fpath_db=None, do_load_sims=True, cluster_inf=None, flush_every=FLUSH_EVERY, executor=None, mass_store=None):
         self.cluster_inf = cluster_inf
+        self.executor = executor or (RayExecutor(cluster_inf) if cluster_inf else None)
+        self.mass_store = mass_store
         self.traj = {}  # index by DB ID
         self.conn = None
 
+        self.flush_every = flush_every
+
         self.pragma = DotMap(
-            memoize_group_ids = False  # keep group hash-to-db-id map in memory (faster but increases memory utilization)
+            memoize_group_ids = True  # no longer used; group hash-to-db-id map is always kept in memory
         )
 
         self.cache = DotMap(
-            group_hash_to_id = {}
+            group_hash_to_id = {}  # populated from the database when it is opened and kept up to date afterwards
+        )
+
+        self.ins_val = DotMap(  # rows buffered until the next flush
+            mass_locus = [],
+            mass_flow  = []
         )
+        self.n_iter_unflushed = 0  # number of iterations saved since the last flush
 
         self.curr_iter_id = None  # ID of the last added row of the 'iter' table; keep for probe persistence to access
 
+        self.traj_queue = deque()  # (trajectory, iteration count) pairs yet to be run sequentially; see add_fork()
+
         self._db_conn_open(fpath_db, do_load_sims)
 
     def __del__(self):
@@ -473,6 +977,7 @@ class TrajectoryEnsemble(object):
     def _db_conn_close(self):
         if self.conn is None: return
 
+        self.flush()
         self.conn.close()
         self.conn = None
 
@@ -509,6 +1014,7 @@ class TrajectoryEnsemble(object):
             with self.conn as c:
                 for r in c.execute('SELECT id, name, memo FROM traj', []):
                     self.traj[r['id']] = Trajectory(r['name'], r['memo'], ensemble=self, id=r['id'])
+                self.cache.group_hash_to_id = { int(r['hash']): r['id'] for r in c.execute('SELECT id, hash FROM grp', []) }
 
             if do_load_sims:
                 self.load_sims()
@@ -517,8 +1023,49 @@ class TrajectoryEnsemble(object):
             n_traj = self._db_get_one('SELECT COUNT(*) FROM traj', [])
             print(f'Using existing database (trajectories loaded: {n_traj})')
 
+        with self.conn as c:
+            c.executescript(self.SQL_CREATE_SCHEMA_STAT)  # databases created before the statistics tables existed lack them
+            c.executescript(self.SQL_CREATE_SCHEMA_FORK)  # ditto for forks
+            c.executescript(self.SQL_CREATE_SCHEMA_PARAM)  # ditto for parameter sweeps
+            if 'm_flow' not in [r['name'] for r in c.execute('PRAGMA table_info(iter)')]:  # ditto for total mass flow
+                c.execute('ALTER TABLE iter ADD COLUMN m_flow REAL')
+
+        if self.mass_store is not None:
+            self.mass_store.attach(self.conn)
+
         self.probe_persistence = ProbePersistenceDB.with_traj(self, self.conn)
 
+    def _db_get_grp_ids(self, groups, conn):
+        """Resolve database IDs of groups, persisting those groups that are not in the database yet.
+
+        All new groups are inserted at once and their IDs are retrieved with a single query (this object is the only
+        writer so the IDs greater than the maximum one prior to the insert are exactly those of the new groups).
+
+        Args:
+            groups (Iterable[Mapping[str,Any]]): Each item is a dict with keys ``hash``, ``attr``, and ``rel`` (the
+                latter two are only needed for groups not yet in the database).
+            conn (sqlite3.Connection): The SQLite3 connection object.
+
+        Returns:
+            Mapping[int,int]: Group hash to database ID map.
+        """
+
+        ids = self.cache.group_hash_to_id
+        new = { g['hash']: g for g in groups if g['hash'] not in ids }
+        if len(new) == 0:
+            return ids
+
+        # https://stackoverflow.com/questions/198692/can-i-pickle-a-python-dictionary-into-a-sqlite3-text-field
+
+        id_max = self._db_get_one('SELECT IFNULL(MAX(id), 0) FROM grp', [], conn)
+        conn.executemany(
+            'INSERT INTO grp (hash, attr, rel) VALUES (?,?,?)',
+            [[str(h), DB.obj2blob(g['attr']), DB.obj2blob(g['rel'])] for (h,g) in new.items()]
+        )
+        for r in conn.execute('SELECT id, hash FROM grp WHERE id > ?', [id_max]):
+            ids[int(r['hash'])] = r['id']
+        return ids
+
     def _db_get_id(self, tbl, where, col='rowid', conn=None):
         c = conn or self.conn
         row = c.execute('SELECT {} FROM {} WHERE {}'.format(col, tbl, where)).fetchone()
@@ -552,6 +1099,37 @@ class TrajectoryEnsemble(object):
             with self.conn as c:
                 c.execute(qry, args)
 
+    def add_fork(self, sim, name, sim_fork, i_left):
+        """Add a trajectory forked off of one of the ensemble's trajectories while the ensemble is being run.
+
+        This is the fork callback function of the simulations of the ensemble's trajectories (see
+        :meth:`Simulation.set_cb_fork() <pram.sim.Simulation.set_cb_fork>`).  The new trajectory is named after its
+        parent and the branch and shares the parent's history up to and including the iteration the fork directive has
+        been issued in; only the iterations that follow are simulated and stored.  The trajectory is run for the
+        iterations left once the trajectories queued before it have been run.
+
+        Forking is only supported when the ensemble is run sequentially.
+
+        Args:
+            sim (Simulation): The simulation being forked.
+            name (str): Branch name.
+            sim_fork (Simulation): The branch's simulation.
+            i_left (int): Number of iterations left to run.
+
+        Returns:
+            ``self``
+        """
+
+        parent = self.traj[sim.traj_id]
+        t = Trajectory(sim_fork, f'{parent.name or parent.id}/{name}', parent.memo)
+        self.add_trajectory(t)
+        if t.id is None:
+            raise TrajectoryError(f'Fork could not be added: {t.name}')
+
+        self._db_ins('INSERT INTO traj_fork (traj_id, parent_id, i) VALUES (?,?,?)', [t.id, parent.id, sim.timer.i - 1])
+        self.traj_queue.append((t, i_left))
+        return self
+
     def add_trajectories(self, traj):
         """Add trajectories.
 
@@ -620,6 +1198,33 @@ class TrajectoryEnsemble(object):
             t.compact()
         return self
 
+    def flush(self):
+        """Persist all buffered rows and commit the current transaction.
+
+        Iterations are saved in batches; the 'iter' rows are inserted right away (probes refer to them) while the
+        'mass_locus' and 'mass_flow' rows are buffered and inserted en masse.  The transaction spanning all of them is
+        committed every ``flush_every`` iterations.
+
+        Returns:
+            ``self``
+        """
+
+        if self.conn is None:
+            return self
+
+        if self.mass_store is not None:
+            self.mass_store.flush()
+        if len(self.ins_val.mass_locus) > 0:
+            self.conn.executemany('INSERT INTO mass_locus (iter_id, grp_id, m, m_p) VALUES (?,?,?,?)', self.ins_val.mass_locus)
+            self.ins_val.mass_locus = []
+        if len(self.ins_val.mass_flow) > 0:
+            self.conn.executemany('INSERT INTO mass_flow (iter_id, grp_src_id, grp_dst_id, m, m_p) VALUES (?,?,?,?,?)', self.ins_val.mass_flow)
+            self.ins_val.mass_flow = []
+        self.conn.commit()
+        self.n_iter_unflushed = 0
+
+        return self
+
     def gen_agent(self, traj, n_iter=-1):
         """Generate a single agent's group transition path based on population-level mass dynamics that a PRAM
         simulation operates on.
@@ -629,7 +1234,8 @@ class TrajectoryEnsemble(object):
         (1) Pick the agent's initial group respecting the initial mass distribution among the groups
         (2) Pick the next group respecting transition probabilities to all possible next groups
 
-        Because step 1 always takes place, the resulting list of agent's states will be of size ``n_iter + 1``.
+        Because step 1 always takes place, the resulting list of agent's states will be of size ``n_iter + 1``.  See
+        :meth:`~pram.traj.TrajectoryEnsemble.gen_agent_paths` for details.
 
         Args:
             traj (Trajectory): The trajectory to use.
@@ -641,35 +1247,17 @@ class TrajectoryEnsemble(object):
                 attributes and relations of the PRAM group that agent would be a part of if it were in a PRAM model.
         """
 
-        agent = { 'attr': {}, 'rel': {} }
-        with self.conn as c:
-            if n_iter <= -1:
-                n_iter = self._db_get_one('SELECT MAX(i) FROM iter WHERE traj_id = ?', [traj.id])
-            else:
-                n_iter = max(0, min(n_iter, self._db_get_one('SELECT MAX(i) FROM iter WHERE traj_id = ?', [traj.id])))
-
-            for i in range(-1, n_iter):
-                if i == -1:  # (1) setting the initial group
-                    # groups = list(zip(*[[r[0], round(r[1],2)] for r in c.execute('SELECT g.id, g.m_p FROM grp g INNER JOIN iter i ON i.id = g.iter_id WHERE i.traj_id = ? AND i.i = ?', [traj.id, -1])]))
-                    groups = list(zip(*[[r[0], round(r[1],2)] for r in c.execute('SELECT grp_id, m_p FROM mass_locus ml INNER JOIN iter i ON ml.iter_id = i.id WHERE i.traj_id = ? AND i.i = ?', [traj.id, -1])]))
-                else:  # (2) generating a sequence of group transitions
-                    groups = list(zip(*[[r[0], round(r[1],2)] for r in c.execute('SELECT g_dst.id, mf.m_p FROM mass_flow mf INNER JOIN iter i ON i.id = mf.iter_id INNER JOIN grp g_src ON g_src.id = mf.grp_src_id INNER JOIN grp g_dst ON g_dst.id = mf.grp_dst_id WHERE i.traj_id = ? AND i.i = ? AND g_src.id = ?', [traj.id, i, grp_id])]))
+        return self.gen_agent_pop(traj, 1, n_iter)[0]
 
-                # print(groups)
-                if sum(groups[1]) > 0:  # prevents errors when the sum is zero (should always be True for the 1st iter)
-                    grp_id = random.choices(groups[0], groups[1])[0]
+    def gen_agent_paths(self, traj, n_agents=1, n_iter=-1):
+        """Generate group transition paths of a population of agents.
 
-                for attr_rel in ['attr', 'rel']:
-                    grp_attr_rel = DB.blob2obj(self._db_get_one(f'SELECT {attr_rel} FROM grp WHERE id = ?', [grp_id]))
-                    for (k,v) in grp_attr_rel.items():
-                        if k not in agent[attr_rel].keys():
-                            agent[attr_rel][k] = [None] + [None] * n_iter
-                        agent[attr_rel][k][i+1] = v
-
-        return agent
-
-    def gen_agent_pop(self, traj, n_agents=1, n_iter=-1):
-        """Generate a agent population based on procedure described in :meth:`~pram.traj.TrajectoryEnsemble.gen_agent`.
+        The mass flow of the trajectory is read once and turned into one sparse transition matrix per iteration (rows
+        and columns are integer group indices and values are masses flowing from the row group to the column group).
+        The initial groups of all agents are drawn at once from the initial mass distribution and then, iteration by
+        iteration, all agents move at once by inverting the cumulative transition probabilities of their current groups
+        (i.e., with a single sorted search for the entire population).  An agent whose group has no outgoing mass flow
+        in an iteration stays in that group.
 
         Args:
             traj (Trajectory): The trajectory to use.
@@ -678,13 +1266,115 @@ class TrajectoryEnsemble(object):
                 trajectory).
 
         Returns:
-            Iterable[Mapping[str, Mapping[str, Any]]]: Each item is a dict with two keys, ``attr`` and ``rel`` which
-                correspond to the attributes and relations of the PRAM group that agent would be a part of if it were
-                in a PRAM model.
+            (numpy.ndarray, Iterable[Mapping[str,Any]]): Agent paths (shape ``(n_agents, n_iter + 1)``) as indices into
+                the list of groups and that list itself.  Each group is a dict with the keys ``id``, ``hash``,
+                ``attr``, and ``rel`` (attributes and relations are decoded once per group).
         """
 
-        return [self.gen_agent(traj, n_iter) for _ in range(n_agents)]
-
+        i_max = self._db_get_one('SELECT MAX(i) FROM traj_iter WHERE traj_id = ?', [traj.id])
+        if n_iter <= -1:
+            n_iter = i_max
+        else:
+            n_iter = max(0, min(n_iter, i_max))
+
+        grps = self.conn.execute('SELECT id, hash, attr, rel FROM grp ORDER BY id').fetchall()
+        grp_idx = np.full(max([r['id'] for r in grps], default=0) + 1, -1)  # group ID -> index
+        grp_idx[[r['id'] for r in grps]] = np.arange(len(grps))
+        n_grp = len(grps)
+
+        cur = self.conn.cursor()
+        cur.row_factory = None
+
+        # (1) Initial groups:
+        if self.mass_store is not None:
+            (t_iters, t_m) = self.mass_store.get_mass(traj.id)
+            m0 = np.zeros(n_grp)
+            if t_iters.size > 0 and t_iters[0] == -1:
+                cols = np.nonzero(~np.isnan(t_m[0]))[0]
+                m0[grp_idx[cols + 1]] = t_m[0,cols]  # column j holds the group with ID j+1
+        else:
+            res = np.array(cur.execute('SELECT ml.grp_id, ml.m FROM mass_locus ml INNER JOIN traj_iter i ON ml.iter_id = i.id WHERE i.traj_id = ? AND i.i = ?', [traj.id, -1]).fetchall(), dtype=float).reshape(-1,2)
+            m0 = np.bincount(grp_idx[res[:,0].astype(int)], res[:,1], minlength=n_grp)
+
+        paths = np.zeros((n_agents, n_iter + 1), dtype=np.min_scalar_type(max(n_grp - 1, 0)))
+        cdf = np.cumsum(m0)
+        if n_agents > 0 and cdf.size > 0 and cdf[-1] > 0:
+            paths[:,0] = np.minimum(np.searchsorted(cdf, (1.0 - np.random.random(n_agents)) * cdf[-1]), n_grp - 1)
+
+        # (2) Group transitions:
+        res = np.array(cur.execute('''
+            SELECT i.i, mf.grp_src_id, mf.grp_dst_id, mf.m
+            FROM mass_flow mf
+            INNER JOIN traj_iter i ON i.id = mf.iter_id
+            WHERE i.traj_id = ? AND i.i BETWEEN ? AND ?
+            ORDER BY i.i''', [traj.id, 0, n_iter - 1]).fetchall(), dtype=float).reshape(-1,4)
+        i_bounds = np.searchsorted(res[:,0], np.arange(n_iter + 1))
+
+        for i in range(n_iter):
+            curr = paths[:,i].astype(np.int64)
+            paths[:,i+1] = curr
+            rows = res[i_bounds[i]:i_bounds[i+1]]
+            if rows.shape[0] == 0:
+                continue
+
+            tm = csr_matrix((rows[:,3], (grp_idx[rows[:,1].astype(int)], grp_idx[rows[:,2].astype(int)])), shape=(n_grp, n_grp))  # transition matrix
+            tm.sum_duplicates()
+            tm.eliminate_zeros()
+            row_len = np.diff(tm.indptr)
+            row_tot = np.asarray(tm.sum(axis=1)).ravel()
+
+            # Cumulative probabilities offset by the row index so that a single sorted array covers all rows:
+            cs = np.cumsum(tm.data)
+            cs_row = np.repeat(np.concatenate(([0.0], cs))[tm.indptr[:-1]], row_len)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                key = np.repeat(np.arange(n_grp), row_len) + (cs - cs_row) / np.repeat(row_tot, row_len)
+
+            do_move = row_tot[curr] > 0
+            a = np.nonzero(do_move)[0]
+            g = curr[a]
+            j = np.searchsorted(key, g + (1.0 - np.random.random(a.size)))
+            j = np.clip(j, tm.indptr[g], tm.indptr[g+1] - 1)  # guard against floating-point round-off
+            paths[a,i+1] = tm.indices[j]
+
+        return (paths, [{ 'id': r['id'], 'hash': r['hash'], 'attr': DB.blob2obj(r['attr']), 'rel': DB.blob2obj(r['rel']) } for r in grps])
+
+    def gen_agent_pop(self, traj, n_agents=1, n_iter=-1):
+        """Generate a agent population based on procedure described in :meth:`~pram.traj.TrajectoryEnsemble.gen_agent`.
+
+        The paths of all agents are generated together by :meth:`~pram.traj.TrajectoryEnsemble.gen_agent_paths` and
+        then translated into per-agent series of attribute and relation values.
+
+        Args:
+            traj (Trajectory): The trajectory to use.
+            n_agents (int): Size of resulting agent population.
+            n_iter (int): Number of iterations to generate (use -1 for as many as many iterations there are in the
+                trajectory).
+
+        Returns:
+            Iterable[Mapping[str, Mapping[str, Any]]]: Each item is a dict with two keys, ``attr`` and ``rel`` which
+                correspond to the attributes and relations of the PRAM group that agent would be a part of if it were
+                in a PRAM model.
+        """
+
+        (paths, grps) = self.gen_agent_paths(traj, n_agents, n_iter)
+        agents = [{ 'attr': {}, 'rel': {} } for _ in range(n_agents)]
+
+        for attr_rel in ['attr', 'rel']:
+            names = []
+            for g in grps:
+                for k in (g[attr_rel] or {}).keys():
+                    if k not in names:
+                        names.append(k)
+
+            for k in names:
+                vals = np.empty(len(grps), dtype=object)
+                vals[:] = [(g[attr_rel] or {}).get(k) for g in grps]
+                has_k = np.array([k in (g[attr_rel] or {}) for g in grps])
+                for a in np.nonzero(has_k[paths].any(axis=1))[0]:  # only agents that have been in a group with the name
+                    agents[a][attr_rel][k] = vals[paths[a]].tolist()
+
+        return agents
+
     def gen_mass_graph(self, traj):
         """Generate a mass graph.
 
@@ -696,33 +1386,226 @@ class TrajectoryEnsemble(object):
         """
 
         g = MassGraph()
-        n_iter = self._db_get_one('SELECT MAX(i) FROM iter WHERE traj_id = ?', [traj.id])
+
+        # Groups (vertices):
+        (m, grps, iters) = self.get_mass_locus(traj)
+        (m_p, _, _) = self.get_mass_locus(traj, do_prob=True)
+        grp_ord = np.argsort([r['id'] for r in grps], kind='stable')  # vertices are added in the order of group IDs
+        for (j,i) in enumerate(iters):
+            for k in grp_ord:
+                if not np.isnan(m[k,j]):
+                    g.add_group(int(i), grps[k]['hash'], m[k,j], m_p[k,j])
+
+        # Mass flow (edges):
         with self.conn as c:
-            # Groups (vertices):
-            for i in range(-1, n_iter + 1):
-                for r in c.execute('''
-                        SELECT g.hash, ml.m, ml.m_p FROM grp g
-                        INNER JOIN mass_locus ml ON ml.grp_id = g.id
-                        INNER JOIN iter i ON i.id = ml.iter_id
-                        WHERE i.traj_id = ? AND i.i = ?
-                        ORDER BY g.id''', [traj.id, i]):
-                    g.add_group(i, r['hash'], r['m'], r['m_p'])
-
-            # Mass flow (edges):
-            for i in range(n_iter + 1):
-                for r in c.execute('''
-                        SELECT g1.hash AS src_hash, g2.hash AS dst_hash, mf.m AS m, mf.m_p AS m_p
-                        FROM mass_flow mf
-                        INNER JOIN iter i ON i.id = mf.iter_id
-                        INNER JOIN grp g1 ON mf.grp_src_id = g1.id
-                        INNER JOIN grp g2 ON mf.grp_dst_id = g2.id
-                        WHERE i.traj_id = ? AND i.i = ?
-                        ORDER BY mf.id''',
-                        [traj.id, i]):
-                    g.add_mass_flow(i, r['src_hash'], r['dst_hash'], r['m'], r['m_p'])
+            for r in c.execute('''
+                    SELECT i.i, g1.hash AS src_hash, g2.hash AS dst_hash, mf.m AS m, mf.m_p AS m_p
+                    FROM mass_flow mf
+                    INNER JOIN traj_iter i ON i.id = mf.iter_id
+                    INNER JOIN grp g1 ON mf.grp_src_id = g1.id
+                    INNER JOIN grp g2 ON mf.grp_dst_id = g2.id
+                    WHERE i.traj_id = ? AND i.i >= 0
+                    ORDER BY i.i, mf.id''',
+                    [traj.id]):
+                g.add_mass_flow(r['i'], r['src_hash'], r['dst_hash'], r['m'], r['m_p'])
 
         return g
 
+    def _get_mass_locus_data(self, m, grps, iters):
+        """Convert mass locus into plot data records (one per group present in an iteration of a trajectory).
+
+        Args:
+            m (numpy.ndarray): Masses (see :meth:`~pram.traj.TrajectoryEnsemble.get_mass_locus`).
+            grps (Iterable[sqlite3.Row]): Groups.
+            iters (numpy.ndarray): Iterations.
+
+        Returns:
+            Iterable[Mapping[str,Any]]
+        """
+
+        names = [g['name'] or g['hash'] for g in grps]
+        m = m.reshape(m.shape[:2] + (-1,)).transpose(2,1,0)  # trajectory, iteration, group
+        return [{ 'i': int(iters[i]) + 1, 'm': float(m[t,i,g]), 'grp': names[g] } for (t,i,g) in zip(*np.nonzero(~np.isnan(m)))]
+
+    def get_mass_flow_tot(self, traj):
+        """Get the total mass transferred in every iteration of a trajectory.
+
+        The total is recorded at all mass flow recording levels other than ``none`` (see :meth:`Simulation.save_state()
+        <pram.sim.Simulation.save_state>`) and is the only mass flow information the ``aggr`` level records.
+
+        Args:
+            traj (Trajectory): The trajectory.
+
+        Returns:
+            numpy.ndarray: Iterations and the corresponding totals (shape ``(n_iter, 2)``).
+        """
+
+        return np.array(self.conn.execute('''
+            SELECT i.i, it.m_flow
+            FROM traj_iter i
+            INNER JOIN iter it ON it.id = i.id
+            WHERE i.traj_id = ? AND it.m_flow IS NOT NULL
+            ORDER BY i.i''', [traj.id]).fetchall(), dtype=float).reshape(-1,2)
+
+    def get_mass_locus(self, traj=None, iter_range=(-1, -1), do_prob=False):
+        """Get mass locus of a trajectory or of the entire ensemble as a dense array.
+
+        All the data are retrieved in a single pass (one ordered query or one read of the columnar mass store per
+        trajectory) and scattered into a preallocated array.  Groups absent in an iteration are NaN.
+
+        Args:
+            traj (Trajectory, optional): The trajectory.  If None, all trajectories are retrieved.
+            iter_range (tuple[int,int]): Range of iterations.
+            do_prob (bool): Do proportions of total mass?
+
+        Returns:
+            (numpy.ndarray, Iterable[sqlite3.Row], numpy.ndarray): Masses, groups, and iterations.  Masses have the shape
+                ``(n_grp, n_iter)`` for a single trajectory and ``(n_grp, n_iter, n_traj)`` for the entire ensemble
+                (with trajectories in the order of ``self.traj``).  Groups (each with the ``id``, ``hash``, and
+                ``name`` fields) are ordered by their name order and then ID.
+        """
+
+        traj_lst = [traj] if traj is not None else list(self.traj.values())
+        if traj is not None:
+            iter_range = self.normalize_iter_range(iter_range, 'SELECT MAX(i) FROM traj_iter WHERE traj_id = ?', [traj.id])
+        else:
+            iter_range = self.normalize_iter_range(iter_range, 'SELECT MAX(i) FROM iter', [])
+        iters = np.arange(iter_range[0], iter_range[1] + 1)
+
+        grps = self.conn.execute('SELECT g.id, g.hash, gn.name FROM grp g LEFT JOIN grp_name gn ON gn.hash = g.hash ORDER BY gn.ord, g.id').fetchall()
+        grp_idx = np.full(max([r['id'] for r in grps], default=0) + 1, -1)  # group ID -> row
+        grp_idx[[r['id'] for r in grps]] = np.arange(len(grps))
+
+        m = np.full((len(grps), iters.size, len(traj_lst)), np.nan)
+        if self.mass_store is not None:
+            for (k,t) in enumerate(traj_lst):
+                (t_iters, t_m) = self.mass_store.get_mass(t.id)
+                sel = (t_iters >= iter_range[0]) & (t_iters <= iter_range[1])
+                t_m = t_m[sel]
+                if do_prob:
+                    t_m = t_m / np.nansum(t_m, axis=1)[:,None]
+                rows = grp_idx[1:t_m.shape[1] + 1]  # column j holds the group with ID j+1
+                cols = np.nonzero(rows >= 0)[0]
+                m[rows[cols][:,None], (t_iters[sel] - iter_range[0])[None,:], k] = t_m[:,cols].T
+        else:
+            traj_idx = np.full(max([t.id for t in traj_lst], default=0) + 1, -1)  # traj ID -> slice
+            traj_idx[[t.id for t in traj_lst]] = np.arange(len(traj_lst))
+
+            cur = self.conn.cursor()
+            cur.row_factory = None
+            qry = f'''
+                SELECT i.traj_id, i.i, ml.grp_id, ml.{'m_p' if do_prob else 'm'}
+                FROM mass_locus ml
+                INNER JOIN traj_iter i ON i.id = ml.iter_id
+                WHERE i.i BETWEEN ? AND ?'''
+            if traj is not None:
+                res = np.array(cur.execute(qry + ' AND i.traj_id = ?', [iter_range[0], iter_range[1], traj.id]).fetchall(), dtype=float)
+            else:
+                res = np.array(cur.execute(qry, [iter_range[0], iter_range[1]]).fetchall(), dtype=float)
+
+            if res.size > 0:
+                m[grp_idx[res[:,2].astype(int)], res[:,1].astype(int) - iter_range[0], traj_idx[res[:,0].astype(int)]] = res[:,3]
+
+        if traj is not None:
+            m = m[:,:,0]
+        return (m, grps, iters)
+
+    def _get_mass_locus_stat_data(self, stat, band_type):
+        """Convert mass locus statistics into plot data records (one per group present in an iteration).
+
+        Args:
+            stat (Mapping[str,Any]): Statistics (see :meth:`~pram.traj.TrajectoryEnsemble.get_mass_locus_stat`).
+            band_type (str): Band type (see ``STAT_BAND_TYPES``).  The ``ci`` band is the normal approximation of the
+                95% confidence interval of the mean.
+
+        Returns:
+            Iterable[Mapping[str,Any]]
+        """
+
+        (n, mean, sd) = (stat['n'], stat['mean'], stat['sd'])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if band_type == 'ci':
+                (lo, hi) = (mean - 1.96 * sd / np.sqrt(n), mean + 1.96 * sd / np.sqrt(n))
+            elif band_type == 'stderr':
+                (lo, hi) = (mean - sd / np.sqrt(n), mean + sd / np.sqrt(n))
+            elif band_type == 'stdev':
+                (lo, hi) = (mean - sd, mean + sd)
+            elif band_type == 'minmax':
+                (lo, hi) = (stat['min'], stat['max'])
+            else:
+                raise ValueError(f"Band type must be one of: {', '.join(self.STAT_BAND_TYPES)}.")
+
+        names = [g['name'] or g['hash'] for g in stat['grps']]
+        iters = stat['iters']
+        return [
+            { 'i': int(iters[i]) + 1, 'm': float(mean[g,i]), 'lo': float(lo[g,i]), 'hi': float(hi[g,i]), 'grp': names[g] }
+            for (g,i) in zip(*np.nonzero(n > 0))
+        ]
+
+    def get_mass_locus_stat(self, iter_range=(-1, -1)):
+        """Get ensemble statistics of mass locus as dense arrays.
+
+        The statistics are read from the 'mass_locus_stat' summary table which is brought up to date first (see
+        :meth:`~pram.traj.TrajectoryEnsemble.upd_mass_locus_stat`).  Consequently, the size of the result and the cost
+        of obtaining it depend on the number of groups and iterations but not on the number of trajectories.  Only the
+        trajectories in which a group is present in an iteration contribute to that group's statistics in that iteration.
+
+        Args:
+            iter_range (tuple[int,int]): Range of iterations.
+
+        Returns:
+            Mapping[str,Any]: Keys ``n`` (number of trajectories), ``mean``, ``sd`` (sample standard deviation), ``min``,
+                and ``max`` hold arrays of the shape ``(n_grp, n_iter)`` (NaN where ``n`` is zero).  Keys ``grps`` and
+                ``iters`` hold groups and iterations as returned by :meth:`~pram.traj.TrajectoryEnsemble.get_mass_locus`.
+        """
+
+        self.upd_mass_locus_stat()
+
+        iter_range = self.normalize_iter_range(iter_range, 'SELECT MAX(i) FROM iter', [])
+        iters = np.arange(iter_range[0], iter_range[1] + 1)
+
+        grps = self.conn.execute('SELECT g.id, g.hash, gn.name FROM grp g LEFT JOIN grp_name gn ON gn.hash = g.hash ORDER BY gn.ord, g.id').fetchall()
+        grp_idx = np.full(max([r['id'] for r in grps], default=0) + 1, -1)  # group ID -> row
+        grp_idx[[r['id'] for r in grps]] = np.arange(len(grps))
+
+        cur = self.conn.cursor()
+        cur.row_factory = None
+        res = np.array(cur.execute('SELECT grp_id, i, n, m_mean, m_m2, m_min, m_max FROM mass_locus_stat WHERE i BETWEEN ? AND ?', [iter_range[0], iter_range[1]]).fetchall(), dtype=float)
+
+        stat = { k: np.full((len(grps), iters.size), np.nan) for k in ('mean', 'sd', 'min', 'max') }
+        stat['n'] = np.zeros((len(grps), iters.size), dtype=int)
+        if res.size > 0:
+            idx = (grp_idx[res[:,0].astype(int)], res[:,1].astype(int) - iter_range[0])
+            n = res[:,2]
+            stat['n'][idx]    = n
+            stat['mean'][idx] = res[:,3]
+            stat['sd'][idx]   = np.sqrt(np.divide(res[:,4], n - 1, out=np.zeros_like(n), where=n > 1))
+            stat['min'][idx]  = res[:,5]
+            stat['max'][idx]  = res[:,6]
+
+        stat['grps']  = grps
+        stat['iters'] = iters
+        return stat
+
+    def get_params(self, traj=None):
+        """Get parameter values recorded for trajectories (e.g., by a :class:`~pram.traj.ParamSweep`).
+
+        Args:
+            traj (Trajectory, optional): The trajectory.  If None, parameter values of all trajectories are returned.
+
+        Returns:
+            Mapping[str,Any] or Mapping[int,Mapping[str,Any]]: Parameter names mapped onto values for the trajectory
+                designated or trajectory database IDs mapped onto those for all trajectories.
+        """
+
+        if traj is not None:
+            return { r['name']: r['val'] for r in self.conn.execute('SELECT name, val FROM traj_param WHERE traj_id = ? ORDER BY name', [traj.id]) }
+
+        params = {}
+        for r in self.conn.execute('SELECT traj_id, name, val FROM traj_param ORDER BY traj_id, name'):
+            params.setdefault(r['traj_id'], {})[r['name']] = r['val']
+        return params
+
     def get_signal(self, traj, do_prob=False):
         """Get time series of masses (or proportions of total mass) of all groups.
 
@@ -734,36 +1617,8 @@ class TrajectoryEnsemble(object):
             Signal
         """
 
-        n_iter_max = self._db_get_one('''
-            SELECT MAX(n_iter) AS n_iter FROM (
-            SELECT g.hash, COUNT(*) AS n_iter FROM grp g
-            INNER JOIN mass_locus ml ON ml.grp_id = g.id
-            INNER JOIN iter i ON i.id = ml.iter_id
-            INNER JOIN traj t ON t.id = i.traj_id
-            WHERE t.id = ?
-            GROUP BY g.hash
-            )''', [traj.id]
-        )
-
-        y = 'm_p' if do_prob else 'm'
-        signal = Signal()
-
-        for g in self.conn.execute('SELECT DISTINCT g.hash, gn.name FROM grp g LEFT JOIN grp_name gn ON gn.hash = g.hash ORDER BY gn.ord, g.id').fetchall():
-            s = np.full([1, n_iter_max], np.nan)  # account for missing values in the signal series
-                    # SELECT i.i + 1 AS i, g.{y} AS y FROM grp g
-            for iter in self.conn.execute(f'''
-                    SELECT i.i + 1 AS i, ml.{y} AS y
-                    FROM grp g
-                    INNER JOIN mass_locus ml ON ml.grp_id = g.id
-                    INNER JOIN iter i ON i.id = ml.iter_id
-                    INNER JOIN traj t ON t.id = i.traj_id
-                    LEFT JOIN grp_name gn ON gn.hash = g.hash
-                    WHERE t.id = ? AND g.hash = ?
-                    ORDER BY gn.ord, g.hash, i.i''', [traj.id, g['hash']]).fetchall():
-                s[0,iter['i']] = iter['y']
-            signal.add_series(s, g['name'] or g['hash'])
-
-        return signal
+        (m, grps, _) = self.get_mass_locus(traj, do_prob=do_prob)
+        return Signal(m, [g['name'] or g['hash'] for g in grps])
 
     def get_time_series(self, traj, group_hash):
         """Get a time series of group mass dynamics.
@@ -898,30 +1753,15 @@ class TrajectoryEnsemble(object):
         data = { 'td': {}, 'fd': {} }  # time- and frequency-domain
         with self.conn as c:
             # (1.1) Normalize iteration bounds:
-            iter_range = self.normalize_iter_range(iter_range, 'SELECT MAX(i) FROM iter WHERE traj_id = ?', [traj.id])
+            iter_range = self.normalize_iter_range(iter_range, 'SELECT MAX(i) FROM traj_iter WHERE traj_id = ?', [traj.id])
             n_iter = iter_range[1] - min(iter_range[0], 0)
             title = f'Trajectory Mass Locus Spectrum (FFT; Sampling Rate of {sampling_rate} on Iterations {iter_range[0]+1} to {iter_range[1]+1})'
 
             # (1.2) Construct time-domain data bundle:
-            for r in c.execute('''
-                    SELECT i.i, ml.m, COALESCE(gn.name, g.hash) AS name
-                    FROM grp g
-                    INNER JOIN mass_locus ml ON g.id = ml.grp_id
-                    INNER JOIN iter i ON i.id = ml.iter_id
-                    INNER JOIN traj t ON t.id = i.traj_id
-                    LEFT JOIN grp_name gn ON gn.hash = g.hash
-                    WHERE i.traj_id = ? AND i.i BETWEEN ? AND ?
-                    ORDER BY gn.ord, g.id''', [traj.id, iter_range[0], iter_range[1]]):
-                    # SELECT COALESCE(gn.name, g.hash) AS grp, g.m
-                    # FROM grp g
-                    # INNER JOIN iter i ON i.id = g.iter_id
-                    # LEFT JOIN grp_name gn ON gn.hash = g.hash
-                    # WHERE i.traj_id = ? AND i.i BETWEEN ? AND ?
-                    # ORDER BY gn.ord, g.id''',
-                    # [traj.id, iter_range[0], iter_range[1]]):
-                if data['td'].get(r['grp']) is None:
-                    data['td'][r['grp']] = []
-                data['td'][r['grp']].append(r['m'])
+            (m, grps, _) = self.get_mass_locus(traj, iter_range)
+            for (k,g) in enumerate(grps):
+                if not np.isnan(m[k]).all():
+                    data['td'][g['name'] or g['hash']] = m[k][~np.isnan(m[k])].tolist()
 
             # (1.3) Move to frequency domain:
             N = sampling_rate
@@ -991,30 +1831,15 @@ class TrajectoryEnsemble(object):
         data = { 'td': {}, 'fd': {} }  # time- and frequency-domain
         with self.conn as c:
             # (1.1) Normalize iteration bounds:
-            iter_range = self.normalize_iter_range(iter_range, 'SELECT MAX(i) FROM iter WHERE traj_id = ?', [traj.id])
+            iter_range = self.normalize_iter_range(iter_range, 'SELECT MAX(i) FROM traj_iter WHERE traj_id = ?', [traj.id])
             n_iter = iter_range[1] - min(iter_range[0], 0)
             title = f'Trajectory Mass Locus Scalogram (Sampling Rate of {sampling_rate} on Iterations {iter_range[0]+1} to {iter_range[1]+1})'
 
             # (1.2) Construct time-domain data bundle:
-            for r in c.execute('''
-                    SELECT i.i, ml.m, COALESCE(gn.name, g.hash) AS name
-                    FROM grp g
-                    INNER JOIN mass_locus ml ON g.id = ml.grp_id
-                    INNER JOIN iter i ON i.id = ml.iter_id
-                    INNER JOIN traj t ON t.id = i.traj_id
-                    LEFT JOIN grp_name gn ON gn.hash = g.hash
-                    WHERE i.traj_id = ? AND i.i BETWEEN ? AND ?
-                    ORDER BY gn.ord, g.id''', [traj.id, iter_range[0], iter_range[1]]):
-                    # SELECT COALESCE(gn.name, g.hash) AS grp, g.m
-                    # FROM grp g
-                    # INNER JOIN iter i ON i.id = g.iter_id
-                    # LEFT JOIN grp_name gn ON gn.hash = g.hash
-                    # WHERE i.traj_id = ? AND i.i BETWEEN ? AND ?
-                    # ORDER BY gn.ord, g.id''',
-                    # [traj.id, iter_range[0], iter_range[1]]):
-                if data['td'].get(r['grp']) is None:
-                    data['td'][r['grp']] = []
-                data['td'][r['grp']].append(r['m'])
+            (m, grps, _) = self.get_mass_locus(traj, iter_range)
+            for (k,g) in enumerate(grps):
+                if not np.isnan(m[k]).all():
+                    data['td'][g['name'] or g['hash']] = m[k][~np.isnan(m[k])].tolist()
 
         # (2) Move to frequency domain and plot:
         widths = np.arange(1, sampling_rate // 2 + 1)
@@ -1073,32 +1898,17 @@ class TrajectoryEnsemble(object):
         data = { 'td': {}, 'fd': {} }  # time- and frequency-domain
         with self.conn as c:
             # (1.1) Normalize iteration bounds:
-            iter_range = self.normalize_iter_range(iter_range, 'SELECT MAX(i) FROM iter WHERE traj_id = ?', [traj.id])
+            iter_range = self.normalize_iter_range(iter_range, 'SELECT MAX(i) FROM traj_iter WHERE traj_id = ?', [traj.id])
             n_iter = iter_range[1] - min(iter_range[0], 0)
 
             # (1.2) Construct time-domain data bundle:
-            for r in c.execute('''
-                    SELECT i.i, ml.m, COALESCE(gn.name, g.hash) AS name
-                    FROM grp g
-                    INNER JOIN mass_locus ml ON g.id = ml.grp_id
-                    INNER JOIN iter i ON i.id = ml.iter_id
-                    INNER JOIN traj t ON t.id = i.traj_id
-                    LEFT JOIN grp_name gn ON gn.hash = g.hash
-                    WHERE i.traj_id = ? AND i.i BETWEEN ? AND ?
-                    ORDER BY i.i, gn.ord''', [traj.id, iter_range[0], iter_range[1]]):
-                    # SELECT COALESCE(gn.name, g.hash) AS grp, g.m
-                    # FROM grp g
-                    # INNER JOIN iter i ON i.id = g.iter_id
-                    # LEFT JOIN grp_name gn ON gn.hash = g.hash
-                    # WHERE i.traj_id = ? AND i.i BETWEEN ? AND ?
-                    # ORDER BY gn.ord, g.id''',
-                    # [traj.id, iter_range[0], iter_range[1]]):
-                if data['td'].get(r['grp']) is None:
-                    data['td'][r['grp']] = []
-                data['td'][r['grp']].append(r['m'])
+            (m, grps, _) = self.get_mass_locus(traj, iter_range)
+            for (k,g) in enumerate(grps):
+                if not np.isnan(m[k]).all():
+                    data['td'][g['name'] or g['hash']] = m[k][~np.isnan(m[k])].tolist()
 
         # (2) Plot:
-        sampling_rate = sampling_rate or self._db_get_one('SELECT MAX(i) + 1 FROM iter WHERE traj_id = ?', [traj.id])
+        sampling_rate = sampling_rate or self._db_get_one('SELECT MAX(i) + 1 FROM traj_iter WHERE traj_id = ?', [traj.id])
         win_len = win_len or sampling_rate // 100
 
         NFFT = win_len           # the length of the windowing segments
@@ -1154,7 +1964,7 @@ class TrajectoryEnsemble(object):
                 title = f'Trajectory Ensemble Mass Locus (Random Sample of {len(traj_sample)} from {len(self.traj)})'
             opacity = max(opacity_min, 1.00 / len(traj_sample))
 
-        # iter_range = self.normalize_iter_range(iter_range, 'SELECT MAX(i) FROM iter WHERE traj_id = ?', [next(iter(traj_sample)).id])
+        # iter_range = self.normalize_iter_range(iter_range, 'SELECT MAX(i) FROM traj_iter WHERE traj_id = ?', [next(iter(traj_sample)).id])
         # title += f'Iterations {iter_range[0]+1} to {iter_range[1]+1})'
 
         # (2) Group sorting (needs to be done here due to Altair's peculiarities):
@@ -1165,20 +1975,10 @@ class TrajectoryEnsemble(object):
         plots = []
         for (ti,t) in enumerate(traj_sample):
             # (3.1) Normalize iteration bounds:
-            iter_range = self.normalize_iter_range(iter_range, 'SELECT MAX(i) FROM iter WHERE traj_id = ?', [t.id])
+            iter_range = self.normalize_iter_range(iter_range, 'SELECT MAX(i) FROM traj_iter WHERE traj_id = ?', [t.id])
 
             # (3.2) Construct the trajectory data bundle:
-            data = []
-            with self.conn as c:
-                for r in c.execute('''
-                        SELECT i.i, ml.m, COALESCE(gn.name, g.hash) AS name
-                        FROM grp g
-                        INNER JOIN mass_locus ml ON g.id = ml.grp_id
-                        INNER JOIN iter i ON i.id = ml.iter_id
-                        LEFT JOIN grp_name gn ON gn.hash = g.hash
-                        WHERE i.traj_id = ? AND i.i BETWEEN ? AND ?
-                        ORDER BY i.i, gn.ord''', [t.id, iter_range[0], iter_range[1]]):
-                    data.append({ 'i': r['i'] + 1, 'm': r['m'], 'grp': r['name'] })
+            data = self._get_mass_locus_data(*self.get_mass_locus(t, iter_range))
 
             # (3.3) Plot the trajectory:
             plots.append(
@@ -1211,6 +2011,11 @@ class TrajectoryEnsemble(object):
     def plot_mass_locus_line_aggr(self, size, filepath, iter_range=(-1, -1), band_type='ci', stroke_w=1, col_scheme='set1', do_ret_plot=False):
         """Generate a mass locus line plot (aggregated).
 
+        Band types listed in ``STAT_BAND_TYPES`` are plotted from ensemble statistics computed in the database (see
+        :meth:`~pram.traj.TrajectoryEnsemble.get_mass_locus_stat`) so the plot data holds one record per group and
+        iteration.  Other band types supported by altair (e.g., ``iqr``) require the mass locus of every trajectory to
+        be handed to altair for aggregation.
+
         Args:
             size (tuple[int,int]): Figure size.
             filepath (str): Destination filepath.
@@ -1238,36 +2043,36 @@ class TrajectoryEnsemble(object):
             sort = [r['name'] for r in c.execute('SELECT DISTINCT COALESCE(gn.name, g.hash) AS name FROM grp g LEFT JOIN grp_name gn ON gn.hash = g.hash ORDER BY gn.ord, g.id')]
 
         # (3) Plot:
+        x = alt.X('i:Q', axis=alt.Axis(title='Iteration', domain=False, tickSize=0, grid=False, labelFontSize=15, titleFontSize=15), scale=alt.Scale(domain=(0, iter_range[1])))
+
         # (3.1) Construct data bundle:
-        data = []
-        with self.conn as c:
-            for r in c.execute('''
-                    SELECT i.i, ml.m, COALESCE(gn.name, g.hash) AS name
-                    FROM grp g
-                    INNER JOIN mass_locus ml ON g.id = ml.grp_id
-                    INNER JOIN iter i ON i.id = ml.iter_id
-                    INNER JOIN traj t ON t.id = i.traj_id
-                    LEFT JOIN grp_name gn ON gn.hash = g.hash
-                    WHERE i.i BETWEEN ? AND ?
-                    ORDER BY t.id, i.i, gn.ord''', [iter_range[0], iter_range[1]]):
-                data.append({ 'i': r['i'] + 1, 'm': r['m'], 'grp': r['name'] })
+        if band_type in self.STAT_BAND_TYPES:  # aggregated in the database
+            data = self._get_mass_locus_stat_data(self.get_mass_locus_stat(iter_range), band_type)
+            y_line = alt.Y('m:Q', axis=alt.Axis(title='Mass', domain=False, tickSize=0, grid=False, labelFontSize=15, titleFontSize=15))
+            y_band = [alt.Y('lo:Q', axis=alt.Axis(title='Mass', domain=False, tickSize=0, grid=False, labelFontSize=15, titleFontSize=15)), alt.Y2('hi:Q')]
+            band_kwargs = {}
+        else:                                  # aggregated by altair
+            data = self._get_mass_locus_data(*self.get_mass_locus(None, iter_range))
+            y_line = alt.Y('mean(m):Q', axis=alt.Axis(title='Mass', domain=False, tickSize=0, grid=False, labelFontSize=15, titleFontSize=15))
+            y_band = [y_line]
+            band_kwargs = { 'extent': band_type }
 
         # (3.2) Plot iterations:
         plot_line = alt.Chart(
             ).mark_line(
                 strokeWidth=stroke_w, interpolate='basis'#, tension=1  # basis, basis-closed, cardinal, cardinal-closed, bundle(tension)
             ).encode(
-                alt.X('i:Q', axis=alt.Axis(title='Iteration', domain=False, tickSize=0, grid=False, labelFontSize=15, titleFontSize=15), scale=alt.Scale(domain=(0, iter_range[1]))),
-                alt.Y('mean(m):Q', axis=alt.Axis(title='Mass', domain=False, tickSize=0, grid=False, labelFontSize=15, titleFontSize=15)),
+                x,
+                y_line,
                 alt.Color('grp:N', scale=alt.Scale(scheme=col_scheme), legend=alt.Legend(title='Group', labelFontSize=15, titleFontSize=15), sort=sort)
             )
 
         plot_band = alt.Chart(  # https://altair-viz.github.io/user_guide/generated/core/altair.ErrorBandDef.html#altair.ErrorBandDef
             ).mark_errorband(
-                extent=band_type, interpolate='basis'#, tension=1  # opacity, basis, basis-closed, cardinal, cardinal-closed, bundle(tension)
+                interpolate='basis', **band_kwargs#, tension=1  # opacity, basis, basis-closed, cardinal, cardinal-closed, bundle(tension)
             ).encode(
-                alt.X('i:Q', axis=alt.Axis(title='Iteration', domain=False, tickSize=0, grid=False, labelFontSize=15, titleFontSize=15), scale=alt.Scale(domain=(0, iter_range[1]))),
-                alt.Y('mean(m):Q', axis=alt.Axis(title='Mass', domain=False, tickSize=0, grid=False, labelFontSize=15, titleFontSize=15)),
+                x,
+                *y_band,
                 alt.Color('grp:N', scale=alt.Scale(scheme=col_scheme), legend=None, sort=sort)
             )
 
@@ -1324,7 +2129,7 @@ class TrajectoryEnsemble(object):
         plots = []
         for (ti,t) in enumerate(traj_sample):
             # (3.1) Normalize iteration bounds:
-            iter_range = self.normalize_iter_range(iter_range, 'SELECT MAX(i) FROM iter WHERE traj_id = ?', [t.id])
+            iter_range = self.normalize_iter_range(iter_range, 'SELECT MAX(i) FROM traj_iter WHERE traj_id = ?', [t.id])
 
             # (3.2) Construct the trajectory data bundle:
             data = []
@@ -1333,7 +2138,7 @@ class TrajectoryEnsemble(object):
                     for r in c.execute(f'''
                             SELECT i.i, p.{s['var']} AS y
                             FROM {probe_name} p
-                            INNER JOIN iter i ON i.id = p.iter_id
+                            INNER JOIN traj_iter i ON i.id = p.iter_id
                             WHERE i.traj_id = ? AND i.i BETWEEN ? AND ?
                             ORDER BY i.i''', [t.id, iter_range[0], iter_range[1]]):
                         data.append({ 'i': r['i'] + 1, 'y': r['y'], 'series': s['lbl'] })
@@ -1396,7 +2201,7 @@ class TrajectoryEnsemble(object):
             traj_sample = random.sample(list(self.traj.values()), n_traj)
             title = f'Trajectory Ensemble Mass Locus (Random Sample of {len(traj_sample)} from {len(self.traj)}; '
 
-        iter_range = self.normalize_iter_range(iter_range, 'SELECT MAX(i) FROM iter WHERE traj_id = ?', [next(iter(traj_sample)).id])
+        iter_range = self.normalize_iter_range(iter_range, 'SELECT MAX(i) FROM traj_iter WHERE traj_id = ?', [next(iter(traj_sample)).id])
         n_iter_per_rot = n_iter_per_rot if (n_iter_per_rot > 0) else iter_range[1] - iter_range[0]
         theta = np.arange(iter_range[0] + 1, iter_range[1] + 2, 1) * 2 * np.pi / n_iter_per_rot
         if n_iter_per_rot == iter_range[1] - iter_range[0]:
@@ -1420,7 +2225,7 @@ class TrajectoryEnsemble(object):
             signal = self.get_signal(t, True)
 
             # (2.3) Plot the signal:
-            for (j,s) in enumerate(signal.S):
+            for (j,s) in enumerate(signal.series):
                 ax.plot(theta, s[iter_range[0] + 1:iter_range[1] + 2], lw=1, linestyle='-', alpha=0.1, color=cmap(j % n_cmap), mfc='none', antialiased=True)
             if i == 0:
                 ax.legend(signal.names, loc='upper right')
@@ -1462,9 +2267,9 @@ class TrajectoryEnsemble(object):
         from pyrqa.computation     import RPComputation
         from pyrqa.image_generator import ImageGenerator
 
-        iter_range = self.normalize_iter_range(iter_range, 'SELECT MAX(i) FROM iter WHERE traj_id = ?', [traj.id])
+        iter_range = self.normalize_iter_range(iter_range, 'SELECT MAX(i) FROM traj_iter WHERE traj_id = ?', [traj.id])
         signal = traj.get_signal()
-        ts = TimeSeries(list(zip(*signal.S)), embedding_dimension=embedding_dimension, time_delay=time_delay)  # len(signal.S)
+        ts = TimeSeries(list(zip(*signal.series)), embedding_dimension=embedding_dimension, time_delay=time_delay)  # len(signal.series)
 
         # with self.conn as c:
             # ts = TimeSeries([r['m'] for r in c.execute('''
@@ -1507,28 +2312,17 @@ class TrajectoryEnsemble(object):
         """
 
         # (1) Data:
-        data = []
         with self.conn as c:
             # (1.1) Normalize iteration bounds:
-            iter_range = self.normalize_iter_range(iter_range, 'SELECT MAX(i) FROM iter WHERE traj_id = ?', [traj.id])
+            iter_range = self.normalize_iter_range(iter_range, 'SELECT MAX(i) FROM traj_iter WHERE traj_id = ?', [traj.id])
 
             # (1.2) Determine max mass sum:
-            m_max = self._db_get_one('''
-                SELECT ROUND(MAX(m_sum),4) FROM (
-                SELECT SUM(m) AS m_sum FROM mass_locus ml INNER JOIN iter i on i.id = ml.iter_id WHERE i.traj_id = ? GROUP BY ml.iter_id
-                )''', [traj.id]
-            )  # without rounding, weird-ass max values can appear due to inexact floating-point arithmetic (four decimals is arbitrary though)
+            (m, grps, iters) = self.get_mass_locus(traj)
+            m_max = round(np.nanmax(np.nansum(m, axis=0)), 4)  # without rounding, weird-ass max values can appear due to inexact floating-point arithmetic (four decimals is arbitrary though)
 
             # (1.3) Construct the data bundle:
-            for r in c.execute('''
-                    SELECT i.i, ml.m, COALESCE(gn.name, g.hash) AS name FROM grp g
-                    INNER JOIN mass_locus ml ON g.id = ml.grp_id
-                    INNER JOIN iter i ON i.id = ml.iter_id
-                    INNER JOIN traj t ON t.id = i.traj_id
-                    LEFT JOIN grp_name gn ON gn.hash = g.hash
-                    WHERE i.traj_id = ? AND i.i BETWEEN ? AND ?
-                    ORDER BY i.i, gn.ord, g.id''', [traj.id, iter_range[0], iter_range[1]]):
-                data.append({ 'grp': r['name'], 'i': r['i'] + 1, 'm': r['m'] })
+            sel = (iters >= iter_range[0]) & (iters <= iter_range[1])
+            data = self._get_mass_locus_data(m[:,sel], grps, iters[sel])
 
             # (1.4) Group sorting (needs to be done here due to Altair's peculiarities):
             sort = [r['name'] for r in c.execute('SELECT name FROM grp_name ORDER BY ord')]
@@ -1555,8 +2349,8 @@ class TrajectoryEnsemble(object):
     def run(self, iter_or_dur=1, is_quiet=False):
         """Run the ensemble.
 
-        The ensemble will be executed on a computational cluster if the cluster info has been associated with it or
-        sequentially otherwise.
+        The ensemble will be executed by the executor if one has been associated with it (a computational cluster
+        info implies the ray executor) or sequentially otherwise.
 
         Args:
             iter_or_dur (int or str): Number of iterations or a string representation of duration (see
@@ -1569,7 +2363,7 @@ class TrajectoryEnsemble(object):
         if iter_or_dur < 1:
             return
 
-        if not self.cluster_inf:
+        if not self.executor:
             return self.run__seq(iter_or_dur, is_quiet)
         else:
             return self.run__par(iter_or_dur, is_quiet)
@@ -1587,28 +2381,39 @@ class TrajectoryEnsemble(object):
 
         ts_sim_0 = Time.ts()
         self.unpersisted_probes = []  # added only for congruency with self.run__par()
-        traj_col = len(str(len(self.traj)))
-        for (i,t) in enumerate(self.traj.values()):
-            if is_quiet:
+        self.traj_queue.extend((t, iter_or_dur) for t in self.traj.values())
+        i = 0
+        while len(self.traj_queue) > 0:  # trajectories forked while running are appended to the queue
+            (t, n_iter) = self.traj_queue.popleft()
+            n_traj = i + 1 + len(self.traj_queue)
+            traj_col = len(str(n_traj))
+            t.sim.set_cb_fork(self.add_fork)
+            if n_iter < 1:
+                pass  # forked on the last iteration; the shared history is all there is
+            elif is_quiet:
                 t.sim.set_cb_save_state(self.save_work)
-                t.run(iter_or_dur)
+                t.run(n_iter)
                 t.sim.set_cb_save_state(None)
             else:
                 # print(f'Running trajectory {i+1} of {len(self.traj)} (iter count: {iter_or_dur}): {t.name or "unnamed simulation"}')
-                with TqdmUpdTo(total=iter_or_dur, miniters=1, desc=f'traj: {i+1:>{traj_col}} of {len(self.traj):>{traj_col}},  iters:{Size.b2h(iter_or_dur, False)}', bar_format='{desc}  |{bar}| {percentage:3.0f}% [{elapsed}<{remaining}, {rate_fmt}{postfix}]', dynamic_ncols=True, ascii=' 123456789.') as pbar:
+                with TqdmUpdTo(total=n_iter, miniters=1, desc=f'traj: {i+1:>{traj_col}} of {n_traj:>{traj_col}},  iters:{Size.b2h(n_iter, False)}', bar_format='{desc}  |{bar}| {percentage:3.0f}% [{elapsed}<{remaining}, {rate_fmt}{postfix}]', dynamic_ncols=True, ascii=' 123456789.') as pbar:
                     t.sim.set_cb_save_state(self.save_work)
                     t.sim.set_cb_upd_progress(lambda i,n: pbar.update_to(i+1))
-                    t.run(iter_or_dur)
+                    t.run(n_iter)
                     t.sim.set_cb_upd_progress(None)
                     t.sim.set_cb_save_state(None)
+            t.sim.set_cb_fork(None)
+            self.upd_mass_locus_stat(t)
+            i += 1
         print(f'Total time: {Time.tsdiff2human(Time.ts() - ts_sim_0)}')
+        self.flush()
         self.save_sims()
         self.is_db_empty = False
         del self.unpersisted_probes
         return self
 
     def run__par(self, iter_or_dur=1, is_quiet=False):
-        """Run the ensemble on a computational cluster.
+        """Run the ensemble in parallel using the associated executor.
 
         Args:
             iter_or_dur (int or str): Number of iterations or a string representation of duration (see
@@ -1620,56 +2425,12 @@ class TrajectoryEnsemble(object):
 
         ts_sim_0 = Time.ts()
         try:
-            ray.init(**self.cluster_inf.get_args())
-
-            n_nodes = len(ray.nodes())
-            n_cpu   = int(ray.cluster_resources()['CPU'])
-            n_traj  = len(self.traj)
-            n_iter  = n_traj * iter_or_dur
-
-            work_collector = WorkCollector.remote(10)
-            progress_mon = ProgressMonitor.remote()
-
-            for t in self.traj.values():
-                t.sim.remote_before()
-            self.probe_persistence.remote_before(work_collector)
-
-            self.unpersisted_probes = []  # probes which have not yet been persisted via self.save_work()
-
-            workers = [Worker(i, t.id, t.sim, iter_or_dur, work_collector, progress_mon) for (i,t) in enumerate(self.traj.values())]
-
-            wait_ids = [start_worker.remote(w) for w in workers]
-            time.sleep(1)  # give workers time to start
-            with TqdmUpdTo(total=n_iter, miniters=1, desc=f'nodes:{n_nodes}  cpus:{n_cpu}  trajs:{n_traj}  iters:{n_traj}×{iter_or_dur}={Size.b2h(n_iter, False)}', bar_format='{desc}  |{bar}| {percentage:3.0f}% [{elapsed}<{remaining}, {rate_fmt}{postfix}]', dynamic_ncols=True, ascii=' 123456789.') as pbar:
-                while len(wait_ids) > 0:
-                    done_id, wait_ids = ray.wait(wait_ids, timeout=0.1)
-
-                    work = ray.get(work_collector.get.remote())
-                    self.save_work(work)
-                    del work
-
-                    pbar.update_to(ray.get(progress_mon.get_i.remote()))
-
-            # Code used previously instead of the progress bar:
-            #     sys.stdout.write('\r')
-            #     sys.stdout.write(ray.get(progress_mon.get_rep.remote()))
-            #     sys.stdout.flush()
-            # sys.stdout.write('\n')
-
-            self.save_work(self.unpersisted_probes)  # save any remaining to-be-persisted probes
-
-            progress_mon.rem_all_workers.remote()
-
-            for t in self.traj.values():
-                t.sim.remote_after()
-            self.probe_persistence.remote_after(self, self.conn)
+            self.executor.run(self, iter_or_dur, is_quiet)
         finally:
-            if self.cluster_inf.get_args().get('address') is None:
-                ray.shutdown()
-            if hasattr(self, 'unpersisted_probes'):
-                del self.unpersisted_probes
+            self.flush()
             print(f'Total time: {Time.tsdiff2human(Time.ts() - ts_sim_0)}')
 
+        self.upd_mass_locus_stat()
         self.save_sims()
         self.is_db_empty = False
         return self
@@ -1706,7 +2467,7 @@ class TrajectoryEnsemble(object):
             self.save_sim(t)
         return self
 
-    def save_iter(self, traj_id, iter, host_name, host_ip, conn):
+    def save_iter(self, traj_id, iter, host_name, host_ip, conn, m_flow=None):
         """Persist the simulation associated with the designated trajectory in the trajectory ensemble database.
 
         Args:
@@ -1715,12 +2476,13 @@ class TrajectoryEnsemble(object):
             host_name (str): Name of host executing the iteration.
             host_ip (str): IP address of host executing the iteration.
             conn (sqlite3.Connection): The SQLite3 connection object.
+            m_flow (float, optional): Total mass transferred in the iteration.
 
         Returns:
             int: Iteration database ID.
         """
 
-        return self._db_ins('INSERT INTO iter (traj_id, i, host_name, host_ip) VALUES (?,?,?,?)', [traj_id, iter, host_name, host_ip], conn)
+        return self._db_ins('INSERT INTO iter (traj_id, i, host_name, host_ip, m_flow) VALUES (?,?,?,?,?)', [traj_id, iter, host_name, host_ip, m_flow], conn)
 
     def save_groups(self, sim, iter_id, conn):
         """Persist all groups of the designated simulation and iteration in the trajectory ensemble database.
@@ -1759,7 +2521,8 @@ class TrajectoryEnsemble(object):
     def save_mass_flow(self, iter_id, mass_flow_specs, conn):
         """Persist the mass flow in the designated simulation and iteration in the trajectory ensemble database.
 
-        Mass flow is present for all but the initial state of a simulation.
+        Mass flow is present for all but the initial state of a simulation.  Mass flow rows are buffered until the next
+        :meth:`~pram.traj.TrajectoryEnsemble.flush()`.
 
         Note:
             This method has to be called *after* either :meth:`~pram.traj.TrajectoryEnsemble.save_mass_locus__seq()` or
@@ -1778,15 +2541,41 @@ class TrajectoryEnsemble(object):
         if mass_flow_specs is None:
             return self
 
+        ids = self.cache.group_hash_to_id
         for mfs in mass_flow_specs:
-            g_src_id = self._db_get_id('grp', f'hash = "{mfs.src.get_hash()}"')
+            g_src_id = ids.get(mfs.src.get_hash())
             for g_dst in mfs.dst:
-                g_dst_id = self._db_get_id('grp', f'hash = "{g_dst.get_hash()}"')
+                self.ins_val.mass_flow.append([iter_id, g_src_id, ids.get(g_dst.get_hash()), g_dst.m, g_dst.m / mfs.m_pop])
 
-                self._db_ins(
-                    'INSERT INTO mass_flow (iter_id, grp_src_id, grp_dst_id, m, m_p) VALUES (?,?,?,?,?)',
-                    [iter_id, g_src_id, g_dst_id, g_dst.m, g_dst.m / mfs.m_pop]
-                )
+        return self
+
+    def save_mass_flow__sparse(self, iter_id, pop_m, mass_flow, conn):
+        """Persist the mass flow given as (source group hash, destination group hash, mass) triplets.
+
+        This is the counterpart of :meth:`~pram.traj.TrajectoryEnsemble.save_mass_flow` for simulations run with the
+        ``sparse`` mass flow recording level (see :meth:`MassFlowSpec.to_sparse() <pram.pop.MassFlowSpec.to_sparse>`).
+        The same ordering note applies.
+
+        Args:
+            iter_id (int or str): Iteration database ID.
+            pop_m (float): Total population mass.
+            mass_flow (tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]): Source group hashes, destination group
+                hashes, and masses.
+            conn (sqlite3.Connection): The SQLite3 connection object.
+
+        Returns:
+            ``self``
+        """
+
+        if mass_flow is None:
+            return self
+
+        ids = self.cache.group_hash_to_id
+        (src, dst, m) = mass_flow
+        self.ins_val.mass_flow.extend([
+            [iter_id, ids.get(h_src), ids.get(h_dst), m_dst, m_dst / pop_m]
+            for (h_src, h_dst, m_dst) in zip(src.tolist(), dst.tolist(), m.tolist())
+        ])
 
         return self
 
@@ -1796,7 +2585,8 @@ class TrajectoryEnsemble(object):
 
         Note:
             This method has to be called *before* :meth:`~pram.traj.TrajectoryEnsemble.save_mass_flow()` to ensure all
-            groups are already present in the database.
+            groups are already present in the database.  Masses are buffered until the next
+            :meth:`~pram.traj.TrajectoryEnsemble.flush()`.
 
         Args:
             pop (GroupPopulation): The group population.
@@ -1807,41 +2597,9 @@ class TrajectoryEnsemble(object):
             ``self``
         """
 
-        # https://stackoverflow.com/questions/198692/can-i-pickle-a-python-dictionary-into-a-sqlite3-text-field
-
         m_pop = pop.get_mass()  # to get proportion of mass flow
-        for g in pop.groups.values():
-            # New group -- persist:
-            if self._db_get_one('SELECT COUNT(*) FROM grp WHERE hash = ?', [str(g.get_hash())], conn) == 0:
-                # for s in g.rel.values():  # sever the 'pop.sim.traj.traj_ens._conn' link (or pickle error)
-                #     s.pop = None
-
-                group_id = conn.execute(
-                    'INSERT INTO grp (hash, attr, rel) VALUES (?,?,?)',
-                    [str(g.get_hash()), DB.obj2blob(g.attr), DB.obj2blob(g.rel)]
-                ).lastrowid
-
-                if self.pragma.memoize_group_ids:
-                    self.cache.group_hash_to_id[g.get_hash()] = group_id
-
-                # for s in g.rel.values():  # restore the link
-                #     s.pop = pop
-
-            # Extant group:
-            else:
-                if self.pragma.memoize_group_ids:
-                    group_id = self.cache.group_hash_to_id.get(g.get_hash())
-                    if group_id is None:  # just a precaution
-                        group_id = self._db_get_id('grp', f'hash = "{g.get_hash()}"', conn=conn)
-                        self.cache.group_hash_to_id[g.get_hash()] = group_id
-                else:
-                    group_id = self._db_get_id('grp', f'hash = "{g.get_hash()}"', conn=conn)
-
-            # Persist the group's mass:
-            conn.execute(
-                'INSERT INTO mass_locus (iter_id, grp_id, m, m_p) VALUES (?,?,?,?)',
-                [iter_id, group_id, g.m, g.m / m_pop]
-            )
+        ids = self._db_get_grp_ids([{ 'hash': g.get_hash(), 'attr': g.attr, 'rel': g.rel } for g in pop.groups.values()], conn)
+        self.ins_val.mass_locus.extend([[iter_id, ids[g.get_hash()], g.m, g.m / m_pop] for g in pop.groups.values()])
 
         return self
 
@@ -1851,7 +2609,8 @@ class TrajectoryEnsemble(object):
 
         Note:
             This method has to be called *before* :meth:`~pram.traj.TrajectoryEnsemble.save_mass_flow()` to ensure all
-            groups are already present in the database.
+            groups are already present in the database.  Masses are buffered until the next
+            :meth:`~pram.traj.TrajectoryEnsemble.flush()`.
 
         Todo:
             Currently, group attributes and relations aren't added to the database.  This is to increase network
@@ -1868,37 +2627,8 @@ class TrajectoryEnsemble(object):
             ``self``
         """
 
-        # https://stackoverflow.com/questions/198692/can-i-pickle-a-python-dictionary-into-a-sqlite3-text-field
-
-        for g in groups:
-            group_hash = g['hash']
-
-            # New group -- persist:
-            if self._db_get_one('SELECT COUNT(*) FROM grp WHERE hash = ?', [str(group_hash)], conn) == 0:
-                # group_id = conn.execute('INSERT INTO grp (hash, attr, rel) VALUES (?,?,?)', [str(group_hash), None, None]).lastrowid
-                group_id = conn.execute(
-                    'INSERT INTO grp (hash, attr, rel) VALUES (?,?,?)',
-                    [str(group_hash), DB.obj2blob(g['attr']), DB.obj2blob(g['rel'])]
-                ).lastrowid
-
-                if self.pragma.memoize_group_ids:
-                    self.cache.group_hash_to_id[group_hash] = group_id
-
-            # Extant group:
-            else:
-                if self.pragma.memoize_group_ids:
-                    group_id = self.cache.group_hash_to_id.get(group_hash)
-                    if group_id is None:  # just a precaution
-                        group_id = self._db_get_id('grp', f'hash = "{group_hash}"', conn=conn)
-                        self.cache.group_hash_to_id[group_hash] = group_id
-                else:
-                    group_id = self._db_get_id('grp', f'hash = "{group_hash}"', conn=conn)
-
-            # Persist the group's mass:
-            conn.execute(
-                'INSERT INTO mass_locus (iter_id, grp_id, m, m_p) VALUES (?,?,?,?)',
-                [iter_id, group_id, g['m'], g['m'] / pop_m]
-            )
+        ids = self._db_get_grp_ids(groups, conn)
+        self.ins_val.mass_locus.extend([[iter_id, ids[g['hash']], g['m'], g['m'] / pop_m] for g in groups])
 
         return self
 
@@ -1929,6 +2659,28 @@ class TrajectoryEnsemble(object):
     #
     #     return self
 
+    def save_params(self, traj, params, conn=None):
+        """Record parameter values the designated trajectory has been simulated with.
+
+        Args:
+            traj (Trajectory): The trajectory.
+            params (Mapping[str,Any]): Parameter names mapped onto values.
+            conn (sqlite3.Connection, optional): The SQLite3 connection object.  If None, the values are committed
+                right away.
+
+        Returns:
+            ``self``
+        """
+
+        qry = 'INSERT OR REPLACE INTO traj_param (traj_id, name, val) VALUES (?,?,?)'
+        args = [(traj.id, k, v.item() if isinstance(v, np.generic) else v) for (k,v) in params.items()]
+        if conn is not None:
+            conn.executemany(qry, args)
+        else:
+            with self.conn as c:
+                c.executemany(qry, args)
+        return self
+
     def save_work(self, work):
         """Persist payload delivered by a remote worker.
 
@@ -1938,6 +2690,15 @@ class TrajectoryEnsemble(object):
             { 'type': 'state', 'host_name': '...', 'host_ip': '...', 'traj_id': 3, 'iter': 4, 'pop_m': 10, 'groups': [...], 'mass_flow_specs': MassFlowSpec(...) }
             { 'type': 'probe', 'qry': '...', 'vals': ['...', ...] }
 
+        The state payload carries either mass flow specs or sparse mass flow triplets (``mass_flow``) depending on the
+        mass flow recording level of the simulation (see :meth:`Simulation.save_state() <pram.sim.Simulation.save_state>`).
+        The total mass transferred (``mass_flow_tot``) is present at all levels and is persisted with the iteration (see
+        :meth:`~pram.traj.TrajectoryEnsemble.get_mass_flow_tot`); at the ``aggr`` level, that is the only mass flow
+        information recorded.
+
+        Rows are written within a transaction that is committed (along with any buffered rows) every ``flush_every``
+        iterations; see :meth:`~pram.traj.TrajectoryEnsemble.flush`.
+
         Args:
             work (Iterable[Mapping[str,Any]]): The payload.
 
@@ -1945,39 +2706,48 @@ class TrajectoryEnsemble(object):
             ``self``
         """
 
-        with self.conn as c:
-            for (i,p) in enumerate(self.unpersisted_probes):
-                try:
-                    c.execute(p['qry'], p['vals'])
-                    del self.unpersisted_probes[i]
-                except sqlite3.IntegrityError:
-                    pass
-
-            for w in work:
-                if w['type'] == 'state':
-                    host_name       = w['host_name']
-                    host_ip         = w['host_ip']
-                    traj_id         = w['traj_id']
-                    iter            = w['iter']
-                    pop_m           = w['pop_m']
-                    groups          = w['groups']
-
-                    if not w.get('mass_flow_specs') is None:
-                        if isinstance(w.get('mass_flow_specs'), list):
-                            mass_flow_specs = w['mass_flow_specs']
-                        else:
-                            mass_flow_specs = pickle.loads(w['mass_flow_specs'])
+        c = self.conn
+        for (i,p) in enumerate(self.unpersisted_probes):
+            try:
+                c.execute(p['qry'], p['vals'])
+                del self.unpersisted_probes[i]
+            except sqlite3.IntegrityError:
+                pass
+
+        for w in work:
+            if w['type'] == 'state':
+                host_name       = w['host_name']
+                host_ip         = w['host_ip']
+                traj_id         = w['traj_id']
+                iter            = w['iter']
+                pop_m           = w['pop_m']
+                groups          = w['groups']
+
+                if not w.get('mass_flow_specs') is None:
+                    if isinstance(w.get('mass_flow_specs'), list):
+                        mass_flow_specs = w['mass_flow_specs']
                     else:
-                        mass_flow_specs = None
+                        mass_flow_specs = pickle.loads(w['mass_flow_specs'])
+                else:
+                    mass_flow_specs = None
 
-                    self.curr_iter_id = self.save_iter(traj_id, iter, host_name, host_ip, c)
+                self.curr_iter_id = self.save_iter(traj_id, iter, host_name, host_ip, c, w.get('mass_flow_tot'))
+                if self.mass_store is None:
                     self.save_mass_locus__par(pop_m, groups, self.curr_iter_id, c)
-                    self.save_mass_flow(self.curr_iter_id, mass_flow_specs, c)
-                elif w['type'] == 'probe':
-                    try:
-                        c.execute(w['qry'], w['vals'])
-                    except sqlite3.IntegrityError:
-                        self.unpersisted_probes.append(s)
+                else:
+                    ids = self._db_get_grp_ids(groups, c)
+                    self.mass_store.append(traj_id, iter, [ids[g['hash']] for g in groups], [g['m'] for g in groups])
+                self.save_mass_flow(self.curr_iter_id, mass_flow_specs, c)
+                self.save_mass_flow__sparse(self.curr_iter_id, pop_m, w.get('mass_flow'), c)
+                self.n_iter_unflushed += 1
+            elif w['type'] == 'probe':
+                try:
+                    c.execute(w['qry'], w['vals'])
+                except sqlite3.IntegrityError:
+                    self.unpersisted_probes.append(w)
+
+        if self.n_iter_unflushed >= self.flush_every:
+            self.flush()
 
         return self
 
@@ -2031,6 +2801,10 @@ class TrajectoryEnsemble(object):
         ensembles share group IDs because they are assumed to contain similar trajectories.  The downside is increased
         memory utilization.
 
+        Note:
+            Group database IDs are now always memoized and this pragma has no effect.  The method is kept for backward
+            compatibility.
+
         Args:
             value (bool): The value.
 
@@ -2048,7 +2822,7 @@ class TrajectoryEnsemble(object):
             ``self``
         """
 
-        iter = [r['i_max'] for r in self.conn.execute('SELECT MAX(i.i) + 1 AS i_max FROM iter i GROUP BY traj_id', [])]
+        iter = [r['i_max'] for r in self.conn.execute('SELECT MAX(i.i) + 1 AS i_max FROM traj_iter i GROUP BY traj_id', [])]
 
         print('Ensemble statistics')
         print(f'    Trajectories')
@@ -2059,6 +2833,265 @@ class TrajectoryEnsemble(object):
 
         return self
 
+    def upd_mass_locus_stat(self, traj=None):
+        """Fold the mass locus of iterations not accounted for yet into the ensemble statistics summary table.
+
+        For every group and iteration, the 'mass_locus_stat' table holds the number of trajectories the group is present
+        in, the mean mass, the sum of squared deviations from the mean, and the minimum and maximum mass.  All of these
+        can be updated one trajectory at a time (Welford's algorithm) so only iterations beyond the last one accounted
+        for (tracked per trajectory in the 'mass_locus_stat_traj' table) need to be read.  Memory use is proportional to
+        the number of groups times the number of iterations being updated.
+
+        This method is called after every trajectory of a sequential run and after a parallel run and does not need
+        to be called explicitly.
+
+        Args:
+            traj (Trajectory, optional): The trajectory.  If None, all trajectories are processed.
+
+        Returns:
+            ``self``
+        """
+
+        self.flush()
+
+        traj_lst = [traj] if traj is not None else list(self.traj.values())
+        i_done = { r['traj_id']: r['i_max'] for r in self.conn.execute('SELECT traj_id, i_max FROM mass_locus_stat_traj') }
+
+        # (1) Identify iterations to be added:
+        upd = []  # (trajectory, first iteration, last iteration)
+        for t in traj_lst:
+            i_max = self._db_get_one('SELECT MAX(i) FROM traj_iter WHERE traj_id = ?', [t.id])
+            if i_max is None:
+                continue
+            i_min = (i_done[t.id] + 1) if t.id in i_done else self._db_get_one('SELECT MIN(i) FROM traj_iter WHERE traj_id = ?', [t.id])
+            if i_min <= i_max:
+                upd.append((t, i_min, i_max))
+        if len(upd) == 0:
+            return self
+
+        # (2) Load the current statistics of the iterations affected:
+        i_lo = min(u[1] for u in upd)
+        i_hi = max(u[2] for u in upd)
+
+        grp_ids = [r[0] for r in self.conn.execute('SELECT id FROM grp ORDER BY id')]
+        grp_idx = np.full(max(grp_ids, default=0) + 1, -1)  # group ID -> row
+        grp_idx[grp_ids] = np.arange(len(grp_ids))
+
+        shape = (len(grp_ids), i_hi - i_lo + 1)
+        n    = np.zeros(shape)
+        mean = np.zeros(shape)
+        m2   = np.zeros(shape)
+        mmin = np.full(shape,  np.inf)
+        mmax = np.full(shape, -np.inf)
+
+        cur = self.conn.cursor()
+        cur.row_factory = None
+        res = np.array(cur.execute('SELECT grp_id, i, n, m_mean, m_m2, m_min, m_max FROM mass_locus_stat WHERE i BETWEEN ? AND ?', [i_lo, i_hi]).fetchall(), dtype=float)
+        if res.size > 0:
+            idx = (grp_idx[res[:,0].astype(int)], res[:,1].astype(int) - i_lo)
+            (n[idx], mean[idx], m2[idx], mmin[idx], mmax[idx]) = res[:,2:].T
+
+        # (3) Fold in the new iterations trajectory by trajectory:
+        for (t, i_min, i_max) in upd:
+            (m, grps, _) = self.get_mass_locus(t, (i_min, i_max))
+            rows = grp_idx[[g['id'] for g in grps]]
+            cols = slice(i_min - i_lo, i_max - i_lo + 1)
+
+            x = np.full((len(grp_ids), i_max - i_min + 1), np.nan)
+            x[rows] = m
+            valid = ~np.isnan(x)
+
+            n_t = n[:,cols] + valid
+            delta = np.where(valid, x - mean[:,cols], 0.0)
+            mean[:,cols] += np.divide(delta, n_t, out=np.zeros_like(delta), where=valid)
+            m2[:,cols]   += delta * np.where(valid, x - mean[:,cols], 0.0)
+            mmin[:,cols]  = np.where(valid, np.fmin(mmin[:,cols], x), mmin[:,cols])
+            mmax[:,cols]  = np.where(valid, np.fmax(mmax[:,cols], x), mmax[:,cols])
+            n[:,cols]     = n_t
+
+        # (4) Persist:
+        (g, i) = np.nonzero(n > 0)
+        with self.conn as c:
+            c.executemany(
+                'INSERT OR REPLACE INTO mass_locus_stat (grp_id, i, n, m_mean, m_m2, m_min, m_max) VALUES (?,?,?,?,?,?,?)',
+                zip(np.asarray(grp_ids)[g].tolist(), (i + i_lo).tolist(), n[g,i].astype(int).tolist(), mean[g,i].tolist(), m2[g,i].tolist(), mmin[g,i].tolist(), mmax[g,i].tolist())
+            )
+            c.executemany('INSERT OR REPLACE INTO mass_locus_stat_traj (traj_id, i_max) VALUES (?,?)', [(t.id, i_max) for (t,_,i_max) in upd])
+
+        return self
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+class ParamSweep(object):
+    """Parameter sweep (e.g., for sensitivity analysis or calibration) over rule parameters of a simulation.
+
+    Every design point is a dict of parameter values and it is simulated as a separate trajectory of a
+    :class:`~pram.traj.TrajectoryEnsemble` with the parameter values recorded alongside (see
+    :meth:`TrajectoryEnsemble.get_params() <pram.traj.TrajectoryEnsemble.get_params>`).  The base simulation (i.e.,
+    rules, probes, and, most importantly, the population) is built by the caller only once.  It is pickled once, sent
+    once to every process of a local process pool, and every design point is simulated on a clone unpickled from it.
+    For sweeps of thousands of points, this avoids building the population thousands of times.
+
+    Parameters are named ``<rule name>.<attribute name>`` and are set as attributes of all rules (and simulation rules)
+    with that name (see :meth:`~pram.traj.ParamSweep.set_params`).  Rules that derive their state from parameters in
+    their constructors need a custom function to apply design points instead.
+
+    Two designs are available:
+
+    - **grid**: The Cartesian product of the values given for every parameter.
+    - **lhs**: Latin hypercube sample of ``n`` points with every parameter given as a (lower bound, upper bound) tuple.
+      The range of every parameter is divided into ``n`` equiprobable strata and every stratum is sampled exactly once.
+
+    Args:
+        sim (Simulation): The base simulation.
+        params (Mapping[str, Iterable]): Parameter names mapped onto values (the 'grid' design) or bounds (the 'lhs'
+            design).
+        design (str): The design; one of ``grid`` or ``lhs``.
+        n (int, optional): Number of design points (the 'lhs' design only).
+        rand_seed (int, optional): Pseudo-random number generator seed.  It is used to sample the 'lhs' design and
+            every design point is simulated with the seed incremented by the point's index so that the sweep is
+            reproducible.
+        fn_set_params (Callable[[Simulation, Mapping[str,Any]], None], optional): Function applying a design point to
+            a simulation clone.  If None, :meth:`~pram.traj.ParamSweep.set_params` is used.
+    """
+
+    DESIGNS = ('grid', 'lhs')
+
+    def __init__(self, sim, params, design='grid', n=None, rand_seed=None, fn_set_params=None):
+        if design not in self.DESIGNS:
+            raise ValueError(f"Unknown design: '{design}' (available: {', '.join(self.DESIGNS)})")
+        if design == 'lhs' and (n is None or n < 1):
+            raise ValueError('The number of design points needs to be a positive integer.')
+
+        self.sim = sim
+        self.params = dict(params)
+        self.design = design
+        self.rand_seed = rand_seed
+        self.fn_set_params = fn_set_params or self.__class__.set_params
+
+        if design == 'grid':
+            self.points = self.gen_grid(self.params)
+        else:
+            self.points = self.gen_lhs(self.params, n, np.random.default_rng(rand_seed))
+
+        self.traj = []  # trajectories of design points (populated by run())
+
+    def __len__(self):
+        return len(self.points)
+
+    @staticmethod
+    def gen_grid(params):
+        """Generate the full factorial (grid) design.
+
+        Args:
+            params (Mapping[str, Iterable]): Parameter names mapped onto values.
+
+        Returns:
+            list[dict[str,Any]]
+        """
+
+        names = list(params.keys())
+        return [dict(zip(names, vals)) for vals in itertools.product(*[list(params[k]) for k in names])]
+
+    @staticmethod
+    def gen_lhs(params, n, rng):
+        """Generate a Latin hypercube design.
+
+        Args:
+            params (Mapping[str, tuple[float,float]]): Parameter names mapped onto (lower bound, upper bound) tuples.
+            n (int): Number of design points.
+            rng (numpy.random.Generator): Pseudo-random number generator.
+
+        Returns:
+            list[dict[str,float]]
+        """
+
+        names = list(params.keys())
+        x = np.empty((n, len(names)))
+        for (j,k) in enumerate(names):
+            (lo, hi) = params[k]
+            x[:,j] = lo + (rng.permutation(n) + rng.random(n)) / n * (hi - lo)
+        return [dict(zip(names, row)) for row in x.tolist()]
+
+    def run(self, ens, iter_or_dur=1, n_procs=None, is_quiet=False):
+        """Simulate all design points.
+
+        Args:
+            ens (TrajectoryEnsemble): The ensemble to add the design points' trajectories to.
+            iter_or_dur (int): Number of iterations.
+            n_procs (int, optional): Number of worker processes.  If None, the number of CPUs is used.
+            is_quiet (bool): Suppress the progress bar?
+
+        Returns:
+            ``self``
+        """
+
+        # (1) Trajectories and parameter values:
+        self.traj = []
+        with ens.conn as c:
+            for p in self.points:
+                t = Trajectory(None)
+                t.set_id(c.execute('INSERT INTO traj (name, memo) VALUES (?,?)', [None, None]).lastrowid)
+                t.ens = ens
+                ens.traj[t.id] = t
+                ens.save_params(t, p, c)
+                self.traj.append(t)
+
+        # (2) Run (the probes of the base simulation persist to the ensemble only for as long as it takes to pickle it):
+        ts_sim_0 = Time.ts()
+        persistence = [p.persistence for p in self.sim.probes]
+
+        try:
+            ens.probe_persistence.remote_before(LocalWorkCollector())
+            ens.unpersisted_probes = []  # probes which have not yet been persisted via ens.save_work()
+
+            for p in self.sim.probes:
+                p.set_persistence(ens.probe_persistence)
+            base = pickle.dumps((self.sim, self.fn_set_params))
+            for (p, pp) in zip(self.sim.probes, persistence):
+                p.persistence = pp
+            args = [(k, t.id, p, None if self.rand_seed is None else self.rand_seed + k, iter_or_dur) for (k, (t,p)) in enumerate(zip(self.traj, self.points))]
+            LocalExecutor(n_procs).run_workers(ens, _start_local_sweep_worker, args, iter_or_dur, is_quiet, base)
+            del base
+
+            ens.save_work(ens.unpersisted_probes)  # save any remaining to-be-persisted probes
+            ens.probe_persistence.remote_after(ens, ens.conn)
+        finally:
+            ens.flush()
+            if hasattr(ens, 'unpersisted_probes'):
+                del ens.unpersisted_probes
+            print(f'Total time: {Time.tsdiff2human(Time.ts() - ts_sim_0)}')
+
+        ens.upd_mass_locus_stat()
+        ens.is_db_empty = False
+        return self
+
+    @staticmethod
+    def set_params(sim, point):
+        """Apply a design point to a simulation by setting attributes of its rules.
+
+        Args:
+            sim (Simulation): The simulation.
+            point (Mapping[str,Any]): Parameter names (``<rule name>.<attribute name>``) mapped onto values.
+
+        Raises:
+            ValueError: If a parameter name is malformed, no rule with the name given exists, or the rule doesn't have
+                the attribute given.
+        """
+
+        for (name, val) in point.items():
+            (rule_name, _, attr) = name.partition('.')
+            if len(rule_name) == 0 or len(attr) == 0:
+                raise ValueError(f"Parameter name needs to have the form '<rule name>.<attribute name>': {name}")
+
+            rules = [r for r in sim.rules + sim.sim_rules if r.name == rule_name]
+            if len(rules) == 0:
+                raise ValueError(f'No rule with the name specified exists: {rule_name}')
+            for r in rules:
+                if not hasattr(r, attr):
+                    raise ValueError(f"Rule '{rule_name}' has no attribute '{attr}'")
+                setattr(r, attr, val)
+
 
 # ----------------------------------------------------------------------------------------------------------------------
 @ray.remote
@@ -2235,6 +3268,8 @@ class Worker(object):
         progress_mon (ProgressMonitor): Progress monitoring actor.
     """
 
+    END_SLEEP_MAX = 2  # max random sleep time at the end of run() [s]
+
     def __init__(self, id, traj_id, sim, n, work_collector=None, progress_mon=None):
         self.id             = id
         self.traj_id        = traj_id
@@ -2329,7 +3364,7 @@ class Worker(object):
         # the progress calculation.  Consequently, workers are removed all at once in TrajectoryEnsemble.run__par().
         # NBD either way.
 
-        time.sleep(random.random() * 2)  # lower the chance of simulations ending at the exact same time (possible for highly similar models)
+        time.sleep(random.random() * self.END_SLEEP_MAX)  # lower the chance of simulations ending at the exact same time (possible for highly similar models)
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -2343,3 +3378,208 @@ def start_worker(w):
 
     w.run()
     return w
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+_local_queue = None  # queue to the head process; set in every process of the local executor's pool
+_local_base  = None  # payload every process of the local executor's pool receives once (see LocalExecutor.run_workers())
+
+
+def _init_local_worker(queue, base=None):
+    """Initialize a process of the :class:`~pram.traj.LocalExecutor` pool.
+
+    Args:
+        queue (multiprocessing.Queue): Queue to the head process.
+        base (bytes, optional): Payload shared by all workers the process will run.
+    """
+
+    global _local_queue, _local_base
+    _local_queue = queue
+    _local_base  = base
+
+
+def _seed_local_worker(rand_seed=None):
+    """Seed the pseudo-random number generators of a process of the :class:`~pram.traj.LocalExecutor` pool.
+
+    Pool processes are forked from the head process and inherit its generators' states.  Unless reseeded, all
+    trajectories run by them would therefore draw the same numbers and replicates of a stochastic simulation would be
+    identical.  If no seed is given, fresh entropy is used.
+
+    Args:
+        rand_seed (int, optional): Pseudo-random number generator seed.
+    """
+
+    random.seed(rand_seed)
+    np.random.seed(rand_seed)
+
+
+def _start_local_worker(w):
+    """Start a local worker.
+
+    The worker is passed serialized with cloudpickle because the standard pickler used by the process pool cannot
+    handle lambdas and closures which simulations (e.g., rules) may hold.  The worker is not returned to the head
+    process to avoid sending the entire simulation back; everything the head process needs has been sent over the
+    queue already.  The final 'done' message tells the head process that all of the worker's payloads have been
+    delivered.
+
+    Args:
+        w (bytes): The pickled :class:`~pram.traj.LocalWorker` object.
+    """
+
+    w = pickle.loads(w)
+    try:
+        _seed_local_worker(w.sim.rand_seed)
+        w.run()
+    finally:
+        _local_queue.put(('done', (w.id,)))
+
+
+def _start_local_sweep_worker(id, traj_id, point, rand_seed, n):
+    """Start a local worker running one design point of a parameter sweep.
+
+    The process has received the pickled base simulation and the function that applies design points to it only once
+    (see :func:`~pram.traj._init_local_worker`); every design point unpickles its own clone of the simulation from
+    it.  That is much cheaper than building the simulation's population anew and much less data to send than a
+    pickled simulation per design point.
+
+    Args:
+        id (int): Worker ID.
+        traj_id (int): Trajectory ensemble database ID of the design point's trajectory.
+        point (Mapping[str,Any]): The design point.
+        rand_seed (int, optional): Pseudo-random number generator seed.  If None, the generators are seeded with fresh
+            entropy (see :func:`~pram.traj._seed_local_worker`).
+        n (int): Number of iterations to run.
+    """
+
+    try:
+        (sim, fn_set_params) = pickle.loads(_local_base)
+        sim.traj_id = traj_id
+        sim.set_rand_seed(rand_seed)
+        if rand_seed is None:
+            _seed_local_worker()
+        sim.set_pragma_analyze(False)
+        fn_set_params(sim, point)
+        sim.remote_before()
+        LocalWorker(id, traj_id, sim, n).run()
+    finally:
+        _local_queue.put(('done', (id,)))
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+class _LocalActorMethod(object):
+    """Stand-in for a ray actor method that forwards the call to the head process via the local executor's queue.
+
+    Args:
+        name (str): Name of the method.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def remote(self, *args):
+        _local_queue.put((self.name, args))
+
+
+class _GroupRef(object):
+    """Group stand-in carrying only what :meth:`TrajectoryEnsemble.save_mass_flow()
+    <pram.traj.TrajectoryEnsemble.save_mass_flow>` needs.
+
+    Args:
+        hash (int): Group's hash.
+        m (float): Group's mass.
+    """
+
+    __slots__ = ('hash', 'm')
+
+    def __init__(self, hash, m):
+        self.hash = hash
+        self.m    = m
+
+    def get_hash(self):
+        return self.hash
+
+
+class LocalWorkCollector(object):
+    """Work collector of the local process-pool executor.
+
+    Mirrors the part of the :class:`~pram.traj.WorkCollector` ray actor API used by workers and probe persistence
+    (i.e., ``save_probe.remote()`` and ``save_state.remote()``) but instead of collecting work it forwards payloads to
+    the head process.
+    """
+
+    def __init__(self):
+        self.save_probe = _LocalActorMethod('probe')
+        self.save_state = _LocalActorMethod('state')
+
+
+class LocalProgressMonitor(object):
+    """Progress monitor of the local process-pool executor.
+
+    Mirrors the part of the :class:`~pram.traj.ProgressMonitor` ray actor API used by workers; progress is aggregated
+    by the head process.
+    """
+
+    def __init__(self):
+        self.add_worker = _LocalActorMethod('add_worker')
+        self.upd_worker = _LocalActorMethod('upd_worker')
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+class LocalWorker(Worker):
+    """Worker run by the local process-pool executor.
+
+    Args:
+        id (int or str): Worker ID.
+        traj_id (int or str): Trajectory ensemble database ID of a trajectory associated with the worker.
+        sim (Simulation): The simulation.
+        n (int): Number of iterations to run.
+    """
+
+    END_SLEEP_MAX = 0  # the head process drains the queue continuously so simultaneous ends are not a concern
+
+    def __init__(self, id, traj_id, sim, n):
+        super().__init__(id, traj_id, sim, n, LocalWorkCollector(), LocalProgressMonitor())
+
+        self.sent_group_hashes = set()  # groups whose attributes and relations the head process has already received
+
+    def do_wait_work(self):
+        """Check if the worker should work or wait.
+
+        The queue to the head process is bounded so sending a payload blocks when the head process falls behind;
+        consequently, the worker can always keep working.
+
+        Returns:
+            bool
+        """
+
+        return True
+
+    def save_state(self, work):
+        """Save simulation state.
+
+        The payload is slimmed down before it is sent to the head process.  Groups in mass flow specs are replaced by
+        their hashes and masses (otherwise, each group would drag the entire population with it) and attributes and
+        relations are sent only the first time a group is encountered (the head process persists them only once).
+
+        Args:
+            work (Iterable[Mapping[str,Any]]): The payload.
+        """
+
+        for w in work:
+            w['host_name'] = self.host_name
+            w['host_ip']   = self.host_ip
+
+            for g in w['groups']:
+                if g['hash'] in self.sent_group_hashes:
+                    g.pop('attr', None)
+                    g.pop('rel',  None)
+                elif 'attr' in g:  # the simulation may have left the definition out already (see the 'mass_flow_rec' pragma)
+                    self.sent_group_hashes.add(g['hash'])
+
+            if w.get('mass_flow_specs') is not None:
+                w['mass_flow_specs'] = [
+                    MassFlowSpec(mfs.m_pop, _GroupRef(mfs.src.get_hash(), mfs.src.m), [_GroupRef(g.get_hash(), g.m) for g in mfs.dst])
+                    for mfs in w['mass_flow_specs']
+                ]
+
+            self.work_collector.save_state.remote(w)
@@ -523,8 +523,9 @@ class Size(object):
     def get_size(obj0):
         ''' https://stackoverflow.com/questions/449560/how-do-i-determine-the-size-of-an-object-in-python/30316760#30316760 '''
 
-        from numbers import Number
-        from collections import Set, Mapping, deque
+        from numbers         import Number
+        from collections     import deque
+        from collections.abc import Set, Mapping
 
         _seen_ids = set()
 
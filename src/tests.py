@@ -1,12 +1,44 @@
 import ast
 import inspect
+import numpy as np
+import tempfile
 import unittest
 
 from collections import Counter
 
-from pram.entity import AttrFluStage, AttrSex, EntityType, Group, Site
-from pram.rule   import Rule, RuleAnalyzerTestRule, TimeInt
-from pram.sim    import RuleAnalyzer
+from pram.data   import GroupSizeProbe
+from pram.entity import AtSiteName, AttrEq, AttrIn, AttrRange, AttrSex, EntityType, Group, GroupQry, GroupSplitSpec, Site
+from pram.pop    import GroupIndex, GroupQryCache
+from pram.rule   import DiscreteInvMarkovChain, ForkRule, GoToRule, GroupMassIncByPropRule, Rule, RuleAnalyzerTestRule, TimeInt
+from pram.sim    import Checkpoint, CompProf, Simulation, SimulationError, StaticRuleAnalyzer
+from pram.traj   import ColumnarMassStore, LocalExecutor, ParamSweep, Trajectory, TrajectoryEnsemble, TrajectoryExecutor
+
+
+class RandomSplitRule(Rule):
+    """Splits every group in two at random; trajectories of a simulation with this rule differ unless seeded."""
+
+    def apply(self, pop, group, iter, t):
+        p = np.random.random()
+        return [GroupSplitSpec(p=p, attr_set={ 'x': 'a' }), GroupSplitSpec(p=1-p, attr_set={ 'x': 'b' })]
+
+
+class ParRandomSplitRule(RandomSplitRule):
+    PAR_SAFE = True
+
+
+class CountingRule(Rule):
+    """Counts the calls of is_applicable() and never splits groups."""
+
+    def __init__(self):
+        super().__init__('counting')
+        self.n = 0
+
+    def apply(self, pop, group, iter, t):
+        return None
+
+    def is_applicable(self, group, iter, t):
+        self.n += 1
+        return super().is_applicable(group, iter, t)
 
 
 class GroupTestCase(unittest.TestCase):
@@ -54,14 +86,26 @@ class GroupTestCase(unittest.TestCase):
         eq(Group(attr={ 'age': 99 }),  Group(attr={ 'age': 99 }))   # same attributes (primitive data types)
 
         eq(Group(attr={ 'sex': AttrSex.F }),        Group(attr={ 'sex': AttrSex.F }))          # same attributes (composite data types)
-        eq(Group(attr={ 'sex': AttrFluStage.NO }), Group(attr={ 'sex': AttrFluStage.NO }))     # same attributes (composite data types)
-        ne(Group(attr={ 'sex': AttrFluStage.NO }), Group(attr={ 'sex': AttrFluStage.SYMPT }))  # different attributes (composite data types)
+        eq(Group(attr={ 'sex': AttrSex.M }),        Group(attr={ 'sex': AttrSex.M }))          # same attributes (composite data types)
+        ne(Group(attr={ 'sex': AttrSex.F }),        Group(attr={ 'sex': AttrSex.M }))          # different attributes (composite data types)
 
         ne(Group(attr={ 'sex': 'f' }), Group(attr={ 'xes': 'f' }))  # different attribute keys
         ne(Group(attr={ 'sex': 'f' }), Group(attr={ 'sex': 'm' }))  # different attribute values
 
         eq(Group(attr={ 'sex': 'f', 'income': 'l' }), Group(attr={ 'income': 'l', 'sex': 'f' }))  # same attributes, different order
 
+    def test_item_hashes(self):
+        eq = self.assertEqual
+        ne = self.assertNotEqual
+
+        ne(Group.gen_hash({ 'x': 1 }), Group.gen_hash({ 'x': 1.0 }))    # values equal in Python but of different types
+        ne(Group.gen_hash({ 'x': 1 }), Group.gen_hash({ 'x': True }))
+        eq(Group.gen_hash({ 'x': [1] }), Group.gen_hash({ 'x': [1] }))  # unhashable values aren't interned
+
+        for i in range(Group.ITEM_HASHES_SIZE + 10):
+            Group.gen_item_hash('i', i)
+        eq(Group._gen_item_hash.cache_info().currsize, Group.ITEM_HASHES_SIZE)  # the intern table is bounded
+
 
 class SiteTestCase(unittest.TestCase):
     def test_comparisons(self):
@@ -71,19 +115,487 @@ class SiteTestCase(unittest.TestCase):
         eq(Site('a'), Site('a'))  # different objects, same name
         ne(Site('a'), Site('b'))  # different objects, different name
 
+    def test_shared_by_simulations(self):
+        eq = self.assertEqual
+
+        home, work = Site('home'), Site('work')
+
+        def sim():
+            return Simulation().add([GoToRule(0.5, 'home', 'work'), Group('g', 1000, rel={ Site.AT: home, 'home': home, 'work': work })])
+
+        s0 = sim().run(3)
+        eq((home.m, work.m), (125.0, 875.0))
+
+        s1 = sim()  # the same sites, new groups; links to groups of the first simulation must not carry over
+        eq((home.m, work.m), (1000.0, 0.0))
+        eq(home.groups, set(s1.pop.groups.values()))
+        eq(work.groups, set())
+
+        s1.run(3)
+        eq((home.m, work.m), (125.0, 875.0))
+        eq(home.groups | work.groups, set(s1.pop.groups.values()))
+
+
+class GroupPredTestCase(unittest.TestCase):
+    def test_evaluation(self):
+        f = self.assertFalse
+        t = self.assertTrue
+
+        g = Group('g', 100, { 'flu': 'i', 'age': 30 })
+
+        t(AttrEq({ 'flu': 'i' })(g))
+        t(AttrIn('flu', ['s', 'i'])(g))
+        f(AttrIn('flu', ['s', 'r'])(g))
+        t(AttrRange('age', 18, 65)(g))
+        f(AttrRange('age', 65)(g))
+        t((AttrEq({ 'flu': 's' }) | AttrRange('age', 18, 65))(g))
+        f((AttrEq({ 'flu': 's' }) & AttrRange('age', 18, 65))(g))
+        t((~AttrEq({ 'flu': 's' }))(g))
+
+    def test_comparisons(self):
+        eq = self.assertEqual
+        ne = self.assertNotEqual
+
+        eq(AttrIn('flu', ['s', 'i']), AttrIn('flu', ['i', 's']))  # different objects, same content
+        ne(AttrIn('flu', ['s', 'i']), AttrIn('flu', ['s', 'r']))  # different content
+        eq(hash(AttrEq({ 'flu': 's' }) | AttrRange('age', 18)), hash(AttrEq({ 'flu': 's' }) | AttrRange('age', 18)))
+
+        eq(GroupQry(cond=[AttrEq({ 'flu': 's' })]), GroupQry(cond=[AttrEq({ 'flu': 's' })]))
+        eq(hash(GroupQry(cond=[AttrEq({ 'flu': 's' })])), hash(GroupQry(cond=[AttrEq({ 'flu': 's' })])))
+
+    def test_index(self):
+        eq = self.assertEqual
+
+        gs = [Group('a', 10, { 'flu': 's', 'age': 20 }), Group('b', 20, { 'flu': 'i', 'age': 40 }), Group('c', 30, { 'flu': 'r', 'age': 70 })]
+        h = { g.name: g.get_hash() for g in gs }
+
+        idx = GroupIndex()
+        for g in gs:
+            idx.add_group(g)
+
+        eq(idx.get_hashes(cond=[AttrEq({ 'flu': 's' })]),                                    { h['a'] })
+        eq(idx.get_hashes(cond=[AttrIn('flu', ['s', 'i'])]),                                 { h['a'], h['b'] })
+        eq(idx.get_hashes(cond=[AttrRange('age', 18, 65)]),                                  { h['a'], h['b'] })
+        eq(idx.get_hashes(cond=[AttrEq({ 'flu': 's' }) | AttrRange('age', 65)]),             { h['a'], h['c'] })
+        eq(idx.get_hashes(cond=[AttrIn('flu', ['s', 'i']) & AttrRange('age', 30)]),          { h['b'] })
+        eq(idx.get_hashes(attr={ 'flu': 'i' }, cond=[AttrRange('age', 18)]),                 { h['b'] })
+        eq(idx.get_hashes(cond=[~AttrEq({ 'flu': 's' })]),                                   None)  # negation can't be answered by the index
+        eq(idx.get_hashes(cond=[lambda g: True]),                                            None)  # neither can lambdas
+
+    def test_pop_get_groups(self):
+        eq = self.assertEqual
+
+        home, work = Site('home'), Site('work')
+        pop = Simulation().pop
+        pop.add_groups([
+            Group('a', 10, { 'flu': 's', 'age': 20 }, { Site.AT: home, 'home': home }),
+            Group('b', 20, { 'flu': 'i', 'age': 40 }, { Site.AT: work, 'home': home }),
+            Group('c', 30, { 'flu': 'r', 'age': 70 }, { Site.AT: home, 'home': home })
+        ])
+
+        def names(qry):
+            return sorted(g.name for g in pop.get_groups(qry))
+
+        eq(names(GroupQry(cond=[AttrIn('flu', ['s', 'i'])])),                  ['a', 'b'])
+        eq(names(GroupQry(cond=[~AttrEq({ 'flu': 's' })])),                    ['b', 'c'])
+        eq(names(GroupQry(cond=[AtSiteName('home')])),                         ['a', 'c'])
+        eq(names(GroupQry(attr={ 'flu': 'r' }, cond=[AtSiteName('home')])),    ['c'])
+        eq(names(GroupQry(cond=[AttrRange('age', 18, 65), lambda g: g.m > 15])), ['b'])
+        eq(pop.get_groups_mass(GroupQry(cond=[AttrRange('age', 18, 65)])),      30.0)
+
+
+class GroupQryCacheTestCase(unittest.TestCase):
+    def test_invalidation(self):
+        eq = self.assertEqual
+
+        home = Site('home')
+        g_s = Group('s', 10, { 'flu': 's' })
+        g_i = Group('i', 20, { 'flu': 'i' })
+
+        c = GroupQryCache()
+        c.put('s',    10, GroupQry(attr={ 'flu': 's' }),              [g_s])
+        c.put('i',    20, GroupQry(attr={ 'flu': 'i' }),              [g_i])
+        c.put('lmbd', 30, GroupQry(cond=[lambda g: g.m > 0]),         [g_s, g_i])
+        c.put('pred', 10, GroupQry(cond=[AttrIn('flu', ['s', 'r'])]), [g_s])
+        c.put('home',  0, None,                                       [], home.get_hash())
+
+        g_new = Group('s.2', 5, { 'flu': 's' })
+        eq(c._get_idx_candidates(g_new), { 's', 'lmbd', 'pred' })  # not matched against 'i' and 'home'
+
+        c.add_group(g_new)
+        eq(c.get('i'), 20)  # changes are applied on access
+        eq(set(c.entries.keys()), { 'i', 'home' })
+
+        c.add_group(Group('r', 5, { 'flu': 'r' }, { Site.AT: home.get_hash() }))  # as in a population
+        eq(c.get('home'), None)
+        eq(set(c.entries.keys()), { 'i' })
+
+        c.upd_mass([g_i.get_hash()])
+        eq(c.get('i'), None)
+        eq(len(c.idx), 0)
+
+
+class RuleApplicationTestCase(unittest.TestCase):
+    TM = { 's': [0.95, 0.05, 0.00], 'i': [0.00, 0.80, 0.20], 'r': [0.10, 0.00, 0.90] }
+
+    def sim(self, *rules):
+        return Simulation().add(list(rules) + [Group(f'g.{x}', 1000, { 'flu': x }) for x in 'sir'])
+
+    def test_applicability_checked_once(self):
+        r = CountingRule()
+        self.sim(DiscreteInvMarkovChain('flu', self.TM), r).run(2)
+        self.assertEqual(r.n, 2 * 3)  # once per group per iteration
+
+    def test_group_qry_changed_between_runs(self):
+        class InfectRule(Rule):
+            def apply(self, pop, group, iter, t):
+                return [GroupSplitSpec(p=1.0, attr_set={ 'flu': 'i' })]
+
+        r = InfectRule('infect', group_qry=GroupQry(attr={ 'age': 30 }))
+        s = Simulation().add([r, Group('g.30', 1000, { 'flu': 's', 'age': 30 }), Group('g.40', 1000, { 'flu': 's', 'age': 40 })])
+
+        def get_flu():
+            return { g.get_attr('age'): g.get_attr('flu') for g in s.pop.groups.values() }
+
+        s.run(1)
+        self.assertEqual(get_flu(), { 30: 'i', 40: 's' })
+
+        r.group_qry = GroupQry(attr={ 'age': 40 })  # the rule-group compatibility table must not go stale
+        s.run(1)
+        self.assertEqual(get_flu(), { 30: 'i', 40: 'i' })
+
+    def test_matrix_path_respects_instance_apply(self):
+        eq = self.assertEqual
+
+        r = DiscreteInvMarkovChain('flu', self.TM)
+        self.assertIsNotNone(r.get_transition_matrix())
+
+        prof = CompProf()
+        s = self.sim(r)
+        s.set_prof(prof)
+        s.run(2)
+        eq({ x['frame']: x['n'] for x in prof.get_report() }.get('rule DiscreteInvMarkovChain(markov-chain).apply'), 2 * 3)
+        self.assertIsNotNone(r.get_transition_matrix())  # the profiler's wrapper is gone after the run
+
+        m0 = sorted((g.get_attr('flu'), g.m) for g in self.sim(DiscreteInvMarkovChain('flu', self.TM)).run(2).pop.groups.values())
+        m1 = sorted((g.get_attr('flu'), g.m) for g in s.pop.groups.values())
+        eq(m0, m1)  # the batched and per-group paths agree
+
+    def test_split_mass_rounding(self):
+        # Combinations (a,b) and (b,b) lead to group x=b; (a,a) and (b,a) to group x=a.  The masses of the four
+        # combinations are 0.36, 1.44, 1.44, and 5.76.  Rounded separately they yield (x=a: 8, x=b: 1) while rounding
+        # the merged masses 7.2 and 1.8 would yield (x=a: 7, x=b: 2).
+        ss_rules = [
+            [GroupSplitSpec(p=0.2, attr_set={ 'x': 'a' }), GroupSplitSpec(p=0.8, attr_set={ 'x': 'b' })],
+            [GroupSplitSpec(p=0.2, attr_set={ 'x': 'b' }), GroupSplitSpec(p=0.8, attr_set={ 'x': 'a' })]
+        ]
+
+        def split(is_mass_frac):
+            s = self.sim(CountingRule()).set_pragma_fractional_mass(is_mass_frac)
+            g = s.pop.groups[Group.gen_hash(attr={ 'flu': 's' })]
+            g.m = 9
+            m = Counter()
+            for g_ in g._apply_rules__split(ss_rules):
+                m[g_.get_attr('x')] += g_.m
+            return m
+
+        self.assertEqual(split(False), { 'a': 8, 'b': 1 })
+        m = split(True)
+        self.assertAlmostEqual(m['a'], 7.2)
+        self.assertAlmostEqual(m['b'], 1.8)
+
+    def test_split_merge(self):
+        # The four combinations lead to only two destinations; the zero-probability spec (x=c) leads nowhere.
+        ss_rules = [
+            [GroupSplitSpec(p=0.2, attr_set={ 'x': 'a' }), GroupSplitSpec(p=0.0, attr_set={ 'x': 'c' }), GroupSplitSpec(p=0.8, attr_set={ 'x': 'b' })],
+            [GroupSplitSpec(p=0.2, attr_set={ 'x': 'b' }), GroupSplitSpec(p=0.8, attr_set={ 'x': 'a' })]
+        ]
+
+        def split(is_mass_frac):
+            s = self.sim(CountingRule()).set_pragma_fractional_mass(is_mass_frac)
+            g = s.pop.groups[Group.gen_hash(attr={ 'flu': 's' })]
+            g.m = 9
+            return [g_.get_attr('x') for g_ in g._apply_rules__split(ss_rules)]
+
+        x = split(True)
+        self.assertEqual(sorted(x), ['a', 'b'])
+
+        x = split(False)
+        self.assertGreater(len(x), 2)
+        self.assertNotIn('c', x)
+
+    def test_prof_detached_on_error(self):
+        class FailingRule(CountingRule):
+            def apply(self, pop, group, iter, t):
+                raise RuntimeError()
+
+        r = FailingRule()
+        s = self.sim(r)
+        s.set_prof(CompProf())
+        with self.assertRaises(RuntimeError):
+            s.run(2)
+        self.assertNotIn('apply', vars(r))
+        self.assertNotIn('is_applicable', vars(r))
+        self.assertIsNone(s.pop.instr)
+
+
+class ParApplyRulesTestCase(unittest.TestCase):
+    @staticmethod
+    def get_masses(sim):
+        return sorted((repr(sorted(g.attr.items())), repr(sorted(g.rel.items())), round(g.m, 9)) for g in sim.pop.groups.values())
+
+    def sim_goto(self, n_procs):
+        sites = { s: Site(s) for s in ['home', 'work', 'store'] }
+        s = Simulation()
+        s.set_pragma_par_apply_rules(n_procs)
+        s.add([
+            GoToRule(0.4, 'home', 'work'),
+            GoToRule(0.3, 'work', 'store'),
+            GoToRule(0.5, 'store', 'home')
+        ])
+        s.add([Group(f'g.{i}', 100 * (i + 1), { 'i': i }, { Site.AT: sites['home'], 'home': sites['home'], 'work': sites['work'], 'store': sites['store'] }) for i in range(5)])
+        return s
+
+    def test_matches_seq(self):
+        pools = set()
+        s = self.sim_goto(3)
+        s.set_cb_after_iter(lambda sim: pools.add(id(sim.pop.par_pool)))
+        s.run(6)
+
+        self.assertEqual(self.get_masses(s), self.get_masses(self.sim_goto(0).run(6)))
+        self.assertEqual(len(pools), 1)     # one pool for the entire run
+        self.assertIsNone(s.pop.par_pool)  # stopped at the end of the run
+
+    def test_unsafe_rules(self):
+        def sim(n_procs):
+            s = Simulation()
+            s.set_pragma_par_apply_rules(n_procs)
+            return s.add([GroupMassIncByPropRule(0.1), Group('g.0', 100, { 'x': 0 }), Group('g.1', 300, { 'x': 1 })]).run(3)
+
+        self.assertFalse(GroupMassIncByPropRule.PAR_SAFE)  # adds VITA groups so must not run in workers
+        self.assertEqual(sim(2).pop.get_mass(), sim(0).pop.get_mass())
+
+    def test_shard_seeds(self):
+        def sim(rand_seed):
+            s = Simulation(rand_seed=rand_seed)
+            s.set_pragma_par_apply_rules(2)
+            return s.add([ParRandomSplitRule('r'), Group('g.0', 1000, { 'k': 0, 'x': 'a' }), Group('g.1', 1000, { 'k': 1, 'x': 'a' })]).run(1)
+
+        m = { g.get_attr('k'): g.m for g in sim(1).pop.groups.values() if g.get_attr('x') == 'a' }
+        self.assertNotEqual(m[0], m[1])  # the two shards draw different numbers
+        self.assertEqual(self.get_masses(sim(1)), self.get_masses(sim(1)))  # and are reproducible
+
 
 class RuleAnalyzerTestCase(unittest.TestCase):
+    TM = { 's': [0.95, 0.05, 0.00], 'i': [0.00, 0.80, 0.20], 'r': [0.10, 0.00, 0.90] }
+
+    def get_attr_names(self, *probes):
+        s = Simulation().set_pragma_autoprune_groups(True)
+        s.add([DiscreteInvMarkovChain('flu', self.TM), *probes, Group('g', 1000, { 'flu': 's', 'age': 30 })]).run(3)
+        return { k for g in s.pop.groups.values() for k in g.attr.keys() }
+
+    def test_autoprune_groups(self):
+        self.assertEqual(self.get_attr_names(), { 'flu' })  # conclusive static analysis; pruned before the run
+
+        # A lambda condition makes the static analysis inconclusive.  The dynamic analysis finds 'age' unused but the
+        # groups must not be pruned after the run based on it:
+        p = GroupSizeProbe('p', [GroupQry(cond=[lambda g: g.m > 0])])
+        self.assertEqual(self.get_attr_names(p), { 'flu', 'age' })
+
     def test_the_test_rule(self):
         eq = self.assertEqual
         ne = self.assertNotEqual
 
-        ra = RuleAnalyzer()
+        ra = StaticRuleAnalyzer()
         ra.analyze_rule(RuleAnalyzerTestRule())
 
         eq(ra.attr_used, {'flu-stage', 'a04', 'a05', 'a02', 'a03', 'a01'})                     # attributes deduced
         eq(ra.rel_used, {'r01', 'r03', 'r02', 'r05', 'r04'})                                   # relations  deduced
         eq(ra.cnt_rec, Counter({'has_attr': 8, 'has_rel': 5, 'get_attr': 0, 'get_rel': 0}))    # counts of recognized
-        eq(ra.cnt_unrec, Counter({'has_attr': 8, 'has_rel': 8, 'get_attr': 0, 'get_rel': 0}))  # counts of unrecognized
+        eq(ra.cnt_unrec, Counter({'has_attr': 10, 'has_rel': 10, 'get_attr': 0, 'get_rel': 0}))  # counts of unrecognized
+
+
+class CheckpointTestCase(unittest.TestCase):
+    class Kill(Exception): pass
+
+    @staticmethod
+    def sim():
+        return Simulation().add([RandomSplitRule('r'), DiscreteInvMarkovChain('flu', RuleApplicationTestCase.TM), Group('g', 1000, { 'flu': 's', 'x': 'a' })])
+
+    @staticmethod
+    def get_masses(sim):
+        return sorted((g.get_attr('flu'), g.get_attr('x'), g.m) for g in sim.pop.groups.values())
+
+    def test_resume(self):
+        def kill(sim):
+            if sim.timer.i == 8:
+                raise self.Kill()
+
+        np.random.seed(1)
+        m = self.get_masses(self.sim().run(12))  # uninterrupted run
+
+        with tempfile.TemporaryDirectory() as dpath:
+            np.random.seed(1)
+            s = self.sim().set_checkpoint(Checkpoint(dpath, every=3, full_every=2)).set_cb_after_iter(kill)
+            with self.assertRaises(self.Kill):
+                s.run(12)
+
+            np.random.seed(7)  # the generators' states are restored from the checkpoint
+            s = self.sim().resume(Checkpoint(dpath, every=3, full_every=2))
+
+        self.assertEqual(s.timer.i, 12)
+        self.assertEqual(self.get_masses(s), m)
+
+
+class MassFlowRecTestCase(unittest.TestCase):
+    @staticmethod
+    def run_ens(mass_flow_rec):
+        ens = TrajectoryEnsemble()
+        ens.add_trajectory(Trajectory(Simulation(rand_seed=1).set_pragma_mass_flow_rec(mass_flow_rec).add([RandomSplitRule('r'), DiscreteInvMarkovChain('flu', RuleApplicationTestCase.TM), Group('g', 1000, { 'flu': 's', 'x': 'a' })])))
+        ens.run(4, is_quiet=True)
+
+        # Groups are identified by hash because their IDs differ between databases:
+        ml = sorted(tuple(r) for r in ens.conn.execute('SELECT i.i, g.hash, ml.m FROM mass_locus ml INNER JOIN iter i ON i.id = ml.iter_id INNER JOIN grp g ON g.id = ml.grp_id'))
+        mf = sorted(tuple(r) for r in ens.conn.execute('SELECT i.i, gs.hash, gd.hash, mf.m FROM mass_flow mf INNER JOIN iter i ON i.id = mf.iter_id INNER JOIN grp gs ON gs.id = mf.grp_src_id INNER JOIN grp gd ON gd.id = mf.grp_dst_id'))
+        return (ml, mf, ens.get_mass_flow_tot(next(iter(ens.traj.values()))).tolist())
+
+    def test_levels(self):
+        eq = self.assertEqual
+
+        (ml, mf, m_flow) = self.run_ens('full')
+        eq([i for (i,m) in m_flow], [0, 1, 2, 3])  # one total per iteration (none for the initial state)
+        self.assertTrue(all(m > 0 for (i,m) in m_flow))
+
+        eq(self.run_ens('sparse'), (ml, mf, m_flow))  # the sparse encoding loses nothing
+
+        (ml_aggr, mf_aggr, m_flow_aggr) = self.run_ens('aggr')
+        eq(ml_aggr, ml)
+        eq(mf_aggr, [])                                     # no flow between groups...
+        eq(m_flow_aggr, m_flow)                             # ...but its totals
+
+
+class EnsembleTestCase(unittest.TestCase):
+    @staticmethod
+    def run_ens(n_traj=3, n_iter=5, mass_store=None):
+        ens = TrajectoryEnsemble(mass_store=mass_store)
+        ens.add_trajectories([Trajectory(Simulation(rand_seed=k).add([RandomSplitRule('r'), DiscreteInvMarkovChain('flu', RuleApplicationTestCase.TM), Group('g', 1000, { 'flu': 's', 'x': 'a' })])) for k in range(n_traj)])
+        ens.run(n_iter, is_quiet=True)
+        return ens
+
+    def test_mass_store(self):
+        ens = self.run_ens()
+        (m, grps, iters) = ens.get_mass_locus()
+
+        with tempfile.TemporaryDirectory() as dpath:
+            ens_ms = self.run_ens(mass_store=ColumnarMassStore(dpath))
+            (m_ms, grps_ms, iters_ms) = ens_ms.get_mass_locus()
+            self.assertEqual(ens_ms.conn.execute('SELECT COUNT(*) FROM mass_locus').fetchone()[0], 0)  # nothing in the table...
+
+        self.assertEqual([tuple(g) for g in grps_ms], [tuple(g) for g in grps])
+        self.assertEqual(iters_ms.tolist(), iters.tolist())
+        self.assertTrue(np.array_equal(m_ms, m, equal_nan=True))  # ...and yet the same mass locus
+
+    def test_mass_locus_stat(self):
+        ens = self.run_ens()  # the statistics are updated after every trajectory of a sequential run
+        (m, grps, iters) = ens.get_mass_locus()
+        stat = ens.get_mass_locus_stat()
+
+        self.assertEqual([tuple(g) for g in stat['grps']], [tuple(g) for g in grps])
+        self.assertEqual(stat['iters'].tolist(), iters.tolist())
+        self.assertEqual(stat['n'].tolist(), (~np.isnan(m)).sum(axis=2).tolist())
+
+        full = stat['n'] == m.shape[2]  # groups present in all trajectories
+        self.assertTrue(full.any())
+        np.testing.assert_allclose(stat['mean'][full], np.mean(m, axis=2)[full])
+        np.testing.assert_allclose(stat['sd'][full],   np.std(m, axis=2, ddof=1)[full])
+        np.testing.assert_allclose(stat['min'][full],  np.min(m, axis=2)[full])
+        np.testing.assert_allclose(stat['max'][full],  np.max(m, axis=2)[full])
+        self.assertTrue(np.isnan(stat['mean'][stat['n'] == 0]).all())
+
+    def test_agent_paths(self):
+        ens = TrajectoryEnsemble()
+        ens.add_trajectory(Trajectory(Simulation(rand_seed=1).add([DiscreteInvMarkovChain('flu', RuleApplicationTestCase.TM), Group('s', 300, { 'flu': 's' }), Group('i', 700, { 'flu': 'i' })])))
+        ens.run(5, is_quiet=True)
+        traj = next(iter(ens.traj.values()))
+
+        np.random.seed(1)
+        (paths, grps) = ens.gen_agent_paths(traj, 10000)
+        i_max = ens.conn.execute('SELECT MAX(i) FROM traj_iter WHERE traj_id = ?', [traj.id]).fetchone()[0]
+        self.assertEqual(paths.shape, (10000, i_max + 1))  # the initial group and one per iteration up to the last one
+        self.assertEqual(ens.gen_agent_paths(traj, 10, 2)[0].shape, (10, 3))
+
+        # Initial groups are distributed as the initial mass:
+        m0 = dict(ens.conn.execute('SELECT ml.grp_id, ml.m FROM mass_locus ml INNER JOIN traj_iter i ON i.id = ml.iter_id WHERE i.traj_id = ? AND i.i = -1', [traj.id]).fetchall())
+        n0 = Counter(grps[j]['id'] for j in paths[:,0])
+        self.assertEqual(set(n0), set(m0))
+        for (grp_id, m) in m0.items():
+            self.assertAlmostEqual(n0[grp_id] / paths.shape[0], m / sum(m0.values()), delta=0.02)
+
+        # Agents only move along the mass flow:
+        flow = set(tuple(r) for r in ens.conn.execute('SELECT grp_src_id, grp_dst_id FROM mass_flow'))
+        for (src, dst) in set(zip(paths[:,:-1].ravel().tolist(), paths[:,1:].ravel().tolist())):
+            if src != dst:
+                self.assertIn((grps[src]['id'], grps[dst]['id']), flow)
+
+
+class TrajectoryExecutorTestCase(unittest.TestCase):
+    @staticmethod
+    def run_ens(rand_seed, n_traj=3, n_iter=5):
+        ens = TrajectoryEnsemble(executor=LocalExecutor(n_procs=n_traj))
+        ens.add_trajectories([Trajectory(Simulation(rand_seed=rand_seed).add([RandomSplitRule('r'), Group('g', 1000, { 'x': 'a' })])) for _ in range(n_traj)])
+        ens.run(n_iter, is_quiet=True)
+        return [tuple(ens.get_mass_locus(t)[0][-1].tolist()[1:]) for t in ens.traj.values()]
+
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            TrajectoryExecutor()
+
+    def test_fork(self):
+        def ens(executor):
+            ens = TrajectoryEnsemble(executor=executor)
+            ens.add_trajectory(Trajectory(Simulation().add([RandomSplitRule('r'), ForkRule(2, { 'b': None }), Group('g', 1000, { 'x': 'a' })])))
+            return ens
+
+        self.assertEqual(len(ens(None).run(4, is_quiet=True).traj), 2)  # sequential runs turn branches into trajectories
+        with self.assertRaises(SimulationError):
+            ens(LocalExecutor(n_procs=1)).run(4, is_quiet=True)  # executors would lose them
+
+    def test_local_replicates(self):
+        eq = self.assertEqual
+
+        eq(len(set(self.run_ens(None))), 3)  # unseeded replicates differ
+        eq(len(set(self.run_ens(1))),    1)  # seeded replicates are identical
+
+
+class ParamSweepTestCase(unittest.TestCase):
+    @staticmethod
+    def sim():
+        return Simulation().add([RandomSplitRule('r'), Group('g', 1000, { 'x': 'a' })])
+
+    def test_run(self):
+        eq = self.assertEqual
+
+        s = self.sim()
+        analyze = s.get_pragma_analyze()
+
+        ens = TrajectoryEnsemble()
+        sw = ParamSweep(s, { 'r.memo': ['a', 'b'] }).run(ens, 3, n_procs=2, is_quiet=True)
+
+        eq(len(sw.traj), 2)
+        eq(len(set(tuple(ens.get_mass_locus(t)[0][-1].tolist()[1:]) for t in sw.traj)), 2)  # unseeded points differ
+        eq(s.get_pragma_analyze(), analyze)  # the base simulation is left as is
+
+    def test_set_params(self):
+        s = self.sim()
+        ParamSweep.set_params(s, { 'r.memo': 'x' })
+        self.assertEqual(s.rules[0].memo, 'x')
+
+        with self.assertRaises(ValueError):
+            ParamSweep.set_params(s, { 'r.memmo': 'x' })  # no such attribute
+        with self.assertRaises(ValueError):
+            ParamSweep.set_params(s, { 'rr.memo': 'x' })  # no such rule
+        with self.assertRaises(ValueError):
+            ParamSweep.set_params(s, { 'r': 'x' })        # malformed name
 
 
 # class SimulationTestCase(unittest.TestCase):